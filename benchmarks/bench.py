@@ -0,0 +1,285 @@
+'''
+pyelixhauser benchmark suite
+
+scores synthetic claims with every scheme and writes the timings as json, so
+runs of different versions of the package can be compared
+
+the claims are generated from the bundled reference csv files: each record is
+a ', ' separated string of codes sampled from a pool, the pool is either a
+small set of real codes (low cardinality) or every real code plus synthetic
+codes in the same format that do not map to a comorbity (high cardinality)
+
+measured per case
+    seconds, records_per_second and codes_per_second (best of --repeat runs)
+    peak_memory_bytes (tracemalloc peak of a separate run)
+and per module the time to import it (after numpy and pandas) and to load its reference tables,
+each in a fresh interpreter
+
+run it with the version of the package to measure installed (or with PYTHONPATH pointing at it)
+
+example usage:
+python benchmarks/bench.py -o bench.json
+python benchmarks/bench.py --schemes cmr2022 --sizes 1000 100000 --repeat 5 -o new.json
+python benchmarks/bench.py --compare old.json new.json
+'''
+
+import argparse
+import gc
+import json
+import os
+import platform
+import re
+import subprocess
+import sys
+import time
+import timeit
+import tracemalloc
+import numpy as np
+import pandas as pd
+import pyelixhauser
+
+_resource_dir = os.path.join(os.path.dirname(os.path.abspath(pyelixhauser.__file__)), 'resources')
+
+# scheme -> (module, functions benchmarked, the first one is the public array api every version has)
+_schemes = {
+    'cci': ('cci', ['cci_from_array', 'cci_matrix']),
+    'icd9cm': ('icd9cm', ['comorbidity_from_array', 'comorbidity_matrix']),
+    'icd10cm': ('icd10cm', ['comorbidity_from_array', 'comorbidity_matrix']),
+    'cmr2022': ('icd10cm_cmr_v2022', ['comorbidity_from_array', 'comorbidity_matrix']),
+}
+_sizes = [1, 1000, 100000, 10000000]
+# codes per record, drawn uniformly from [low, high]
+_codes_per_record = {'few': (1, 5), 'many': (20, 40)}
+_low_cardinality = 100
+_synthetic_codes = 100000
+
+
+def _read_resource(name):
+    '''
+    internal function to read a bundled reference file as text
+    '''
+    with open(os.path.join(_resource_dir, name), encoding='utf-8', errors='replace') as f:
+        return f.read()
+
+
+def reference_codes(scheme):
+    '''
+    reference_codes
+    function to extract the real codes of a scheme from its bundled reference csv
+    param scheme: string, one of 'cci', 'icd9cm', 'icd10cm', 'cmr2022'
+    return list of distinct codes, formatted the way they appear in claims
+    '''
+    if scheme == 'cci':
+        codes = re.findall(r"^'\s*(V?[0-9]{3,5})\s*'", _read_resource('cci2015.csv'), flags=re.MULTILINE)
+    elif scheme == 'icd9cm':
+        codes = re.findall(r'\b(V?[0-9]{3}(?:\.[0-9]{1,2})?)\b', _read_resource('icd9cm_elixhauser.csv'))
+    elif scheme == 'icd10cm':
+        codes = re.findall(r'\b([A-Z][0-9]{2}(?:\.[0-9]{1,4})?)\b', _read_resource('icd10_elixhauser.csv'))
+    elif scheme == 'cmr2022':
+        lines = _read_resource('CMR-Reference-File-v2022-1.csv').splitlines()[2:]
+        codes = [line.split('\t', 1)[0] for line in lines if line.strip()]
+        codes = [code[:3] + '.' + code[3:] if len(code) > 3 else code for code in codes]
+    else:
+        raise ValueError(F'unknown scheme {scheme!r}, expected one of {list(_schemes)}')
+    return list(dict.fromkeys(codes))
+
+
+def synthetic_codes(scheme, n, rng):
+    '''
+    synthetic_codes
+    function to generate codes in the format of a scheme, most of them do not map to a comorbity
+    param scheme: string, one of 'cci', 'icd9cm', 'icd10cm', 'cmr2022'
+    param n: int, number of codes
+    param rng: numpy random generator
+    return list of codes
+    '''
+    numbers = rng.integers(0, 100000, size=n)
+    if scheme == 'cci':
+        return [F'{number:05d}' for number in numbers]
+    if scheme == 'icd9cm':
+        return [F'{number // 100:03d}.{number % 100:02d}' for number in numbers]
+    letters = rng.integers(0, 26, size=n)
+    return [F'{chr(65 + letter)}{number // 1000:02d}.{number % 1000}' for letter, number in zip(letters, numbers)]
+
+
+def code_pool(scheme, cardinality, rng):
+    '''
+    code_pool
+    function to build the pool the codes of the synthetic claims are sampled from
+    param scheme: string, one of 'cci', 'icd9cm', 'icd10cm', 'cmr2022'
+    param cardinality: string, 'low' (a few real codes) or 'high' (all real codes plus synthetic ones)
+    param rng: numpy random generator
+    return numpy object array of distinct codes
+    '''
+    codes = reference_codes(scheme)
+    if cardinality == 'low':
+        return rng.choice(np.array(codes, dtype=object), size=min(_low_cardinality, len(codes)), replace=False)
+    codes = codes + synthetic_codes(scheme, _synthetic_codes, rng)
+    return np.array(list(dict.fromkeys(codes)), dtype=object)
+
+
+def generate_records(pool, n_records, codes_per_record, rng):
+    '''
+    generate_records
+    function to generate synthetic claims
+    param pool: numpy object array of codes
+    param n_records: int
+    param codes_per_record: tuple (low, high), number of codes of a record is drawn uniformly from it
+    param rng: numpy random generator
+    return tuple (list of ', ' separated strings of codes, total number of codes)
+    '''
+    low, high = codes_per_record
+    lengths = rng.integers(low, high + 1, size=n_records)
+    codes = pool[rng.integers(0, len(pool), size=int(lengths.sum()))].tolist()
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).tolist()
+    records = [', '.join(codes[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+    return records, len(codes)
+
+
+def _time_call(func, records, repeat):
+    '''
+    internal function to time one call of func, best of repeat runs
+    small inputs are called in a loop (timeit autorange) to get above the timer resolution
+    '''
+    timer = timeit.Timer(lambda: func(records))
+    number, _ = timer.autorange()
+    return min(timer.repeat(repeat=repeat, number=number)) / number
+
+
+def _peak_memory(func, records):
+    '''
+    internal function to measure the peak memory allocated during one call of func
+    '''
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func(records)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def startup_times(module):
+    '''
+    startup_times
+    function to measure the import time (after numpy and pandas) and the reference table load time
+    of a module in a fresh interpreter, with the compiled table cache disabled (cold) and enabled (warm)
+    param module: string, module name
+    return dict
+    '''
+    script = ('import time, importlib\n'
+              't = time.perf_counter()\n'
+              'import numpy, pandas\n'
+              't_dependencies = time.perf_counter() - t\n'
+              't = time.perf_counter()\n'
+              F'module = importlib.import_module("pyelixhauser.{module}")\n'
+              't_import = time.perf_counter() - t\n'
+              't = time.perf_counter()\n'
+              'module.warmup() if hasattr(module, "warmup") else None\n'
+              'print(t_dependencies, t_import, time.perf_counter() - t)\n')
+    results = {}
+    for label, cache_dir in (('cold', ''), ('warm', None)):
+        env = dict(os.environ)
+        if cache_dir is not None:
+            env['PYELIXHAUSER_CACHE_DIR'] = cache_dir
+        subprocess.run([sys.executable, '-c', script], env=env, check=True, capture_output=True)
+        output = subprocess.run([sys.executable, '-c', script], env=env, check=True, capture_output=True, text=True)
+        dependencies_seconds, import_seconds, load_seconds = map(float, output.stdout.split())
+        results.setdefault('numpy_pandas_import_seconds', dependencies_seconds)
+        results[F'{label}_import_seconds'] = import_seconds
+        results[F'{label}_load_seconds'] = load_seconds
+    return results
+
+
+def run(schemes, sizes, repeat=3, memory=True, max_codes=50000000, seed=0, log=print):
+    '''
+    run
+    function to run the benchmark suite
+    param schemes: list of scheme names
+    param sizes: list of record counts
+    param repeat: int, timing runs per case (the best is reported)
+    param memory: bool, also measure the peak memory of each case
+    param max_codes: int, cases with more codes than this are skipped (reported with skipped=True)
+    param seed: int, seed of the claim generators
+    param log: function called with a progress line per case
+    return dict, json serializable
+    '''
+    from importlib import import_module
+    results = {'meta': {'pyelixhauser': pyelixhauser.__version__, 'python': platform.python_version(),
+                        'numpy': np.__version__, 'pandas': pd.__version__, 'platform': platform.platform(),
+                        'cpu_count': os.cpu_count(), 'seed': seed, 'repeat': repeat,
+                        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')},
+               'startup': {}, 'cases': []}
+    for scheme in schemes:
+        module_name, function_names = _schemes[scheme]
+        results['startup'][scheme] = startup_times(module_name)
+        log(F'{scheme} startup {results["startup"][scheme]}')
+        module = import_module('pyelixhauser.' + module_name)
+        functions = [(name, getattr(module, name)) for name in function_names if hasattr(module, name)]
+        for cardinality in ('low', 'high'):
+            pool = code_pool(scheme, cardinality, np.random.default_rng(seed))
+            for shape, codes_per_record in _codes_per_record.items():
+                for n_records in sizes:
+                    case = {'scheme': scheme, 'records': n_records, 'codes_per_record': shape,
+                            'cardinality': cardinality, 'pool_size': len(pool)}
+                    if n_records * codes_per_record[1] > max_codes:
+                        results['cases'].append(dict(case, skipped=True))
+                        log(F'{scheme} {cardinality} {shape} {n_records} skipped (over --max-codes)')
+                        continue
+                    records, n_codes = generate_records(pool, n_records, codes_per_record, np.random.default_rng(seed))
+                    for name, func in functions:
+                        seconds = _time_call(func, records, repeat)
+                        row = dict(case, function=name, codes=n_codes, seconds=seconds,
+                                   records_per_second=n_records / seconds, codes_per_second=n_codes / seconds)
+                        if memory:
+                            row['peak_memory_bytes'] = _peak_memory(func, records)
+                        results['cases'].append(row)
+                        log(F'{scheme} {cardinality} {shape} {n_records} {name}: {seconds:.6f}s '
+                            F'{row["records_per_second"]:,.0f} records/s {row["codes_per_second"]:,.0f} codes/s')
+                    del records
+    return results
+
+
+def compare(old, new):
+    '''
+    compare
+    function to compare two result files case by case
+    param old: dict, results of the baseline run
+    param new: dict, results of the new run
+    return pandas data frame, one row per case found in both runs, speedup = old seconds / new seconds
+    '''
+    keys = ['scheme', 'function', 'cardinality', 'codes_per_record', 'records']
+    frames = [pd.DataFrame([case for case in results['cases'] if not case.get('skipped')])
+              .loc[:, keys + ['seconds']] for results in (old, new)]
+    merged = frames[0].merge(frames[1], on=keys, suffixes=('_old', '_new'))
+    merged['speedup'] = merged['seconds_old'] / merged['seconds_new']
+    return merged
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='benchmark the pyelixhauser schemes on synthetic claims')
+    parser.add_argument('-o', '--output', help='json file to write the results to (default: stdout)')
+    parser.add_argument('--schemes', nargs='+', default=list(_schemes), choices=list(_schemes))
+    parser.add_argument('--sizes', nargs='+', type=int, default=_sizes, help='record counts')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-memory', action='store_true', help='skip the peak memory runs')
+    parser.add_argument('--max-codes', type=int, default=50000000, help='skip cases with more codes than this')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'), help='compare two result files')
+    args = parser.parse_args(argv)
+    if args.compare:
+        old, new = (json.load(open(path)) for path in args.compare)
+        print(compare(old, new).to_string(index=False))
+        return 0
+    results = run(args.schemes, args.sizes, repeat=args.repeat, memory=not args.no_memory,
+                  max_codes=args.max_codes, seed=args.seed, log=lambda line: print(line, file=sys.stderr))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -4,3 +4,15 @@
 VERSION = (0,1, 0)
 # string created from tuple to avoid inconsistency
 __version__ = ".".join([str(x) for x in VERSION])
+
+
+def warmup(*modules):
+    '''
+    warmup
+    function to load the reference tables now instead of on the first lookup
+    (for services that want to pay the start up cost before taking traffic)
+    param modules: module names ('cci', 'icd9cm', 'icd10cm', 'icd10cm_cmr_v2022'), all of them by default
+    '''
+    from importlib import import_module
+    for name in modules or ('cci', 'icd9cm', 'icd10cm', 'icd10cm_cmr_v2022'):
+        import_module('pyelixhauser.' + name).warmup()
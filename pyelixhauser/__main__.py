@@ -0,0 +1,4 @@
+import sys
+from pyelixhauser.cli import main
+
+sys.exit(main())
@@ -0,0 +1,156 @@
+'''
+pyelixhauser arrow module contains
+entry points for Apache Arrow and Polars data, without converting the column to python strings
+
+the input is dictionary encoded (arrow dictionary and polars categorical columns already are), only the
+distinct strings are tokenized and resolved, and the results are broadcast back to the rows through the
+integer indices. List columns (one code per element, e.g. list<string>) are flattened, their distinct codes
+resolved the same way and OR-ed back per record. The flags are returned as an arrow RecordBatch or a
+polars DataFrame of uint8 (or bool) columns, in the columns of the scheme's comorbidity_matrix
+
+needs pyarrow (pip install pyarrow), and polars for the polars functions (pip install polars)
+
+example usage:
+comorbidity_arrow(table['diagnosis_codes'], 'cmr2022')   # pyarrow RecordBatch
+comorbidity_polars(df['diagnosis_codes'], 'icd10cm', dtype='bool')   # polars DataFrame
+encode(pl.Series(['E11.9 N18.3', None]), 'cmr2022')   # numpy uint64 bitmasks, see pyelixhauser.bitmask
+'''
+
+import numpy as np
+from pyelixhauser import batch, bitmask, multi
+from pyelixhauser.schemes import get_scheme
+
+_dtypes = ('uint8', 'bool')
+
+
+def _import_pyarrow():
+    '''
+    internal function to import pyarrow, the optional dependency of this module
+    '''
+    try:
+        import pyarrow
+        import pyarrow.compute
+    except ImportError:
+        raise ImportError('arrow input and output require pyarrow (pip install pyarrow)')
+    return pyarrow, pyarrow.compute
+
+
+def _import_polars():
+    '''
+    internal function to import polars, the optional dependency of the polars functions
+    '''
+    try:
+        import polars
+    except ImportError:
+        raise ImportError('polars input and output require polars (pip install polars)')
+    return polars
+
+
+def _as_arrow(array):
+    '''
+    internal function to get the arrow data of a column
+    param array: pyarrow Array or ChunkedArray, polars Series, or anything pyarrow.array accepts
+    return list of pyarrow arrays (the chunks of the column)
+    '''
+    pyarrow, _ = _import_pyarrow()
+    if type(array).__module__.split('.')[0] == 'polars':
+        array = array.to_arrow()
+    if isinstance(array, pyarrow.ChunkedArray):
+        return array.chunks
+    if not isinstance(array, pyarrow.Array):
+        array = pyarrow.array(array)
+    return [array]
+
+
+def _resolve_strings(array, scheme):
+    '''
+    internal function to resolve a string (or dictionary of strings) array through its distinct values
+    return tuple of numpy arrays, one value per row (bitmask, cmr2022 '# Comorbidities' count else 0),
+    null rows are 0
+    '''
+    pyarrow, compute = _import_pyarrow()
+    # string_view (polars strings, pyarrow >= 16) is not dictionary encoded by every pyarrow version
+    is_string_view = getattr(pyarrow.types, 'is_string_view', None)
+    if is_string_view is not None and is_string_view(array.type):
+        array = array.cast(pyarrow.large_string())
+    if not pyarrow.types.is_dictionary(array.type):
+        array = compute.dictionary_encode(array)
+    # null rows take the extra 0 appended after the values of the dictionary
+    indices = batch.dictionary_indices(array)
+    masks, counts = multi._batch_masks(array.dictionary.to_pylist(), [scheme])
+    return np.append(masks[:, 0], np.uint64(0))[indices], np.append(counts, 0)[indices]
+
+
+def _resolve(array, scheme):
+    '''
+    internal function to resolve one arrow array, of strings or of lists of strings
+    return tuple of numpy arrays, one value per row (bitmask, cmr2022 '# Comorbidities' count else 0)
+    '''
+    pyarrow, compute = _import_pyarrow()
+    if not (pyarrow.types.is_list(array.type) or pyarrow.types.is_large_list(array.type)):
+        return _resolve_strings(array, scheme)
+    lengths = compute.fill_null(compute.list_value_length(array), 0).to_numpy()
+    offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+    code_masks, code_counts = _resolve_strings(compute.list_flatten(array), scheme)
+    return batch.reduce_or(code_masks, offsets), batch.reduce_max(code_counts.astype(np.int64), offsets)
+
+
+def _records(array, scheme):
+    '''
+    internal function to resolve every chunk of a column
+    '''
+    get_scheme(scheme)
+    resolved = [_resolve(chunk, scheme) for chunk in _as_arrow(array)]
+    if not resolved:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    return np.concatenate([masks for masks, _ in resolved]), np.concatenate([counts for _, counts in resolved])
+
+
+def encode(array, scheme):
+    '''
+    encode
+    function to detect the comorbities of an arrow or polars column as bitmasks
+    param array: pyarrow Array or ChunkedArray, or polars Series, of strings (codes shoulld be seperated
+    with , or space), dictionary / categorical strings, or lists of strings (one code per element)
+    param scheme: string, one of pyelixhauser.schemes.names
+    return numpy uint64 array, one bitmask per row (null rows are 0), same as bitmask.encode
+    '''
+    return _records(array, scheme)[0]
+
+
+def comorbidity_arrow(array, scheme, dtype='uint8'):
+    '''
+    comorbidity_arrow
+    function to detect the comorbities of an arrow or polars column
+    param array: pyarrow Array or ChunkedArray, or polars Series, of strings (codes shoulld be seperated
+    with , or space), dictionary / categorical strings, or lists of strings (one code per element)
+    param scheme: string, one of pyelixhauser.schemes.names
+    param dtype: 'uint8' or 'bool', type of the flag columns (the cmr2022 '# Comorbidities' count stays uint8)
+    return pyarrow RecordBatch, one row per row of array, the columns of the scheme's comorbidity_matrix
+    '''
+    if dtype not in _dtypes:
+        raise ValueError(F'unknown dtype {dtype!r}, expected one of {list(_dtypes)}')
+    pyarrow, _ = _import_pyarrow()
+    masks, counts = _records(array, scheme)
+    names = bitmask.columns(scheme)
+    # one contiguous numpy column per comorbity, handed to arrow without copying
+    columns = [((masks >> np.uint64(j)) & np.uint64(1)).astype(dtype) for j in range(len(names))]
+    if get_scheme(scheme)['module'] == multi._count_module:
+        names = [multi._count_column] + names
+        columns = [counts.astype(np.uint8)] + columns
+    return pyarrow.RecordBatch.from_arrays([pyarrow.array(column) for column in columns], names=names)
+
+
+def comorbidity_polars(array, scheme, dtype='uint8'):
+    '''
+    comorbidity_polars
+    function to detect the comorbities of a polars (or arrow) column
+    param array: polars Series, or pyarrow Array or ChunkedArray, see comorbidity_arrow
+    param scheme: string, one of pyelixhauser.schemes.names
+    param dtype: 'uint8' or 'bool', type of the flag columns (the cmr2022 '# Comorbidities' count stays uint8)
+    return polars DataFrame, one row per row of array, the columns of the scheme's comorbidity_matrix
+    '''
+    polars = _import_polars()
+    pyarrow, _ = _import_pyarrow()
+    return polars.from_arrow(pyarrow.Table.from_batches([comorbidity_arrow(array, scheme, dtype=dtype)]))
@@ -0,0 +1,521 @@
+'''
+Internal batch engine shared by the cci, icd9cm, icd10cm and icd10cm_cmr_v2022 modules
+
+a column of diagnosis strings is scored in four steps
+    1. every record is tokenized at once with the module's token pattern
+    2. the tokens of the whole batch are deduplicated
+    3. each distinct token is resolved to a comorbidity bitmask exactly once
+    4. the bitmasks are OR reduced per record and unpacked into a preallocated uint8 matrix
+'''
+
+import os
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+import numpy as np
+import pandas as pd
+from pyelixhauser import instrument
+from pyelixhauser.setup_logger import logger
+
+
+def as_strings(array):
+    '''
+    as_strings
+    function to convert an array like of records to a pandas series of strings
+    param array: list, numpy array or pandas series of strings (missing values are treated as empty records)
+    return pandas series of strings with a default range index
+    '''
+    if isinstance(array, (pd.Series, pd.Index)):
+        values = array.to_numpy(dtype=object)
+    elif _is_arrow(array):
+        values = array.to_numpy(zero_copy_only=False).astype(object).reshape(-1)
+    elif isinstance(array, np.ndarray):
+        values = array.astype(object).reshape(-1)
+    else:
+        values = np.asarray(list(array), dtype=object)
+    series = pd.Series(values)
+    return series.where(series.notna(), '').astype(str)
+
+
+def _is_arrow(array):
+    '''
+    internal function to recognize pyarrow arrays and chunked arrays without importing pyarrow
+    '''
+    return type(array).__module__.split('.')[0] == 'pyarrow' and hasattr(array, 'to_numpy')
+
+
+def _arrow_dictionary(array):
+    '''
+    internal function to read the indices and dictionary of a pyarrow dictionary array, or of a chunked
+    array of them (e.g. a column of a parquet table), the chunks are first given one shared dictionary
+    return tuple (numpy int64 array of indices, -1 for nulls; list of the dictionary values), None for
+    arrays that are not dictionary encoded
+    '''
+    import pyarrow
+    if not pyarrow.types.is_dictionary(array.type):
+        return None
+    if isinstance(array, pyarrow.Array):
+        return dictionary_indices(array), array.dictionary.to_pylist()
+    chunks = array.unify_dictionaries().chunks
+    if not chunks:
+        return np.zeros(0, dtype=np.int64), []
+    return np.concatenate([dictionary_indices(chunk) for chunk in chunks]), chunks[0].dictionary.to_pylist()
+
+
+def categories(array):
+    '''
+    categories
+    function to split a dictionary encoded column (pandas categorical, or pyarrow dictionary array)
+    into its integer codes and its categories, so only the categories are resolved
+
+    param array: array like, pandas categorical or pyarrow dictionary (chunked) array
+    return tuple (numpy int64 array, position of each record in values; numpy object array of strings,
+    the categories used plus '' for missing values), None when array is not dictionary encoded
+    '''
+    if isinstance(array, (pd.Series, pd.Index)) and isinstance(array.dtype, pd.CategoricalDtype):
+        array = array.array
+    if isinstance(array, pd.Categorical):
+        codes, values = array.codes, array.categories
+    elif _is_arrow(array):
+        decoded = _arrow_dictionary(array)
+        if decoded is None:
+            return None
+        codes, values = decoded
+    else:
+        return None
+    values = np.append(as_strings(values).to_numpy(dtype=object), '')
+    codes = np.asarray(codes, dtype=np.int64)
+    codes = np.where(codes < 0, len(values) - 1, codes)
+    if len(values) > len(codes):
+        # e.g. a slice of a large column, the categories no record uses are not resolved
+        used = np.flatnonzero(np.bincount(codes, minlength=len(values)))
+        positions = np.zeros(len(values), dtype=np.int64)
+        positions[used] = np.arange(len(used))
+        codes, values = positions[codes], values[used]
+    return codes, values
+
+
+def dictionary_indices(array):
+    '''
+    dictionary_indices
+    function to read the indices of a pyarrow dictionary array (signed or unsigned, e.g. the uint32
+    indices of polars categoricals) as int64, with -1 for null entries
+
+    param array: pyarrow DictionaryArray
+    return numpy int64 array
+    '''
+    import pyarrow
+    from pyarrow import compute
+    return compute.fill_null(compute.cast(array.indices, pyarrow.int64()), -1).to_numpy()
+
+
+def take(results, codes):
+    '''
+    take
+    function to broadcast per category results back to the records of a dictionary encoded column
+
+    param results: numpy array (or tuple of numpy arrays), one value or row per category
+    param codes: numpy int64 array, the category of each record (from categories)
+    return numpy array (or tuple of numpy arrays), one value or row per record
+    '''
+    if isinstance(results, tuple):
+        return tuple(np.take(values, codes, axis=0) for values in results)
+    return np.take(results, codes, axis=0)
+
+
+def tokenize(array, pattern, upper=False):
+    '''
+    tokenize
+    function to split a whole column of records into tokens
+
+    param array: array like of strings
+    param pattern: regular expression matching one token
+    param upper: bool, uppercase the records before tokenizing
+    return tuple (list of tokens, numpy int64 array of record offsets),
+    the tokens of record i are tokens[offsets[i]:offsets[i + 1]]
+    '''
+    series = as_strings(array)
+    if upper:
+        series = series.str.upper()
+    token_lists = series.str.findall(pattern).tolist()
+    offsets = np.zeros(len(token_lists) + 1, dtype=np.int64)
+    np.cumsum(np.fromiter(map(len, token_lists), dtype=np.int64, count=len(token_lists)), out=offsets[1:])
+    return list(chain.from_iterable(token_lists)), offsets
+
+
+def factorize(tokens):
+    '''
+    factorize
+    function to deduplicate the tokens of a batch
+
+    param tokens: list of strings
+    return tuple (numpy int64 array, position of each token in uniques; numpy object array of distinct tokens)
+    '''
+    return pd.factorize(np.asarray(tokens, dtype=object))
+
+
+def factorize_codes(codes):
+    '''
+    factorize_codes
+    function to deduplicate a column of codes (long format data), dictionary encoded columns
+    are numbered by their integer codes without building the strings of every row
+
+    param codes: pandas series of codes, pandas categorical or pyarrow dictionary array
+    return tuple (numpy int64 array, position of each code in uniques; numpy object array of distinct codes)
+    '''
+    decoded = categories(codes)
+    if decoded is not None:
+        return decoded
+    return factorize(as_strings(codes))
+
+
+def resolve(uniques, lookup, dtype=np.uint64):
+    '''
+    resolve
+    function to resolve every distinct token exactly once
+
+    param uniques: array like of distinct tokens
+    param lookup: function, token -> int
+    param dtype: numpy dtype of the result
+    return numpy array, lookup(token) for every distinct token
+    '''
+    return np.fromiter(map(lookup, uniques), dtype=dtype, count=len(uniques))
+
+
+def _reduce(ufunc, values, offsets, dtype):
+    '''
+    internal function to reduce per token values to per record values
+    records without tokens are left at 0
+    '''
+    results = np.zeros(len(offsets) - 1, dtype=dtype)
+    has_tokens = offsets[1:] > offsets[:-1]
+    if has_tokens.any():
+        results[has_tokens] = ufunc.reduceat(values, offsets[:-1][has_tokens])
+    return results
+
+
+def reduce_or(values, offsets):
+    '''
+    reduce_or
+    function to OR together the per token bitmasks of each record
+
+    param values: numpy uint64 array, one bitmask per token
+    param offsets: numpy int64 array of record offsets (from tokenize)
+    return numpy uint64 array, one bitmask per record
+    '''
+    return _reduce(np.bitwise_or, values, offsets, np.uint64)
+
+
+def reduce_max(values, offsets):
+    '''
+    reduce_max
+    function to take the maximum of the per token values of each record
+
+    param values: numpy int64 array, one value per token
+    param offsets: numpy int64 array of record offsets (from tokenize)
+    return numpy int64 array, one value per record
+    '''
+    return _reduce(np.maximum, values, offsets, np.int64)
+
+
+def log_summary(name, n_records, n_tokens, n_distinct, masks):
+    '''
+    log_summary
+    function to log one debug line per batch instead of one line per code,
+    nothing is counted or formatted unless debug logging is on
+
+    param name: string, name of the module or scheme
+    param n_records: int, number of records (or ids) in the batch
+    param n_tokens: int, number of tokens (or rows) in the batch
+    param n_distinct: int, number of distinct tokens resolved
+    param masks: numpy uint64 array, one bitmask per record
+    '''
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug('%s: %d records, %d tokens, %d distinct tokens resolved, %d records with a comorbidity',
+                     name, n_records, n_tokens, n_distinct, np.count_nonzero(masks))
+
+
+def finish_batch(record, masks, token_masks, n_distinct, valid=None):
+    '''
+    finish_batch
+    function to count a resolved batch and end its instrumentation record (see pyelixhauser.instrument),
+    nothing is counted when instrumentation is off
+
+    param record: dict from instrument.start, or None
+    param masks: numpy uint64 array, one bitmask per record
+    param token_masks: numpy uint64 array, one bitmask per token (or row)
+    param n_distinct: int, number of distinct tokens resolved
+    param valid: optional numpy array, non zero for the tokens that are codes of the scheme (all tokens by default)
+    '''
+    if record is None:
+        return
+    instrument.finish(record, records=len(masks), tokens=len(token_masks), distinct_tokens=n_distinct,
+                      valid_tokens=len(token_masks) if valid is None else int(np.count_nonzero(valid)),
+                      tokens_with_comorbidity=int(np.count_nonzero(token_masks)),
+                      records_with_comorbidity=int(np.count_nonzero(masks)))
+
+
+def record_masks(array, pattern, lookup, upper=False):
+    '''
+    record_masks
+    function to resolve a column of records to one comorbidity bitmask per record
+
+    param array: array like of strings
+    param pattern: regular expression matching one token
+    param lookup: function, token -> bitmask
+    param upper: bool, uppercase the records before tokenizing
+    return numpy uint64 array, one bitmask per record
+    '''
+    record = instrument.start(lookup.__module__)
+    tokens, offsets = tokenize(array, pattern, upper=upper)
+    instrument.lap(record, 'tokenize')
+    inverse, uniques = factorize(tokens)
+    instrument.lap(record, 'dedupe')
+    token_masks = resolve(uniques, lookup)[inverse]
+    instrument.lap(record, 'resolve')
+    masks = reduce_or(token_masks, offsets)
+    instrument.lap(record, 'reduce')
+    log_summary(lookup.__module__, len(masks), len(tokens), len(uniques), masks)
+    finish_batch(record, masks, token_masks, len(uniques))
+    return masks
+
+
+def _concatenate(results):
+    '''
+    internal function to join the per chunk results of parallel in input order
+    '''
+    if isinstance(results[0], tuple):
+        return tuple(np.concatenate(parts) for parts in zip(*results))
+    return np.concatenate(results)
+
+
+def parallel(func, *arrays, n_jobs=None, executor=None, warmup=None):
+    '''
+    parallel
+    function to run a batch function over chunks of a column on several cores,
+    the results are reassembled in input order
+
+    param func: module level function, array like of strings -> numpy array (or tuple of numpy arrays)
+    with one value or row per string
+    param arrays: array like of strings, or several of the same length (e.g. codes and their POA indicators),
+    func is then called with the same chunk of each
+    a single dictionary encoded column (see categories) is resolved once per category
+    param n_jobs: int, number of worker processes (-1 for one per cpu), None or 1 runs in this process
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    param warmup: function called before the worker processes are started, on platforms that fork
+    the workers inherit the loaded reference tables (copy on write) instead of rebuilding them
+    return the joined results of func
+    '''
+    decoded = categories(arrays[0]) if len(arrays) == 1 else None
+    if decoded is not None:
+        # dictionary encoded column: func runs on the categories only, then the results are taken to the records
+        codes, values = decoded
+        return take(parallel(func, values, n_jobs=n_jobs, executor=executor, warmup=warmup), codes)
+    if executor is None and n_jobs in (None, 1):
+        return func(*arrays)
+    values = [as_strings(array).to_numpy(dtype=object) for array in arrays]
+    n_chunks = min(len(values[0]), 4 * n_workers(n_jobs))
+    if n_chunks <= 1:
+        return func(*values)
+    chunks = [np.array_split(array, n_chunks) for array in values]
+    if executor is not None:
+        return _concatenate(list(executor.map(func, *chunks)))
+    with process_pool(n_jobs, warmup=warmup) as pool:
+        return _concatenate(list(pool.map(func, *chunks)))
+
+
+def n_workers(n_jobs):
+    '''
+    n_workers
+    function to find the number of worker processes of an n_jobs argument
+
+    param n_jobs: int, number of worker processes, None or -1 for one per cpu
+    return int
+    '''
+    return (os.cpu_count() or 1) if n_jobs in (None, -1) else n_jobs
+
+
+def process_pool(n_jobs=None, warmup=None):
+    '''
+    process_pool
+    function to create the process pool parallel runs on when it is not given an executor,
+    to reuse one pool over many batches (e.g. the chunks of a file) pass it to them as executor
+
+    param n_jobs: int, number of worker processes, None or -1 for one per cpu
+    param warmup: function called before the worker processes are started, on platforms that fork
+    the workers inherit the loaded reference tables (copy on write) instead of rebuilding them
+    return concurrent.futures ProcessPoolExecutor, shut it down (or use it in a with block) when done
+    '''
+    if warmup is not None:
+        warmup()
+    methods = multiprocessing.get_all_start_methods()
+    context = multiprocessing.get_context('fork') if 'fork' in methods else None
+    return ProcessPoolExecutor(max_workers=n_workers(n_jobs), mp_context=context)
+
+
+def align_tokens(offsets, other_offsets):
+    '''
+    align_tokens
+    function to pair the tokens of two tokenized columns by position within each record
+    (e.g. the n-th code of a record with the n-th POA indicator of the same record)
+
+    param offsets: numpy int64 array of record offsets (from tokenize)
+    param other_offsets: numpy int64 array of record offsets of the other column, same number of records
+    return numpy int64 array, for every token the position of its partner in the other token list,
+    -1 when the record has fewer tokens in the other column
+    '''
+    lengths = np.diff(offsets)
+    records = np.repeat(np.arange(len(lengths)), lengths)
+    positions = np.arange(offsets[-1]) - offsets[:-1][records]
+    partners = other_offsets[:-1][records] + positions
+    return np.where(positions < np.diff(other_offsets)[records], partners, -1)
+
+
+def group_ids(ids):
+    '''
+    group_ids
+    function to number the ids of long format data (one code per row)
+
+    param ids: pandas series of ids
+    return tuple (numpy int64 array, group of each row, -1 for missing ids; pandas index of the distinct ids, sorted)
+    '''
+    groups, uniques = pd.factorize(ids, sort=True)
+    return groups, pd.Index(uniques, name=getattr(ids, 'name', None))
+
+
+def _group_offsets(values, groups, n_groups):
+    '''
+    internal function to sort per row values by group
+    return tuple (values sorted by group, numpy int64 array of group offsets)
+    '''
+    keep = groups >= 0
+    values, groups = values[keep], groups[keep]
+    order = np.argsort(groups, kind='stable')
+    offsets = np.zeros(n_groups + 1, dtype=np.int64)
+    np.cumsum(np.bincount(groups, minlength=n_groups), out=offsets[1:])
+    return values[order], offsets
+
+
+def group_reduce_or(values, groups, n_groups):
+    '''
+    group_reduce_or
+    function to OR together the per row bitmasks of each group
+
+    param values: numpy uint64 array, one bitmask per row
+    param groups: numpy int64 array, group of each row (from group_ids)
+    param n_groups: int, number of groups
+    return numpy uint64 array, one bitmask per group
+    '''
+    return reduce_or(*_group_offsets(values, groups, n_groups))
+
+
+def group_reduce_max(values, groups, n_groups):
+    '''
+    group_reduce_max
+    function to take the maximum of the per row values of each group
+
+    param values: numpy int64 array, one value per row
+    param groups: numpy int64 array, group of each row (from group_ids)
+    param n_groups: int, number of groups
+    return numpy int64 array, one value per group
+    '''
+    return reduce_max(*_group_offsets(values, groups, n_groups))
+
+
+def long_record_masks(ids, codes, lookup):
+    '''
+    long_record_masks
+    function to resolve long format data (one code per row) to one comorbidity bitmask per id
+
+    param ids: pandas series of ids
+    param codes: pandas series of codes
+    param lookup: function, code -> bitmask
+    return tuple (pandas index of the distinct ids, numpy uint64 array, one bitmask per id)
+    '''
+    record = instrument.start(lookup.__module__)
+    groups, unique_ids = group_ids(ids)
+    instrument.lap(record, 'group')
+    inverse, uniques = factorize_codes(codes)
+    instrument.lap(record, 'dedupe')
+    row_masks = resolve(uniques, lookup)[inverse]
+    instrument.lap(record, 'resolve')
+    masks = group_reduce_or(row_masks, groups, len(unique_ids))
+    instrument.lap(record, 'reduce')
+    log_summary(lookup.__module__, len(unique_ids), len(groups), len(uniques), masks)
+    finish_batch(record, masks, row_masks, len(uniques))
+    return unique_ids, masks
+
+
+@instrument.timed('assemble')
+def mask_labels(masks, columns, sep=' | '):
+    '''
+    mask_labels
+    function to turn bitmasks into the joined names of their comorbities (the output of get_elix and get_cci),
+    the label of each distinct bitmask is built once and broadcast to the records
+
+    param masks: numpy uint64 array, one bitmask per record
+    param columns: list of names, bit j is columns[j]
+    param sep: string placed between the names
+    return numpy object array, one label per record, None for records without a comorbidity
+    '''
+    distinct, inverse = np.unique(np.asarray(masks, dtype=np.uint64), return_inverse=True)
+    table = np.empty(len(distinct), dtype=object)
+    for i, mask in enumerate(distinct.tolist()):
+        table[i] = sep.join(name for j, name in enumerate(columns) if (mask >> j) & 1) or None
+    return table[inverse.reshape(-1)]
+
+
+@instrument.timed('assemble')
+def to_frame(matrix, columns, index=None):
+    '''
+    to_frame
+    function to wrap a result matrix in a pandas data frame without copying it
+    param matrix: numpy array
+    param columns: list of column names
+    param index: optional pandas index (row labels)
+    return pandas data frame
+    '''
+    return pd.DataFrame(matrix, columns=columns, index=index, copy=False)
+
+
+@instrument.timed('assemble')
+def to_sparse(csr, columns, as_frame=False, index=None):
+    '''
+    to_sparse
+    function to wrap the arrays of a CSR result matrix (from sparse_masks)
+    param csr: tuple (data, indices, indptr)
+    param columns: list of column names
+    param as_frame: bool, False returns a scipy.sparse csr_matrix (needs scipy), its columns are in the order
+    of columns, True returns a pandas data frame of Sparse[uint8, 0] columns named columns (no scipy needed)
+    param index: optional pandas index (row labels) of the data frame
+    return scipy.sparse.csr_matrix or pandas data frame
+    '''
+    data, indices, indptr = csr
+    n_rows = len(indptr) - 1
+    try:
+        from scipy import sparse
+    except ImportError:
+        if not as_frame:
+            raise ImportError('sparse matrices require scipy (pip install scipy), '
+                              'as_frame=True returns a pandas sparse data frame instead')
+        sparse = None
+    if sparse is not None:
+        matrix = sparse.csr_matrix((data, indices, indptr), shape=(n_rows, len(columns)))
+        if not as_frame:
+            return matrix
+        # the columns are built from the stored entries, the dense matrix is never allocated
+        return pd.DataFrame.sparse.from_spmatrix(matrix.astype(np.uint8), index=index, columns=list(columns))
+    # without scipy each column is densified one at a time, never the whole matrix
+    rows = np.repeat(np.arange(n_rows, dtype=np.int64), np.diff(indptr))
+    order = np.argsort(indices, kind='stable')
+    column_offsets = np.searchsorted(indices[order], np.arange(len(columns) + 1))
+    arrays = {}
+    for j in range(len(columns)):
+        entries = order[column_offsets[j]:column_offsets[j + 1]]
+        column = np.zeros(n_rows, dtype=np.uint8)
+        column[rows[entries]] = data[entries]
+        arrays[j] = pd.arrays.SparseArray(column, fill_value=0)
+    frame = pd.DataFrame(arrays, index=index)
+    frame.columns = list(columns)
+    return frame
@@ -0,0 +1,171 @@
+'''
+pyelixhauser bitmask module contains
+a compact representation of comorbidity profiles, one numpy uint64 bitmask per
+record (8 bytes instead of a series of 18 to 40 int64), and vectorized set
+operations on it
+
+bit j of a mask is column j of the comorbities of the scheme, see columns(scheme).
+For cmr2022 the bits are the measures only, the '# Comorbidities' count is not
+part of the mask
+
+example usage:
+masks = encode(['E11.9 N18.3', 'J30.1', 'I10'], 'cmr2022')
+profile = union_reduce(masks)
+popcount(profile)
+to_pandas(profile, 'cmr2022')
+'''
+
+import numpy as np
+import pandas as pd
+from pyelixhauser import batch, schemes
+from pyelixhauser.utils import popcount as _popcount, unpack_masks
+
+_count_column = '# Comorbidities'
+
+
+def columns(scheme):
+    '''
+    columns
+    function to list the comorbities represented by the bits of a scheme's masks
+    param scheme: string, one of pyelixhauser.schemes.names ('cci', 'icd9cm', 'icd10cm', 'cmr2022')
+    return list of column names, bit j is columns(scheme)[j]
+    '''
+    return schemes.get_module(scheme)._mask_columns()
+
+
+def encode(array, scheme, n_jobs=None, executor=None):
+    '''
+    encode
+    function to detect comorbities for a whole column of strings and return them as bitmasks
+    param array: list, numpy array or pandas series of strings (codes shoulld be seperated with , or space )
+    param scheme: string, one of pyelixhauser.schemes.names
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    return numpy uint64 array, one bitmask per string
+    '''
+    return schemes.get_function(scheme, 'masks')(array, n_jobs=n_jobs, executor=executor)
+
+
+def encode_long(df, id_col, code_col, scheme):
+    '''
+    encode_long
+    function to detect comorbities from long format data (one code per row) as one bitmask per id
+    param df: pandas data frame
+    param id_col: name of the column identifying the patient or encounter
+    param code_col: name of the column containing the code
+    param scheme: string, one of pyelixhauser.schemes.names
+    return pandas series of uint64, index is the sorted ids
+    '''
+    ids, masks = schemes.get_module(scheme)._long_masks(df.loc[:, id_col], df.loc[:, code_col])
+    return pd.Series(masks, index=ids)
+
+
+def from_pandas(results, scheme):
+    '''
+    from_pandas
+    function to pack the output of comorbidity_from_string (a series) or comorbidity_from_array
+    (a data frame) into bitmasks, missing values count as 0
+    param results: pandas series or data frame with the columns of the scheme
+    param scheme: string, one of pyelixhauser.schemes.names
+    return numpy uint64 scalar for a series, numpy uint64 array (one per row) for a data frame
+    '''
+    names = columns(scheme)
+    if isinstance(results, pd.Series):
+        values = results.loc[names].fillna(0).to_numpy(dtype=np.uint64).reshape(1, -1)
+    else:
+        values = results.loc[:, names].fillna(0).to_numpy(dtype=np.uint64)
+    masks = np.bitwise_or.reduce((values != 0).astype(np.uint64) << np.arange(len(names), dtype=np.uint64), axis=1)
+    return masks[0] if isinstance(results, pd.Series) else masks
+
+
+def to_pandas(masks, scheme, counts=None, index=None):
+    '''
+    to_pandas
+    function to expand bitmasks into the output format of comorbidity_from_string (for a single mask)
+    or comorbidity_from_array (for an array of masks), with int64 values
+    param masks: int or array like of ints
+    param scheme: string, one of pyelixhauser.schemes.names
+    param counts: cmr2022 only, int or array like of the '# Comorbidities' counts, the number of measures
+    flagged in each mask when not given
+    param index: optional pandas index (row labels) of the data frame
+    return pandas series for a single mask, pandas data frame for an array of masks
+    '''
+    names = columns(scheme)
+    single = np.ndim(masks) == 0
+    masks = np.asarray(masks, dtype=np.uint64).reshape(-1)
+    results = unpack_masks(masks, len(names)).astype(np.int64)
+    if schemes.get_scheme(scheme)['module'] == 'icd10cm_cmr_v2022':
+        counts = _popcount(masks) if counts is None else counts
+        results = np.hstack([np.asarray(counts, dtype=np.int64).reshape(-1, 1), results])
+        names = [_count_column] + names
+    if single:
+        return pd.Series(results[0], index=names)
+    return batch.to_frame(results, names, index=index)
+
+
+def labels(masks, scheme, sep=' | '):
+    '''
+    labels
+    function to turn bitmasks into the joined names of their comorbities, as returned by get_elix or get_cci
+    param masks: numpy uint64 array
+    param scheme: string, one of pyelixhauser.schemes.names
+    param sep: string placed between the names
+    return numpy object array, one label per mask, None for masks without a comorbity
+    '''
+    return batch.mask_labels(masks, columns(scheme), sep=sep)
+
+
+def union(*masks):
+    '''
+    union
+    function to combine profiles element wise, a comorbity is set if it is set in any of them
+    param masks: numpy uint64 arrays (or ints) of the same shape
+    return numpy uint64 array
+    '''
+    return np.bitwise_or.reduce(np.broadcast_arrays(*[np.asarray(m, dtype=np.uint64) for m in masks]), axis=0)
+
+
+def intersection(*masks):
+    '''
+    intersection
+    function to combine profiles element wise, a comorbity is set if it is set in all of them
+    param masks: numpy uint64 arrays (or ints) of the same shape
+    return numpy uint64 array
+    '''
+    return np.bitwise_and.reduce(np.broadcast_arrays(*[np.asarray(m, dtype=np.uint64) for m in masks]), axis=0)
+
+
+def difference(masks, other):
+    '''
+    difference
+    function to remove the comorbities of other from masks, element wise
+    param masks: numpy uint64 array (or int)
+    param other: numpy uint64 array (or int)
+    return numpy uint64 array
+    '''
+    return np.asarray(masks, dtype=np.uint64) & ~np.asarray(other, dtype=np.uint64)
+
+
+def popcount(masks):
+    '''
+    popcount
+    function to count the comorbities set in each profile
+    param masks: numpy uint64 array (or int)
+    return numpy uint8 array
+    '''
+    return _popcount(masks)
+
+
+def union_reduce(masks, groups=None):
+    '''
+    union_reduce
+    function to union all profiles, or the profiles of each group (e.g. the encounters of each patient)
+    param masks: numpy uint64 array
+    param groups: optional array like of group labels, one per mask
+    return numpy uint64 scalar without groups, otherwise a pandas series of uint64 indexed by the sorted groups
+    '''
+    masks = np.asarray(masks, dtype=np.uint64)
+    if groups is None:
+        return np.bitwise_or.reduce(masks)
+    group_numbers, group_index = batch.group_ids(pd.Series(groups))
+    return pd.Series(batch.group_reduce_or(masks, group_numbers, len(group_index)), index=group_index)
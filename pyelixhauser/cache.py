@@ -0,0 +1,182 @@
+'''
+Internal cache of compiled reference tables
+
+the lookup indexes of each module are built from the bundled csv files, the
+compiled arrays are written once to a versioned binary artifact and later
+processes read that artifact (one memory mapped file) instead of parsing the
+csv again, the modules then build their lookup dicts from its arrays
+
+artifacts are keyed by the package version, the compile version of the module
+(bumped whenever its _compile changes) and the sha256 of the source csv, so a
+new release, a changed compiler or an edited csv never loads a stale index
+(hashing the csv is much cheaper than parsing it). They are written to $PYELIXHAUSER_CACHE_DIR,
+or to $XDG_CACHE_HOME/pyelixhauser (~/.cache/pyelixhauser) when it is not set.
+Setting PYELIXHAUSER_CACHE_DIR to an empty string disables the cache. Packagers
+can prebuild the artifacts into the package so they ship with it
+
+    python -m pyelixhauser.cache pyelixhauser/resources
+'''
+
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from importlib import resources
+import numpy as np
+from pyelixhauser import __version__
+from pyelixhauser.setup_logger import logger
+
+_format_version = 1
+_magic = b'PYELIXHAUSER'
+_alignment = 64
+_prebuilt_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'resources')
+
+
+def cache_dir():
+    '''
+    cache_dir
+    function to find the directory the compiled artifacts are stored in
+    return string, or None if the cache is disabled
+    '''
+    directory = os.environ.get('PYELIXHAUSER_CACHE_DIR')
+    if directory is not None:
+        return directory or None
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'pyelixhauser')
+
+
+def resource_hash(resource_name):
+    '''
+    resource_hash
+    function to hash the content of a bundled resource file
+    param resource_name: string, resource path (e.g. "/resources/cci2015.csv")
+    return string, hex sha256 of the file
+    '''
+    data = resources.files('pyelixhauser').joinpath(resource_name.lstrip('/')).read_bytes()
+    return hashlib.sha256(data).hexdigest()
+
+
+def artifact_name(name, resource_name, compile_version=1):
+    '''
+    artifact_name
+    function to build the file name of a compiled artifact
+    param name: string, module name
+    param resource_name: string, resource path of the source csv
+    param compile_version: int, version of the module's _compile
+    return string
+    '''
+    key = F'{__version__}|{resource_name}|{resource_hash(resource_name)}'
+    digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+    return F'{name}-v{_format_version}.{compile_version}-{digest[:16]}.bin'
+
+
+def write_arrays(path, arrays, meta):
+    '''
+    write_arrays
+    function to write numpy arrays and json metadata to a single binary file,
+    the file is written to a temporary name first and then renamed, so concurrent
+    readers never see a partial artifact
+    param path: string
+    param arrays: dict, name -> numpy array (numeric, bool or fixed width unicode)
+    param meta: dict, json serializable metadata
+    '''
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    entries, offset = [], 0
+    for name, array in arrays.items():
+        entries.append({'name': name, 'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset})
+        offset += -(-array.nbytes // _alignment) * _alignment
+    header = json.dumps({'meta': meta, 'arrays': entries}).encode('utf-8')
+    data_start = -(-(len(_magic) + 4 + len(header)) // _alignment) * _alignment
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(_magic + len(header).to_bytes(4, 'little') + header)
+            for entry, array in zip(entries, arrays.values()):
+                f.seek(data_start + entry['offset'])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def read_arrays(path):
+    '''
+    read_arrays
+    function to memory map a file written by write_arrays
+    param path: string
+    return tuple (dict, name -> read only numpy array backed by the memory map; dict of metadata)
+    '''
+    buffer = np.memmap(path, dtype=np.uint8, mode='r')
+    if bytes(buffer[:len(_magic)]) != _magic:
+        raise ValueError(F'{path} is not a pyelixhauser artifact')
+    header_end = len(_magic) + 4 + int.from_bytes(bytes(buffer[len(_magic):len(_magic) + 4]), 'little')
+    header = json.loads(bytes(buffer[len(_magic) + 4:header_end]).decode('utf-8'))
+    data_start = -(-header_end // _alignment) * _alignment
+    arrays = {}
+    for entry in header['arrays']:
+        dtype = np.dtype(entry['dtype'])
+        start = data_start + entry['offset']
+        size = int(np.prod(entry['shape'], dtype=np.int64)) * dtype.itemsize
+        arrays[entry['name']] = buffer[start:start + size].view(dtype).reshape(entry['shape'])
+    return arrays, header['meta']
+
+
+def cached(name, resource_name, build, compile_version=1):
+    '''
+    cached
+    function to load the compiled arrays of a module, from its artifact when one
+    exists for the current package, compiler and source csv, otherwise by building (and storing) them
+    param name: string, module name
+    param resource_name: string, resource path of the source csv
+    param build: function, returns a tuple (dict of numpy arrays, dict of json metadata)
+    param compile_version: int, version of build, bump it whenever build changes
+    return tuple (dict of numpy arrays, dict of metadata)
+    '''
+    directory = cache_dir()
+    if directory is None:
+        return build()
+    file_name = artifact_name(name, resource_name, compile_version)
+    path = os.path.join(directory, file_name)
+    for candidate in (os.path.join(_prebuilt_dir, file_name), path):
+        try:
+            return read_arrays(candidate)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.debug('ignoring unreadable artifact %s: %s', candidate, e)
+    arrays, meta = build()
+    try:
+        write_arrays(path, arrays, meta)
+    except OSError as e:
+        logger.debug('could not write artifact %s: %s', path, e)
+    return arrays, meta
+
+
+def build_cache(directory=None, modules=('cci', 'icd9cm', 'icd10cm', 'icd10cm_cmr_v2022')):
+    '''
+    build_cache
+    function to (re)build the compiled artifacts, e.g. at package build or image build time
+    param directory: string, target directory (defaults to cache_dir())
+    param modules: module names to build
+    return list of the artifact paths written
+    '''
+    from importlib import import_module
+    directory = directory or cache_dir()
+    paths = []
+    for name in modules:
+        module = import_module('pyelixhauser.' + name)
+        path = os.path.join(directory, artifact_name(name, module._resource_name, module._compile_version))
+        write_arrays(path, *module._compile())
+        paths.append(path)
+    return paths
+
+
+if __name__ == '__main__':
+    for path in build_cache(*sys.argv[1:2]):
+        print(path)
@@ -1,10 +1,11 @@
 
-import pkg_resources
 import pandas as pd
 import re
 import logging
+from functools import lru_cache
 from pyelixhauser.setup_logger import logger
-from pyelixhauser.utils import load_resource
+from pyelixhauser.utils import load_resource, open_resource, lazy_attributes, unpack_masks, sparse_masks
+from pyelixhauser import batch, cache, instrument, memo, tokens
 import numpy as np
 
 '''
@@ -51,8 +52,8 @@ https://www.hcup-us.ahrq.gov/toolssoftware/chronic/chronic.jsp
 
 
 _resource_name = "/resources/cci2015.csv"
+_compile_version = 1
 _manager = 'pyelixhauser'
-_path = pkg_resources.resource_stream(_manager,_resource_name)
 
 
 _input_cols = ['ICD-9-CM CODE',
@@ -96,9 +97,6 @@ _cci_dict = {
 
 18 : 'Factors influencing health status and contact with health services'
 }
-_cci_df = pd.read_csv(_path, skiprows=2, index_col=None, names=_input_cols)
-_cci_df.loc[:, 'ICD-9-CM CODE'] = _cci_df.loc[:, 'ICD-9-CM CODE']\
-.apply(lambda x: re.sub('[^0-9A-Z]','', str(x).upper()).strip())
 
 def _is_substring(s_input, s_ref):
 	s_input = str(s_input).replace('.', '').upper().strip()
@@ -110,39 +108,123 @@ def _is_substring(s_input, s_ref):
 		return False
 
 
+def _build_prefix_index(df):
+	'''
+	internal function to compile the cci reference table into a prefix index (a flattened trie)
+	param df: pandas data frame, the cci reference table
+	return dict, every prefix of every reference code -> (category, is_chronic)
+	of the first row (in file order) whose code starts with that prefix
+	'''
+	prefix_index = {}
+	rows = zip(df.loc[:, 'ICD-9-CM CODE'], df.loc[:, 'CATEGORY DESCRIPTION'], df.loc[:, 'BODY SYSTEM'])
+	for code, chronic, body_system in rows:
+		value = None
+		for i in range(1, len(code) + 1):
+			if code[:i] in prefix_index:
+				continue
+			if value is None:
+				value = (int(re.sub('[^0-9]', '', body_system)), int(re.sub('[^0-9]', '', chronic)) == 1)
+			prefix_index[code[:i]] = value
+	return prefix_index
+
+
+@lru_cache(maxsize=None)
+def _lookup_table():
+	'''
+	internal function to load the cci reference table from its csv
+	return pandas data frame, with the codes stripped to [0-9A-Z]
+	'''
+	with open_resource(_resource_name) as f:
+		cci_df = pd.read_csv(f, skiprows=2, index_col=None, names=_input_cols)
+	cci_df.loc[:, 'ICD-9-CM CODE'] = cci_df.loc[:, 'ICD-9-CM CODE'].astype(str).str.upper()\
+	.str.replace('[^0-9A-Z]', '', regex=True).str.strip()
+	return cci_df
+
+
+def _compile():
+	'''
+	internal function to compile the reference table into the arrays of the prefix index
+	return tuple (dict of numpy arrays: prefixes, their category and is_chronic flag; dict of metadata)
+	'''
+	prefix_index = _build_prefix_index(_lookup_table())
+	arrays = {'prefixes': np.array(list(prefix_index), dtype=str),
+	          'categories': np.array([category for category, _ in prefix_index.values()], dtype=np.uint8),
+	          'is_chronic': np.array([is_chronic for _, is_chronic in prefix_index.values()], dtype=bool)}
+	return arrays, {}
+
+
+@lru_cache(maxsize=None)
+@instrument.timed_load('cci')
+def _reference():
+	'''
+	internal function to build the prefix index (from the compiled artifact when one is cached),
+	runs on the first lookup (or on warmup) and is cached afterwards
+	return dict of reference tables
+	'''
+	arrays, _ = cache.cached('cci', _resource_name, _compile, _compile_version)
+	values = zip(arrays['categories'].tolist(), arrays['is_chronic'].tolist())
+	return {'prefix_index': dict(zip(arrays['prefixes'].tolist(), values))}
+
+
+__getattr__ = lazy_attributes(__name__, {'_cci_df': _lookup_table, '_prefix_index': lambda: _reference()['prefix_index']})
+
+
+def warmup():
+	'''
+	warmup
+	function to load the reference table and build the prefix index now instead of on the first lookup
+	(for services that want to pay the start up cost before taking traffic)
+	'''
+	_reference()
+
+
+@memo.memoize('code')
 def _get_cci(s):
-	index = _cci_df.loc[:, 'ICD-9-CM CODE'].apply(lambda x: _is_substring(s, x))
-	results = _cci_df.loc[index, ['CATEGORY DESCRIPTION','BODY SYSTEM']]
+	prefix_index = _reference()['prefix_index']
+	s = str(s).replace('.', '').upper().strip()
 	try:
-		category = int(re.sub('[^0-9]','',(results.iloc[0,1])))
-		is_chronic = int(re.sub('[^0-9]','',results.iloc[0,0])) == 1
-		logger.debug(F'cci lookup hit found in {s}')
-		return category, is_chronic
-	except IndexError:
+		return prefix_index[s]
+	except KeyError:
 		return (None, False)
 
 
 def _icd9_validation(s):
-	pattern ="V?[0-9]{2,8}"
+	return tokens.validate_icd9(s)
 
-	s = ' ' + str(s).upper()
-	s = re.sub('[.]', '', s).strip()
-	logger.debug(F"icd9 validation function for {s}")
-	try:
-	    results = re.search(pattern, s)
-	    return results.group()
-	except AttributeError:
-	    logger.debug(F'failed to find an icd9 in "{s}"')
-	    return None
-	except TypeError:
-	    logger.debug(F'failed to find an icd9 in "{s}"')
-	    return None
+
+_token_pattern = "V?[0-9]{2,8}"
+_category_bits = {category: 1 << i for i, category in enumerate(_cci_dict)}
+
+
+@memo.memoize('code')
+def _code_mask(code):
+	'''
+	internal function to lookup the chronic condition category of a single icd9 token
+	param code: string (as found by _icd9_gen)
+	return int, bitmask over the categories of _cci_dict (0 if the code is not chronic)
+	'''
+	# the code is already cached at the code level, the lookup itself is not cached a second time
+	category, is_chronic = _get_cci.__wrapped__(_icd9_validation(code))
+	if is_chronic:
+		return _category_bits[category]
+	return 0
+
+
+@memo.memoize('record')
+def _record_mask(s):
+	'''
+	internal function that ORs together the chronic condition categories of every code in a string
+	param s: string
+	return int, bitmask over the categories of _cci_dict
+	'''
+	mask = 0
+	for code in tokens.candidates(s, 'icd9cm'):
+		mask |= _code_mask(code)
+	return mask
 
 
 def _icd9_gen(s):
-		s = re.sub('[^V0-9.]', ' ', s).strip()
-		s = re.sub('  ', ' ', s).strip()
-		for result in re.findall("V?[0-9]{2,8}", s):
+		for result in tokens.candidates(s, 'icd9cm'):
 			yield _icd9_validation(result)
 
 
@@ -157,14 +239,119 @@ def cci_from_string(s):
 		else:
 			pass
 	return results
-def cci_from_array(array):
+def cci_from_array(array, n_jobs=None, executor=None):
 	index = list(_cci_dict.values())
-	results = np.zeros((len(array), len(index )))
-	for (i, s) in enumerate(array):
-		results[i, :] = cci_from_string(s)
+	results = cci_matrix(array, n_jobs=n_jobs, executor=executor)
 	return pd.DataFrame(results, columns=index).astype(int)
 
 
+def _batch_masks(array):
+	'''
+	internal function to resolve a column of strings to one bitmask per string
+	param array: array like of strings
+	return numpy uint64 array
+	'''
+	return batch.record_masks(array, _token_pattern, _code_mask)
+
+
+def cci_matrix(array, as_frame=False, n_jobs=None, executor=None, sparse=False):
+	'''
+	cci_matrix
+	function to detect chronic conditions for a whole column of strings at once,
+	each distinct code in the column is only looked up once
+	param array: list, numpy array or pandas series of strings (icd9cm codes shoulld be seperated with , or space )
+	param as_frame: bool, return a pandas data frame wrapping the matrix (without copying it)
+	param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+	param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+	param sparse: bool, return a scipy.sparse csr_matrix (or with as_frame a pandas sparse data frame),
+	built from the hits of each string without building the dense matrix
+	returns numpy uint8 array, one row per string, one column per category of _cci_dict
+
+	example usage:
+	cci_matrix(['4280|4280', '1611, 1, 0010', ''])
+
+
+	'''
+	masks = batch.parallel(_batch_masks, array, n_jobs=n_jobs, executor=executor, warmup=warmup)
+	if sparse:
+		return batch.to_sparse(sparse_masks(masks, len(_cci_dict)), list(_cci_dict.values()), as_frame=as_frame)
+	results = unpack_masks(masks, len(_cci_dict))
+	if as_frame:
+		return batch.to_frame(results, list(_cci_dict.values()))
+	return results
+
+
+def cci_masks(array, n_jobs=None, executor=None):
+	'''
+	cci_masks
+	function to detect chronic conditions for a whole column of strings as compact bitmasks
+	(see pyelixhauser.bitmask for set operations and conversion to the pandas output)
+	param array: list, numpy array or pandas series of strings (icd9cm codes shoulld be seperated with , or space )
+	param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+	param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+	returns numpy uint64 array, one bitmask per string, bit j is category j of _cci_dict
+
+	example usage:
+	cci_masks(['4280|4280', '1611, 1, 0010', ''])
+
+
+	'''
+	return batch.parallel(_batch_masks, array, n_jobs=n_jobs, executor=executor, warmup=warmup)
+
+
+def get_cci_array(array, n_jobs=None, executor=None):
+	'''
+	get_cci_array
+	function to detect chronic condition categories for a whole column of strings as labels, the same as
+	get_cci on each string, built from the bitmasks without a series per string
+	param array: list, numpy array or pandas series of strings (icd9cm codes shoulld be seperated with , or space )
+	param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+	param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+	returns numpy object array, one label per string (categories joined with ' | ', None when there is none)
+
+	example usage:
+	get_cci_array(['428.0 401.1', '490.1', ''])
+	'''
+	return batch.mask_labels(cci_masks(array, n_jobs=n_jobs, executor=executor), _mask_columns())
+
+
+def _mask_columns():
+	'''
+	internal function to list the categories represented by the bits of the masks
+	'''
+	return list(_cci_dict.values())
+
+
+def _long_masks(ids, codes):
+	'''
+	internal function to resolve long format data (one code per row) to one bitmask per id
+	return tuple (pandas index of the distinct ids, numpy uint64 array)
+	'''
+	return batch.long_record_masks(ids, codes, _record_mask)
+
+
+def cci_from_long(df, id_col, code_col, sparse=False):
+	'''
+	cci_from_long
+	function to detect chronic conditions from long format data (one icd9cm code per row),
+	each distinct code is only looked up once and the rows are combined per id
+	param df: pandas data frame
+	param id_col: name of the column identifying the patient or encounter
+	param code_col: name of the column containing the icd9cm code
+	param sparse: bool, return a data frame of Sparse[uint8, 0] columns (the dense matrix is never built)
+	returns pandas data frame (uint8), one row per id, index is the ids, columns are the categories of _cci_dict
+
+	example usage:
+	cci_from_long(pd.DataFrame({'id': [1, 1, 2], 'code': ['428.0', '0010', '1611']}), 'id', 'code')
+
+
+	'''
+	ids, masks = _long_masks(df.loc[:, id_col], df.loc[:, code_col])
+	if sparse:
+		return batch.to_sparse(sparse_masks(masks, len(_cci_dict)), list(_cci_dict.values()), as_frame=True, index=ids)
+	return batch.to_frame(unpack_masks(masks, len(_cci_dict)), list(_cci_dict.values()), index=ids)
+
+
 def get_cci(s):
     '''
     get_cci(
@@ -0,0 +1,93 @@
+'''
+pyelixhauser command line interface
+
+scores a csv or parquet file (or stdin) chunk by chunk and writes one row of
+comorbities per input row (wide layout) or per id (long layout)
+
+example usage:
+pyelixhauser claims.csv -s cmr2022 --codes diagnosis_codes --id encounter_id -o flags.csv
+cat diagnoses.csv | pyelixhauser -s icd9cm --layout long --id patient_id --codes code > flags.csv
+'''
+
+import argparse
+import json
+import os
+import sys
+import pandas as pd
+from pyelixhauser import __version__, batch, instrument, schemes
+from pyelixhauser.setup_logger import logger
+from pyelixhauser.stream import score_file, score_long_file
+
+
+def _parser():
+    '''
+    internal function to build the argument parser
+    '''
+    parser = argparse.ArgumentParser(prog='pyelixhauser', description='score icd codes for comorbities')
+    parser.add_argument('input', nargs='?', default='-', help='csv or parquet file (default: csv from stdin)')
+    parser.add_argument('-o', '--output', default='-', help='csv or parquet file (default: csv to stdout)')
+    parser.add_argument('-s', '--scheme', required=True, choices=schemes.names)
+    parser.add_argument('--layout', default='wide', choices=['wide', 'long'],
+                        help='wide: one string of codes per row, long: one code per row grouped by --id')
+    parser.add_argument('--codes', default='codes', help='name of the column containing the codes (default: codes)')
+    parser.add_argument('--id', help='id column, copied to the output (wide) or grouped on (long, required)')
+    parser.add_argument('--keep', nargs='*', default=[], help='other columns copied to the output (wide only)')
+    parser.add_argument('--chunk-size', type=int, default=100000, help='rows held in memory at a time')
+    parser.add_argument('-j', '--jobs', type=int, help='worker processes, -1 for one per cpu, one pool serves the whole run')
+    parser.add_argument('--input-format', choices=['csv', 'parquet'], help='default: from the file extension')
+    parser.add_argument('--output-format', choices=['csv', 'parquet'], help='default: from the file extension')
+    parser.add_argument('--sep', default=',', help='csv field separator')
+    parser.add_argument('--score', metavar='WEIGHTS',
+                        help='write an index score instead of the comorbities, the name of bundled weights '
+                             '(e.g. van_walraven) or a csv file with comorbidity and weight columns')
+    parser.add_argument('--stats', action='store_true',
+                        help='print the stage timers and counters (json) to stderr when done')
+    parser.add_argument('--version', action='version', version=F'%(prog)s {__version__}')
+    return parser
+
+
+def _read_weights(score):
+    '''
+    internal function to read the --score option, a csv file of comorbidity, weight or the name of bundled weights
+    '''
+    if score is None or not os.path.isfile(score):
+        return score
+    df = pd.read_csv(score)
+    return dict(zip(df['comorbidity'], df['weight']))
+
+
+def main(argv=None):
+    '''
+    main
+    entry point of the pyelixhauser command
+    param argv: list of command line arguments (defaults to sys.argv[1:])
+    return int, exit status
+    '''
+    parser = _parser()
+    args = parser.parse_args(argv)
+    if args.layout == 'long' and args.id is None:
+        parser.error('--id is required with --layout long')
+    formats = {'input_format': args.input_format, 'output_format': args.output_format, 'sep': args.sep}
+    if args.stats:
+        instrument.enable()
+    pool = None
+    if args.jobs not in (None, 1):
+        pool = batch.process_pool(args.jobs, warmup=schemes.get_module(args.scheme).warmup)
+    try:
+        formats['score'] = _read_weights(args.score)
+        if args.layout == 'long':
+            n_rows = score_long_file(args.input, args.output, args.scheme, args.id, args.codes,
+                                     chunk_size=args.chunk_size, n_jobs=args.jobs, executor=pool, **formats)
+        else:
+            keep_columns = ([args.id] if args.id is not None else []) + args.keep
+            n_rows = score_file(args.input, args.output, args.scheme, args.codes, keep_columns=keep_columns,
+                                chunk_size=args.chunk_size, n_jobs=args.jobs, executor=pool, **formats)
+    except (ImportError, KeyError, OSError, ValueError) as e:
+        parser.exit(1, F'{parser.prog}: error: {e}\n')
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    logger.info('%d rows written to %s', n_rows, args.output)
+    if args.stats:
+        sys.stderr.write(json.dumps(dict(instrument.snapshot(), rows=n_rows), indent=2) + '\n')
+    return 0
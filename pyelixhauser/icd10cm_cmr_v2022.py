@@ -44,24 +44,80 @@ WGHTLOSS = Weight Loss
 '''
 
 
-import pkg_resources
 import pandas as pd
+import numpy as np
 import re
 import logging
+from functools import lru_cache
 from pyelixhauser.setup_logger import logger
-from pyelixhauser.utils import load_resource
+from pyelixhauser.utils import load_resource, open_resource, lazy_attributes, unpack_masks, sparse_masks, popcount
+from pyelixhauser import batch, cache, instrument, memo, tokens
 
 
 _resource_name = "/resources/CMR-Reference-File-v2022-1.csv"
+_compile_version = 1
 _manager = 'pyelixhauser'
-_path = pkg_resources.resource_stream(_manager,_resource_name)
 
-_idc10cm_lookup_df = pd.read_csv(_path, sep='\t', skiprows=1, index_col='ICD-10-CM Diagnosis')\
-.sort_index()\
-.drop('ICD-10-CM Code Description', axis=1)
 
-_feature_names = list(_idc10cm_lookup_df.columns)
-_null_result = pd.Series([0] * _idc10cm_lookup_df.shape[1], index=_feature_names)
+@lru_cache(maxsize=None)
+def _lookup_table():
+    '''
+    internal function to load the CMR reference table from its csv
+    return pandas data frame, index is the icd10cm code, '# Comorbidities' first, then one column per measure
+    '''
+    with open_resource(_resource_name) as f:
+        lookup_df = pd.read_csv(f, sep='\t', skiprows=1, index_col='ICD-10-CM Diagnosis')\
+        .sort_index()\
+        .drop('ICD-10-CM Code Description', axis=1)
+    logger.debug('icd10cm map to ElixhauserComorbidity loaded with %d values', lookup_df.shape[0])
+    return lookup_df
+
+
+def _compile():
+    '''
+    internal function to compile the reference table into the arrays of the hash index
+    return tuple (dict of numpy arrays: codes, bitmask over the measures and '# Comorbidities' count per code;
+    dict of metadata)
+    '''
+    df = _lookup_table()
+    counts = df.iloc[:, 0].to_numpy(dtype=np.int64)
+    flags = df.iloc[:, 1:].to_numpy(dtype=np.uint64)
+    weights = np.left_shift(np.uint64(1), np.arange(flags.shape[1], dtype=np.uint64))
+    masks = (flags * weights).sum(axis=1, dtype=np.uint64)
+    return {'codes': np.array(df.index, dtype=str), 'masks': masks, 'counts': counts}, {'feature_names': list(df.columns)}
+
+
+@lru_cache(maxsize=None)
+@instrument.timed_load('icd10cm_cmr_v2022')
+def _reference():
+    '''
+    internal function to build the lookup index (from the compiled artifact when one is cached),
+    runs on the first lookup (or on warmup) and is cached afterwards
+    return dict of reference tables
+    '''
+    arrays, meta = cache.cached('icd10cm_cmr_v2022', _resource_name, _compile, _compile_version)
+    feature_names = meta['feature_names']
+    return {'feature_names': feature_names,
+            'null_result': pd.Series([0] * len(feature_names), index=feature_names),
+            'code_index': dict(zip(arrays['codes'].tolist(), zip(arrays['masks'].tolist(), arrays['counts'].tolist()))),
+            'n_measures': len(feature_names) - 1}
+
+
+__getattr__ = lazy_attributes(__name__, {'_idc10cm_lookup_df': _lookup_table,
+                                         '_feature_names': lambda: _reference()['feature_names'],
+                                         '_null_result': lambda: _reference()['null_result'],
+                                         '_code_index': lambda: _reference()['code_index'],
+                                         '_n_measures': lambda: _reference()['n_measures']})
+
+
+def warmup():
+    '''
+    warmup
+    function to load the reference table and build the lookup index now instead of on the first lookup
+    (for services that want to pay the start up cost before taking traffic)
+    '''
+    _reference()
+
 
 def _icd10cm_validation(s):
     '''
@@ -73,35 +129,17 @@ def _icd10cm_validation(s):
     '''
 
 
-    s = ' ' + str(s).upper()
-    s = re.sub('[^A-Z0-9.]', ' ', s).strip()
-    s = re.sub('  ', ' ', s).strip()
-    pattern = '^(?i:[A-TV-Z][0-9][0-9AB](?:\.[0-9A-KXZ](?:[0-9A-EXYZ](?:[0-9A-HX][0-59A-HJKMNP-S]?)?)?)?|U07(?:\.[01])?)$'
-    try:
-        results = re.search(pattern, s)
-        return results.group()
-    except AttributeError:
-        logger.debug(F'failed to find an icd10cm in "{s}"')
-        return None
-    except TypeError:
-        logger.debug(F'failed to find an icd10cm in "{s}"')
-        return None
+    runs = tokens.candidates(s, 'icd10cm')
+    return tokens.validate_icd10cm(runs[0]) if len(runs) == 1 else None
 
+@memo.memoize('code')
 def _lookup_comorbility(code):
     '''
     internal function to lookup an icd10cm code  and comorbity
     param s: string (icd10cm code)
-    return  pandas series, index is comorbities
+    return  tuple (bitmask over the measures, '# Comorbidities' count), (0, 0) if the code has no comorbidity
     '''
-    code = re.sub('[.]', '', code)
-    try:
-        result =  _idc10cm_lookup_df.loc[code, :]
-        msg = F"{code}: resolved to comorbity {result.loc[result==1].index}"
-        logger.debug(msg)
-        return result
-    except KeyError:
-        logger.debug(F' Code {code} does not have an associated comorbidity')
-        return _null_result
+    return _reference()['code_index'].get(code.replace('.', ''), (0, 0))
 
 
 def _icd10cm_validated_code_gen(s, split=' '):
@@ -123,20 +161,131 @@ def _icd10cm_validated_code_gen(s, split=' '):
 
 def _comorbidity_gen(s):
     '''
-    internal generator that yields arrays of comorbities
+    internal generator that yields the comorbities of each valid code in a string
     param s: string
-    yield pandas series, index is comorbities
+    yield tuple (bitmask over the measures, '# Comorbidities' count)
+    '''
+    for code in tokens.codes(s, 'icd10cm'):
+        yield _lookup_comorbility(code)
+
+
+@memo.memoize('record')
+def _record_mask(s):
+    '''
+    internal function that ORs together the comorbities of every code in a string
+    param s: string
+    return tuple (bitmask, max '# Comorbidities' count), or None when no valid icd10cm code was found
+    '''
+    mask, count, found = 0, 0, False
+    for code_mask, code_count in _comorbidity_gen(s):
+        mask |= code_mask
+        count = max(count, code_count)
+        found = True
+    if found:
+        return mask, count
+    return None
+
+
+def _to_matrix(masks, counts):
+    '''
+    internal function to expand bitmasks and counts into a result matrix
+    param masks: array like of ints, one bitmask per record
+    param counts: array like of ints, one '# Comorbidities' count per record
+    return numpy int64 array, first column '# Comorbidities' then one column per measure
+    '''
+    counts = np.asarray(counts, dtype=np.int64).reshape(-1, 1)
+    return np.hstack([counts, unpack_masks(masks, _reference()['n_measures']).astype(np.int64)])
+
+
+_token_pattern = '[A-Z0-9.]+'
+
+# present on admission (POA): the measures only counted when their code was present on admission
+# (Elixhauser Comorbidity Software Refined for ICD-10-CM v2022 user guide), CBVD_SQLA and all
+# other measures are exempt
+_poa_dependent = ['ANEMDEF', 'BLDLOSS', 'CBVD_POA', 'COAG', 'HF', 'LIVER_MLD', 'LIVER_SEV', 'NEURO_MOVT',
+                  'NEURO_OTH', 'NEURO_SEIZ', 'PARALYSIS', 'PSYCHOSES', 'PULMCIRC', 'RENLFL_MOD', 'RENLFL_SEV',
+                  'ULCER_PEPTIC', 'VALVE', 'WGHTLOSS']
+# indicators of a code not present on admission (N = no, U = insufficient documentation),
+# Y, W (clinically undetermined), 1 or E (exempt) and missing indicators count as present
+_poa_not_present = ('N', 'U')
+_poa_pattern = '[A-Z0-9]'
+
+
+@memo.memoize('code')
+def _resolve_token(token):
+    '''
+    internal function to validate and lookup a single token
+    param token: string
+    return tuple (bitmask, '# Comorbidities' count, 1), or (0, 0, 0) if the token is not a valid icd10cm code
+    '''
+    code = tokens.validate_icd10cm(token)
+    if code is None:
+        return (0, 0, 0)
+    # the token is already cached at the code level, the lookup itself is not cached a second time
+    return _lookup_comorbility.__wrapped__(code) + (1,)
+
+
+def _poa_mask():
+    '''
+    internal function to build the bitmask of the measures that require the code to be present on admission
+    '''
+    columns = _mask_columns()
+    return np.uint64(sum(1 << columns.index(name) for name in _poa_dependent))
+
+
+def _not_present(indicators):
+    '''
+    internal function to flag POA indicators of codes not present on admission
+    param indicators: array like of strings
+    return numpy bool array
+    '''
+    return np.isin(np.asarray(indicators, dtype=object), _poa_not_present)
+
+
+def _drop_not_present(resolved, not_present):
     '''
-    s = ' ' + str(s).upper()
-    s = re.sub('[^A-Z0-9.]', ' ', s).strip()
-    s = re.sub('  ', ' ', s).strip()
-    gen = _icd10cm_validated_code_gen(s)
-    try:
-        while True:
-            code  = next(gen)
-            yield _lookup_comorbility(code)
-    except StopIteration:
-        return _null_result
+    internal function to clear the POA dependent measures of the codes not present on admission,
+    the '# Comorbidities' count of those codes becomes the number of measures left
+    param resolved: numpy uint64 array, one row (bitmask, '# Comorbidities' count, ...) per code
+    param not_present: numpy bool array, one value per code
+    '''
+    resolved[not_present, 0] &= ~_poa_mask()
+    resolved[not_present, 1] = popcount(resolved[not_present, 0])
+
+
+def _batch_records(array, poa=None):
+    '''
+    internal function to resolve a whole column of strings, each distinct token is only resolved once
+    param array: array like of strings
+    param poa: optional array like of strings, the POA indicators of each string, one character per
+    valid icd10cm code
+    return tuple of numpy arrays, one value per string (bitmask, max '# Comorbidities' count, has a valid code)
+    '''
+    record = instrument.start(__name__)
+    tokens, offsets = batch.tokenize(array, _token_pattern, upper=True)
+    instrument.lap(record, 'tokenize')
+    inverse, uniques = batch.factorize(tokens)
+    instrument.lap(record, 'dedupe')
+    resolved = np.array([_resolve_token(token) for token in uniques], dtype=np.uint64).reshape(-1, 3)[inverse]
+    if poa is not None:
+        indicators, poa_offsets = batch.tokenize(poa, _poa_pattern, upper=True)
+        # the indicators pair with the valid codes only, tokens that are not codes take none
+        valid = resolved[:, 2].astype(bool)
+        code_offsets = np.concatenate([[0], np.cumsum(valid)])[offsets]
+        partners = batch.align_tokens(code_offsets, poa_offsets)
+        indicators = np.append(np.asarray(indicators, dtype=object), '')
+        codes = resolved[valid]
+        _drop_not_present(codes, _not_present(indicators[partners]))
+        resolved[valid] = codes
+    instrument.lap(record, 'resolve')
+    masks = batch.reduce_or(resolved[:, 0], offsets)
+    counts = batch.reduce_max(resolved[:, 1].astype(np.int64), offsets)
+    found = batch.reduce_or(resolved[:, 2], offsets).astype(bool)
+    instrument.lap(record, 'reduce')
+    batch.log_summary(__name__, len(masks), len(tokens), len(uniques), masks)
+    batch.finish_batch(record, masks, resolved[:, 0], len(uniques), valid=resolved[:, 2])
+    return masks, counts, found
+
 
 def comorbidity_from_string(s):
     '''
@@ -150,9 +299,11 @@ def comorbidity_from_string(s):
 
 
     '''
-
-    results = pd.DataFrame(list(_comorbidity_gen(s)), columns=_feature_names)
-    return results.max(axis=0)
+    feature_names = _reference()['feature_names']
+    record = _record_mask(s)
+    if record is None:
+        return pd.DataFrame([], columns=feature_names).max(axis=0)
+    return pd.Series(_to_matrix([record[0]], [record[1]])[0], index=feature_names)
 
 
 def get_elix(s):
@@ -175,11 +326,27 @@ def get_elix(s):
         return  ' | '.join(array.loc[array == 1].index)
     else:
         return None
-def comorbidity_from_array(array):
+def _records(array, poa, n_jobs, executor):
+    '''
+    internal function to resolve a whole column of strings, with their POA indicators when given
+    return tuple of numpy arrays, see _batch_records
+    '''
+    if poa is None:
+        return batch.parallel(_batch_records, array, n_jobs=n_jobs, executor=executor, warmup=warmup)
+    if len(poa) != len(array):
+        raise ValueError(F'poa has {len(poa)} values for {len(array)} strings')
+    return batch.parallel(_batch_records, array, poa, n_jobs=n_jobs, executor=executor, warmup=warmup)
+
+
+def comorbidity_from_array(array, n_jobs=None, executor=None, poa=None):
     '''
     comorbidity_from_string
     function to detect comorbities from a string if icd10cm codes
     param s: string (icd10cm codes shoulld be seperated with , or space )
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    param poa: optional array like of strings, the present on admission indicators of each string,
+    one character per valid icd10cm code in the same order (e.g. 'YNY' or 'Y N Y'), see comorbidity_matrix
     yield pandas series, index is comorbities
 
     example usage:
@@ -187,7 +354,160 @@ def comorbidity_from_array(array):
 
 
     '''
+    feature_names = _reference()['feature_names']
+    masks, counts, found = _records(array, poa, n_jobs, executor)
+    if len(masks) == 0:
+        return pd.DataFrame([], columns=feature_names)
+    results = _to_matrix(masks, counts)
+    if not found.all():
+        # records without a valid code have always been reported as NaN
+        results = results.astype(np.float64)
+        results[~found, :] = np.nan
+    return pd.DataFrame(results, columns=feature_names)
+
+
+def comorbidity_matrix(array, as_frame=False, n_jobs=None, executor=None, sparse=False, poa=None):
+    '''
+    comorbidity_matrix
+    function to detect comorbities for a whole column of strings at once,
+    each distinct code in the column is only validated and looked up once
+    param array: list, numpy array or pandas series of strings (icd10cm codes shoulld be seperated with , or space )
+    param as_frame: bool, return a pandas data frame wrapping the matrix (without copying it)
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    param sparse: bool, return a scipy.sparse csr_matrix (or with as_frame a pandas sparse data frame),
+    built from the hits of each string without building the dense matrix
+    param poa: optional array like of strings, the present on admission indicators of each string,
+    one character per valid icd10cm code in the same order (e.g. 'YNY' or 'Y N Y'), tokens that are
+    not valid codes take no indicator; the POA dependent measures (_poa_dependent, e.g. CBVD_POA or HF)
+    of a code flagged N or U are dropped, other indicators and codes without an indicator count as present
+    returns numpy uint8 array, one row per string, first column '# Comorbidities' then one column per measure
+    (strings without a valid icd10cm code are all zeros)
+
+    example usage:
+    comorbidity_matrix(['E11.9 Z23, Z20.828', 'J30.1', 'N18.3'])
+
+
+    '''
+    reference = _reference()
+    masks, counts, _ = _records(array, poa, n_jobs, executor)
+    if sparse:
+        csr = sparse_masks(masks, reference['n_measures'], counts=counts.astype(np.uint8))
+        return batch.to_sparse(csr, reference['feature_names'], as_frame=as_frame)
+    results = np.empty((len(masks), len(reference['feature_names'])), dtype=np.uint8)
+    results[:, 0] = counts
+    results[:, 1:] = unpack_masks(masks, reference['n_measures'])
+    if as_frame:
+        return batch.to_frame(results, reference['feature_names'])
+    return results
+
+
+def comorbidity_masks(array, n_jobs=None, executor=None, poa=None):
+    '''
+    comorbidity_masks
+    function to detect comorbities for a whole column of strings as compact bitmasks
+    (see pyelixhauser.bitmask for set operations and conversion to the pandas output)
+    param array: list, numpy array or pandas series of strings (icd10cm codes shoulld be seperated with , or space )
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    param poa: optional array like of strings, the present on admission indicators, see comorbidity_matrix
+    returns numpy uint64 array, one bitmask per string, bit j is measure j (the '# Comorbidities' count is not included)
+
+    example usage:
+    comorbidity_masks(['E11.9 Z23, Z20.828', 'J30.1', 'N18.3'])
+
+
+    '''
+    masks, _, _ = _records(array, poa, n_jobs, executor)
+    return masks
 
-    results = list(map(comorbidity_from_string, array))
-    return pd.DataFrame(results, columns=_feature_names)
 
+def get_elix_array(array, n_jobs=None, executor=None, poa=None):
+    '''
+    get_elix_array
+    function to detect comorbities for a whole column of strings as labels, the same as get_elix on
+    each string, built from the bitmasks without a series per string
+    param array: list, numpy array or pandas series of strings (icd10cm codes shoulld be seperated with , or space )
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    param poa: optional array like of strings, the present on admission indicators, see comorbidity_matrix
+    returns numpy object array, one label per string (comorbities joined with ' | ', None when there is none)
+
+    example usage:
+    get_elix_array(['E11.9 N18.3', 'J30.1', ''])
+
+
+    '''
+    masks = comorbidity_masks(array, n_jobs=n_jobs, executor=executor, poa=poa)
+    return batch.mask_labels(masks, _mask_columns())
+
+
+def _mask_columns():
+    '''
+    internal function to list the measures represented by the bits of the masks
+    '''
+    return list(_reference()['feature_names'][1:])
+
+
+def _long_records(ids, codes, poa=None):
+    '''
+    internal function to resolve long format data (one code per row) to one bitmask and
+    '# Comorbidities' count per id
+    param poa: optional array like of the POA indicator of each row
+    return tuple (pandas index of the distinct ids, numpy uint64 array of masks, numpy int64 array of counts)
+    '''
+    record = instrument.start(__name__)
+    groups, unique_ids = batch.group_ids(ids)
+    instrument.lap(record, 'group')
+    inverse, uniques = batch.factorize_codes(codes)
+    instrument.lap(record, 'dedupe')
+    resolved = np.array([_record_mask(code) or (0, 0) for code in uniques], dtype=np.uint64).reshape(-1, 2)[inverse]
+    if poa is not None:
+        _drop_not_present(resolved, _not_present(batch.as_strings(poa).str.strip().str.upper()))
+    instrument.lap(record, 'resolve')
+    counts = batch.group_reduce_max(resolved[:, 1].astype(np.int64), groups, len(unique_ids))
+    masks = batch.group_reduce_or(resolved[:, 0], groups, len(unique_ids))
+    instrument.lap(record, 'reduce')
+    batch.log_summary(__name__, len(unique_ids), len(groups), len(uniques), masks)
+    batch.finish_batch(record, masks, resolved[:, 0], len(uniques))
+    return unique_ids, masks, counts
+
+
+def _long_masks(ids, codes):
+    '''
+    internal function to resolve long format data (one code per row) to one bitmask per id
+    return tuple (pandas index of the distinct ids, numpy uint64 array)
+    '''
+    ids, masks, _ = _long_records(ids, codes)
+    return ids, masks
+
+
+def comorbidity_from_long(df, id_col, code_col, sparse=False, poa_col=None):
+    '''
+    comorbidity_from_long
+    function to detect comorbities from long format data (one icd10cm code per row),
+    each distinct code is only validated and looked up once and the rows are combined per id
+    param df: pandas data frame
+    param id_col: name of the column identifying the patient or encounter
+    param code_col: name of the column containing the icd10cm code
+    param sparse: bool, return a data frame of Sparse[uint8, 0] columns (the dense matrix is never built)
+    param poa_col: optional name of the column containing the present on admission indicator of the code,
+    the POA dependent measures of codes flagged N or U are dropped (blank or missing counts as present)
+    returns pandas data frame (uint8), one row per id, index is the ids,
+    first column '# Comorbidities' then one column per measure
+
+    example usage:
+    comorbidity_from_long(pd.DataFrame({'id': [1, 1, 2], 'code': ['E11.9', 'N18.3', 'Z20.828']}), 'id', 'code')
+
+
+    '''
+    reference = _reference()
+    poa = None if poa_col is None else df.loc[:, poa_col]
+    ids, masks, counts = _long_records(df.loc[:, id_col], df.loc[:, code_col], poa)
+    if sparse:
+        csr = sparse_masks(masks, reference['n_measures'], counts=counts.astype(np.uint8))
+        return batch.to_sparse(csr, reference['feature_names'], as_frame=True, index=ids)
+    results = np.empty((len(ids), len(reference['feature_names'])), dtype=np.uint8)
+    results[:, 0] = counts
+    results[:, 1:] = unpack_masks(masks, reference['n_measures'])
+    return batch.to_frame(results, reference['feature_names'], index=ids)
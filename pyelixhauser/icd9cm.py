@@ -32,25 +32,26 @@ example inputs ; 532.91, 533.41,
 '''
 
 
-import pkg_resources
 import pandas as pd
+import numpy as np
 import re
 import logging
+from functools import lru_cache
 from pyelixhauser.setup_logger import logger
-from pyelixhauser.utils import load_resource
+from pyelixhauser.utils import load_resource, open_resource, lazy_attributes, unpack_masks, sparse_masks, compile_intervals, interval_mask
+from pyelixhauser import batch, cache, instrument, memo
 
 
 _resource_name = "/resources/icd9cm_elixhauser.csv"
+_compile_version = 1
 _manager = 'pyelixhauser'
-_path = pkg_resources.resource_stream(_manager,_resource_name)
 
-_icd9cm_lookup_df = pd.read_csv(_path)
-_feature_names = _icd9cm_lookup_df.loc[:, 'Comorbidities']
-_feature_names = [n.replace('\n', ' ' ).strip() for n in _feature_names]
 
 
+_code_pattern = 'V?[0-9]+[.]?x?[0-9]*'
 
-def _parse_codes(s, pattern='V?[0-9]+[.]?x?[0-9]*'):
+
+def _parse_codes(s, pattern=_code_pattern):
     return re.findall(pattern, s)
 
 assert _parse_codes('490.x-505.x') == ['490.x', '505.x']
@@ -70,7 +71,7 @@ def _isin_range(s, min_code, max_code):
         try:
             v = float(s)
         except ValueError:
-            logger.debug(F'input string  {s} to _isin_range in not in range {min_code, max_code}')
+            logger.debug('input string  %s to _isin_range in not in range %s', s, (min_code, max_code))
             return False
 
         if all(('x' in min_code, 'x' in max_code)):
@@ -82,7 +83,7 @@ def _isin_range(s, min_code, max_code):
                 else:
                     return False
             except ValueError:
-                logger.debug(F'input string  {s} to _isin_range in not in range {min_code, max_code}')
+                logger.debug('input string  %s to _isin_range in not in range %s', s, (min_code, max_code))
                 return False
         else:
             try:
@@ -124,6 +125,140 @@ def _icd9_str_has_comorbity(input_str, ref_str):
 
 
 
+def _range_bounds(min_code, max_code):
+    '''
+    internal function to convert a reference range into numeric bounds,
+    following the same rules as _isin_range
+    param min_code: string, first code of the range
+    param max_code: string, last code of the range
+    return tuple (lower, upper) of the half open range [lower, upper), or None if no code can fall in the range
+    '''
+    min_code = str(min_code).lower().replace('\n', '').replace('\t', '').strip()
+    max_code = str(max_code).lower().replace('\n', '').replace('\t', '').strip()
+    try:
+        if all(('x' in min_code, 'x' in max_code)):
+            return float(re.sub('x', '', min_code)), float(re.sub('x', '', max_code)) + 1
+        return float(min_code), float(max_code)
+    except ValueError:
+        return None
+
+
+def _compile_reference(ref_str_array):
+    '''
+    internal function to parse the "Enhanced ICD-9-CM" reference strings once
+    param ref_str_array: array of reference strings, one per comorbidity
+    return tuple (dict of exact codes -> bitmask, interval bounds, interval bitmasks),
+    bit i of each bitmask is the comorbidity in row i of the reference table
+    '''
+    exact_codes = {}
+    intervals = []
+    for i, ref_str in enumerate(ref_str_array):
+        bit = 1 << i
+        for ref_code_range in ref_str.replace('\n', '').split(','):
+            reference_codes = _parse_codes(ref_code_range.strip())
+            if len(reference_codes) == 1 and 'x' not in reference_codes[0]:
+                exact_codes[reference_codes[0]] = exact_codes.get(reference_codes[0], 0) | bit
+                continue
+            elif len(reference_codes) == 1:
+                bounds = _range_bounds(reference_codes[0], reference_codes[0])
+            elif len(reference_codes) == 2:
+                bounds = _range_bounds(reference_codes[0], reference_codes[1])
+            elif len(reference_codes) == 0:
+                continue
+            else:
+                raise ValueError(F" multipe reference code {reference_codes } ranges with 3 or more codes not supported")
+            if bounds is not None:
+                intervals.append(bounds + (bit,))
+    bounds, masks = compile_intervals(intervals)
+    return exact_codes, bounds, masks
+
+
+@lru_cache(maxsize=None)
+def _lookup_table():
+    '''
+    internal function to load the reference table from its csv
+    return pandas data frame with the 'Comorbidities' and 'Enhanced ICD-9-CM' columns
+    '''
+    with open_resource(_resource_name) as f:
+        return pd.read_csv(f)
+
+
+def _compile():
+    '''
+    internal function to compile the reference table into the arrays of the interval index
+    return tuple (dict of numpy arrays: exact codes and their bitmasks, interval bounds and segment bitmasks;
+    dict of metadata)
+    '''
+    lookup_df = _lookup_table()
+    feature_names = [n.replace('\n', ' ' ).strip() for n in lookup_df.loc[:, 'Comorbidities']]
+    exact_codes, interval_bounds, interval_masks = _compile_reference(lookup_df.loc[:, "Enhanced ICD-9-CM"])
+    arrays = {'exact_codes': np.array(list(exact_codes), dtype=str),
+              'exact_masks': np.array(list(exact_codes.values()), dtype=np.uint64),
+              'interval_bounds': np.array(interval_bounds, dtype=np.float64),
+              'interval_masks': np.array(interval_masks, dtype=np.uint64)}
+    return arrays, {'feature_names': feature_names}
+
+
+@lru_cache(maxsize=None)
+@instrument.timed_load('icd9cm')
+def _reference():
+    '''
+    internal function to build the interval index (from the compiled artifact when one is cached),
+    runs on the first lookup (or on warmup) and is cached afterwards
+    return dict of reference tables
+    '''
+    arrays, meta = cache.cached('icd9cm', _resource_name, _compile, _compile_version)
+    return {'feature_names': meta['feature_names'],
+            'exact_codes': dict(zip(arrays['exact_codes'].tolist(), arrays['exact_masks'].tolist())),
+            'interval_bounds': arrays['interval_bounds'].tolist(),
+            'interval_masks': arrays['interval_masks'].tolist()}
+
+
+__getattr__ = lazy_attributes(__name__, {'_icd9cm_lookup_df': _lookup_table,
+                                         '_feature_names': lambda: _reference()['feature_names'],
+                                         '_exact_codes': lambda: _reference()['exact_codes'],
+                                         '_interval_bounds': lambda: _reference()['interval_bounds'],
+                                         '_interval_masks': lambda: _reference()['interval_masks']})
+
+
+def warmup():
+    '''
+    warmup
+    function to load the reference table and compile the lookup index now instead of on the first lookup
+    (for services that want to pay the start up cost before taking traffic)
+    '''
+    _reference()
+
+
+@memo.memoize('code')
+def _code_mask(code):
+    '''
+    internal function to lookup all comorbities of a single parsed icd9cm code
+    param code: string (as returned by _parse_codes)
+    return int, bitmask over the rows of the reference table
+    '''
+    reference = _reference()
+    mask = reference['exact_codes'].get(code, 0)
+    try:
+        value = float(code)
+    except ValueError:
+        return mask
+    return mask | interval_mask(reference['interval_bounds'], reference['interval_masks'], value)
+
+
+@memo.memoize('record')
+def _record_mask(s):
+    '''
+    internal function that ORs together the comorbities of every code in a string
+    param s: string
+    return int, bitmask over the rows of the reference table
+    '''
+    mask = 0
+    for code in _parse_codes(s):
+        mask |= _code_mask(code)
+    return mask
+
+
 def comorbidity_from_string(s):
     '''
     comorbidity_from_string
@@ -136,9 +271,10 @@ def comorbidity_from_string(s):
 
 
     '''
-    ref_str_array = _icd9cm_lookup_df.loc[:, "Enhanced ICD-9-CM"]
-    results = list(map(lambda x: _icd9_str_has_comorbity(s, x), ref_str_array))
-    return pd.Series(results, index=_feature_names).replace({True:1, False:0})
+    feature_names = _reference()['feature_names']
+    mask = _record_mask(s)
+    results = [bool((mask >> i) & 1) for i in range(len(feature_names))]
+    return pd.Series(results, index=feature_names).replace({True:1, False:0})
 
 def get_elix(s):
     '''
@@ -160,11 +296,13 @@ def get_elix(s):
     else:
         return None
 
-def comorbidity_from_array(array):
+def comorbidity_from_array(array, n_jobs=None, executor=None):
     '''
     comorbidity_from_string
     function to detect comorbities from a string if icd10cm codes
     param s: string (icd10cm codes shoulld be seperated with , or space )
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
     yield pandas series, index is comorbities from ICD9 cm codes
 
     example usage:
@@ -173,6 +311,120 @@ def comorbidity_from_array(array):
 
     '''
 
-    results = list(map(comorbidity_from_string, array))
-    return pd.DataFrame(results, columns=_feature_names)
+    feature_names = _reference()['feature_names']
+    results = comorbidity_matrix(array, n_jobs=n_jobs, executor=executor)
+    if results.shape[0] == 0:
+        return pd.DataFrame([], columns=feature_names)
+    return pd.DataFrame(results.astype(np.int64), columns=feature_names)
+
+
+def _batch_masks(array):
+    '''
+    internal function to resolve a column of strings to one bitmask per string
+    param array: array like of strings
+    return numpy uint64 array
+    '''
+    return batch.record_masks(array, _code_pattern, _code_mask)
+
 
+def comorbidity_matrix(array, as_frame=False, n_jobs=None, executor=None, sparse=False):
+    '''
+    comorbidity_matrix
+    function to detect comorbities for a whole column of strings at once,
+    each distinct code in the column is only looked up once
+    param array: list, numpy array or pandas series of strings (codes shoulld be seperated with , or space )
+    param as_frame: bool, return a pandas data frame wrapping the matrix (without copying it)
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    param sparse: bool, return a scipy.sparse csr_matrix (or with as_frame a pandas sparse data frame),
+    built from the hits of each string without building the dense matrix
+    returns numpy uint8 array, one row per string, one column per comorbity
+
+    example usage:
+    comorbidity_matrix(['490.1 | 506.0', '175', 'V45.1'])
+
+
+    '''
+    feature_names = _reference()['feature_names']
+    masks = batch.parallel(_batch_masks, array, n_jobs=n_jobs, executor=executor, warmup=warmup)
+    if sparse:
+        return batch.to_sparse(sparse_masks(masks, len(feature_names)), feature_names, as_frame=as_frame)
+    results = unpack_masks(masks, len(feature_names))
+    if as_frame:
+        return batch.to_frame(results, feature_names)
+    return results
+
+
+def comorbidity_masks(array, n_jobs=None, executor=None):
+    '''
+    comorbidity_masks
+    function to detect comorbities for a whole column of strings as compact bitmasks
+    (see pyelixhauser.bitmask for set operations and conversion to the pandas output)
+    param array: list, numpy array or pandas series of strings (codes shoulld be seperated with , or space )
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    returns numpy uint64 array, one bitmask per string, bit j is comorbity j
+
+    example usage:
+    comorbidity_masks(['490.1 | 506.0', '175', 'V45.1'])
+
+
+    '''
+    return batch.parallel(_batch_masks, array, n_jobs=n_jobs, executor=executor, warmup=warmup)
+
+
+def get_elix_array(array, n_jobs=None, executor=None):
+    '''
+    get_elix_array
+    function to detect comorbities for a whole column of strings as labels, the same as get_elix on
+    each string, built from the bitmasks without a series per string
+    param array: list, numpy array or pandas series of strings (icd9cm codes shoulld be seperated with , or space )
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    returns numpy object array, one label per string (comorbities joined with ' | ', None when there is none)
+
+    example usage:
+    get_elix_array(['428.0 401.1', '490.1', ''])
+
+
+    '''
+    masks = comorbidity_masks(array, n_jobs=n_jobs, executor=executor)
+    return batch.mask_labels(masks, _mask_columns())
+
+
+def _mask_columns():
+    '''
+    internal function to list the comorbities represented by the bits of the masks
+    '''
+    return list(_reference()['feature_names'])
+
+
+def _long_masks(ids, codes):
+    '''
+    internal function to resolve long format data (one code per row) to one bitmask per id
+    return tuple (pandas index of the distinct ids, numpy uint64 array)
+    '''
+    return batch.long_record_masks(ids, codes, _record_mask)
+
+
+def comorbidity_from_long(df, id_col, code_col, sparse=False):
+    '''
+    comorbidity_from_long
+    function to detect comorbities from long format data (one icd9cm code per row),
+    each distinct code is only looked up once and the rows are combined per id
+    param df: pandas data frame
+    param id_col: name of the column identifying the patient or encounter
+    param code_col: name of the column containing the icd9cm code
+    param sparse: bool, return a data frame of Sparse[uint8, 0] columns (the dense matrix is never built)
+    returns pandas data frame (uint8), one row per id, index is the ids, columns are comorbities
+
+    example usage:
+    comorbidity_from_long(pd.DataFrame({'id': [1, 1, 2], 'code': ['490.1', 'V45.1', '175']}), 'id', 'code')
+
+
+    '''
+    feature_names = _reference()['feature_names']
+    ids, masks = _long_masks(df.loc[:, id_col], df.loc[:, code_col])
+    if sparse:
+        return batch.to_sparse(sparse_masks(masks, len(feature_names)), feature_names, as_frame=True, index=ids)
+    return batch.to_frame(unpack_masks(masks, len(feature_names)), feature_names, index=ids)
@@ -0,0 +1,221 @@
+'''
+pyelixhauser instrument module contains
+optional instrumentation of the batch functions, off by default
+
+when enabled, every batch resolved by a scheme records
+    timers: seconds spent per stage (tokenize, dedupe, resolve, reduce, and group for long format data)
+    counters: records, tokens, distinct_tokens, valid_tokens (tokens that are codes of the scheme),
+    tokens_with_comorbidity, records_with_comorbidity, cache_hits and cache_misses (see pyelixhauser.memo)
+building the outputs (assemble) and reading and writing files (read, write) are timed as well, and the
+time to load each reference table is always recorded (it happens once per process)
+
+the totals are returned by snapshot(), and a callback passed to enable() receives the record of every
+batch as it finishes, e.g. to export them to a metrics system. When disabled the instrumented functions
+only check a flag once per batch. Batches resolved in worker processes (n_jobs) are not recorded
+
+example usage:
+enable(callback=lambda batch: print(batch['name'], batch['timers'], batch['counters']))
+comorbidity_matrix(df['diagnosis_codes'])
+snapshot()   # {'timers': {'tokenize': ..., ...}, 'counters': {...}, 'load_times': {...}, 'modules': {...}}
+disable()
+'''
+
+from functools import wraps
+from threading import Lock
+from time import perf_counter
+from pyelixhauser import memo
+
+_lock = Lock()
+_enabled = False
+_callback = None
+_totals = {'timers': {}, 'counters': {}, 'modules': {}}
+# module -> seconds to load its reference table, recorded whether instrumentation is enabled or not
+_load_times = {}
+
+
+def enable(callback=None):
+    '''
+    enable
+    function to turn instrumentation on
+    param callback: optional function called with the record of every batch, a dict with keys
+    name (module of the scheme), timers (stage -> seconds) and counters (counter -> int)
+    '''
+    global _enabled, _callback
+    with _lock:
+        _enabled, _callback = True, callback
+
+
+def disable():
+    '''
+    disable
+    function to turn instrumentation off (the totals are kept until reset)
+    '''
+    global _enabled, _callback
+    with _lock:
+        _enabled, _callback = False, None
+
+
+def enabled():
+    '''
+    enabled
+    return bool, whether instrumentation is on
+    '''
+    return _enabled
+
+
+def reset():
+    '''
+    reset
+    function to set the totals back to zero (the reference load times are kept)
+    '''
+    with _lock:
+        _totals.update({'timers': {}, 'counters': {}, 'modules': {}})
+
+
+def snapshot():
+    '''
+    snapshot
+    function to report the totals since instrumentation was enabled (or reset)
+    return dict with keys timers (stage -> seconds), counters (counter -> int), load_times (module -> seconds)
+    and modules (module -> dict of its own timers and counters)
+    '''
+    with _lock:
+        return {'timers': dict(_totals['timers']), 'counters': dict(_totals['counters']),
+                'load_times': dict(_load_times),
+                'modules': {name: {'timers': dict(totals['timers']), 'counters': dict(totals['counters'])}
+                            for name, totals in _totals['modules'].items()}}
+
+
+def _add(target, values):
+    '''
+    internal function to add a dict of values into a dict of totals
+    '''
+    for key, value in values.items():
+        target[key] = target.get(key, 0) + value
+
+
+def _cache_hits():
+    '''
+    internal function to read the hit and miss counters of the memo caches
+    '''
+    cache_stats = memo.stats().values()
+    return sum(level['hits'] for level in cache_stats), sum(level['misses'] for level in cache_stats)
+
+
+def start(name):
+    '''
+    start
+    function to begin the record of a batch
+    param name: string, module of the scheme
+    return dict, the record to pass to lap and finish, None when instrumentation is off
+    '''
+    if not _enabled:
+        return None
+    return {'name': name, 'timers': {}, 'counters': {}, 'cache': _cache_hits(), 'last': perf_counter()}
+
+
+def lap(record, stage):
+    '''
+    lap
+    function to charge the time since the previous lap (or start) to a stage of a batch
+    param record: dict from start, or None
+    param stage: string
+    '''
+    if record is None:
+        return
+    now = perf_counter()
+    record['timers'][stage] = record['timers'].get(stage, 0.0) + now - record['last']
+    record['last'] = now
+
+
+def finish(record, **counters):
+    '''
+    finish
+    function to end the record of a batch, add it to the totals and pass it to the callback
+    param record: dict from start
+    param counters: the counters of the batch, e.g. records=..., tokens=...
+    '''
+    hits, misses = _cache_hits()
+    counters['cache_hits'] = hits - record['cache'][0]
+    counters['cache_misses'] = misses - record['cache'][1]
+    batch = {'name': record['name'], 'timers': record['timers'], 'counters': counters}
+    with _lock:
+        _add(_totals['timers'], batch['timers'])
+        _add(_totals['counters'], counters)
+        totals = _totals['modules'].setdefault(batch['name'], {'timers': {}, 'counters': {}})
+        _add(totals['timers'], batch['timers'])
+        _add(totals['counters'], counters)
+        callback = _callback
+    if callback is not None:
+        callback(batch)
+
+
+def add_time(stage, seconds):
+    '''
+    add_time
+    function to charge time to a stage outside of a batch record (e.g. reading a file)
+    param stage: string
+    param seconds: float
+    '''
+    with _lock:
+        _add(_totals['timers'], {stage: seconds})
+
+
+def timed(stage):
+    '''
+    timed
+    decorator to charge the time of every call of a function to a stage, when instrumentation is on
+    param stage: string
+    return decorator
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            began = perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                add_time(stage, perf_counter() - began)
+        return wrapper
+    return decorator
+
+
+def timed_iter(iterable, stage):
+    '''
+    timed_iter
+    generator to charge the time taken to produce each item of an iterable to a stage, when instrumentation is on
+    param iterable: e.g. the chunks of a file
+    param stage: string
+    yields the items of iterable
+    '''
+    iterator = iter(iterable)
+    while True:
+        began = perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        if _enabled:
+            add_time(stage, perf_counter() - began)
+        yield item
+
+
+def timed_load(name):
+    '''
+    timed_load
+    decorator to record the time a module takes to load its reference table
+    param name: string, module name
+    return decorator
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper():
+            began = perf_counter()
+            result = func()
+            with _lock:
+                _load_times[name] = perf_counter() - began
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,249 @@
+'''
+pyelixhauser lookback module contains
+an incremental accumulator of comorbities per patient over a rolling lookback window
+
+instead of re-scoring the whole history of a patient every time a claim arrives, the state keeps
+the coded events inside the window and, per patient, a count of the events flagging each comorbity.
+Ingesting an event adds 1 to the counts of its comorbities, expiring it subtracts 1, so the current
+flags (count > 0) and scores are always up to date without going back to the history
+
+the state is a dict of numpy arrays (see create), snapshot and restore copy it so it can be
+pickled or kept as a checkpoint
+
+example usage:
+state = create('cmr2022', window='365D')
+ingest(state, df['patient_id'], df['service_date'], df['diagnosis_codes'])
+flags(state)   # one row per patient, as bitmask.to_pandas
+score(state, weights={'HF': 15, 'CANCER_METS': 23})
+data = snapshot(state)
+state = restore(data)
+'''
+
+import numpy as np
+import pandas as pd
+from pyelixhauser import bitmask, scores
+from pyelixhauser.utils import unpack_masks
+
+_format_version = 1
+
+
+def create(scheme, window, expire_on_ingest=True):
+    '''
+    create
+    function to create an empty accumulator
+    param scheme: string, one of pyelixhauser.schemes.names
+    param window: length of the lookback, a pandas timedelta (or string, e.g. '365D') for datetime
+    timestamps, or a number for numeric timestamps (e.g. days)
+    param expire_on_ingest: bool, expire the events that fell out of the window after every ingest,
+    relative to the latest timestamp ingested
+    return dict, the state of the accumulator
+    '''
+    numeric = isinstance(window, (int, float, np.integer, np.floating))
+    width = len(bitmask.columns(scheme))
+    return {'version': _format_version, 'scheme': scheme, 'numeric': numeric,
+            'window': window if numeric else pd.Timedelta(window).value,
+            'expire_on_ingest': expire_on_ingest, 'now': None,
+            'ids': [], 'rows': {}, 'counts': np.zeros((0, width), dtype=np.int32),
+            'event_times': np.zeros(0, dtype=np.float64 if numeric else np.int64),
+            'event_rows': np.zeros(0, dtype=np.int64), 'event_masks': np.zeros(0, dtype=np.uint64)}
+
+
+def _times(state, times):
+    '''
+    internal function to convert timestamps to the numbers stored in the state
+    (datetimes are stored as int64 nanoseconds)
+    '''
+    if state['numeric']:
+        return np.asarray(times, dtype=np.float64).reshape(-1)
+    return pd.to_datetime(pd.Series(np.asarray(times, dtype=object).reshape(-1))).to_numpy('datetime64[ns]').view(np.int64)
+
+
+def _rows(state, ids):
+    '''
+    internal function to find the row of each id in the counts, adding rows for new ids
+    '''
+    inverse, uniques = pd.factorize(np.asarray(ids, dtype=object).reshape(-1))
+    rows = state['rows']
+    new_ids = [patient for patient in uniques.tolist() if patient not in rows]
+    if new_ids:
+        for patient in new_ids:
+            rows[patient] = len(state['ids'])
+            state['ids'].append(patient)
+        # the counts keep spare rows and grow geometrically, so new patients are amortized O(1)
+        counts = state['counts']
+        if len(state['ids']) > len(counts):
+            grown = np.zeros((max(len(state['ids']), 2 * len(counts)), counts.shape[1]), dtype=np.int32)
+            grown[:len(counts)] = counts
+            state['counts'] = grown
+    return np.array([rows[patient] for patient in uniques.tolist()], dtype=np.int64)[inverse]
+
+
+def ingest(state, ids, times, codes, n_jobs=None):
+    '''
+    ingest
+    function to add coded events (e.g. the diagnosis codes of a claim) to the accumulator
+    param state: dict from create
+    param ids: array like of patient ids, one per event
+    param times: array like of timestamps, one per event
+    param codes: array like of strings, the codes of each event (codes shoulld be seperated with , or space )
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    return dict, the state
+    '''
+    return ingest_masks(state, ids, times, bitmask.encode(codes, state['scheme'], n_jobs=n_jobs))
+
+
+def ingest_masks(state, ids, times, masks):
+    '''
+    ingest_masks
+    function to add events already encoded as bitmasks (see pyelixhauser.bitmask) to the accumulator
+    param state: dict from create
+    param ids: array like of patient ids, one per event
+    param times: array like of timestamps, one per event
+    param masks: array like of uint64 bitmasks, one per event
+    return dict, the state
+    '''
+    rows = _rows(state, ids)
+    times = _times(state, times)
+    masks = np.asarray(masks, dtype=np.uint64).reshape(-1)
+    if not len(rows) == len(times) == len(masks):
+        raise ValueError(F'{len(rows)} ids, {len(times)} times and {len(masks)} events do not match')
+    if len(times) == 0:
+        return state
+    latest = times.max()
+    state['now'] = latest if state['now'] is None else max(state['now'], latest)
+    # events without a comorbity never change the flags, only their patients are kept
+    keep = masks != 0
+    rows, times, masks = rows[keep], times[keep], masks[keep]
+    np.add.at(state['counts'], rows, unpack_masks(masks, state['counts'].shape[1]).astype(np.int32))
+    # the events are kept sorted by time, only the new events are sorted and inserted after the
+    # stored events with the same time, without sorting the store again
+    order = np.argsort(times, kind='stable')
+    rows, times, masks = rows[order], times[order], masks[order]
+    positions = np.searchsorted(state['event_times'], times, side='right')
+    state['event_times'] = np.insert(state['event_times'], positions, times)
+    state['event_rows'] = np.insert(state['event_rows'], positions, rows)
+    state['event_masks'] = np.insert(state['event_masks'], positions, masks)
+    if state['expire_on_ingest']:
+        expire(state)
+    return state
+
+
+def expire(state, now=None):
+    '''
+    expire
+    function to drop the events that fell out of the window, an event at time t is kept while t > now - window
+    param state: dict from create
+    param now: timestamp the window ends at (defaults to the latest timestamp ingested)
+    return int, number of events dropped
+    '''
+    if now is None:
+        now = state['now']
+        if now is None:
+            return 0
+    else:
+        now = _times(state, [now])[0]
+    n_expired = int(np.searchsorted(state['event_times'], now - state['window'], side='right'))
+    if n_expired:
+        masks = state['event_masks'][:n_expired]
+        np.subtract.at(state['counts'], state['event_rows'][:n_expired],
+                       unpack_masks(masks, state['counts'].shape[1]).astype(np.int32))
+        for key in ('event_times', 'event_rows', 'event_masks'):
+            state[key] = state[key][n_expired:]
+    return n_expired
+
+
+def _selected(state, ids):
+    '''
+    internal function to select the rows of some ids (all ids by default)
+    return tuple (numpy int64 array of rows, pandas index of the ids)
+    '''
+    if ids is None:
+        return np.arange(len(state['ids'])), pd.Index(state['ids'])
+    ids = list(ids)
+    unknown = [patient for patient in ids if patient not in state['rows']]
+    if unknown:
+        raise KeyError(F'unknown ids {unknown[:10]}')
+    return np.array([state['rows'][patient] for patient in ids], dtype=np.int64), pd.Index(ids)
+
+
+def counts(state, ids=None):
+    '''
+    counts
+    function to report the number of events in the window flagging each comorbity
+    param state: dict from create
+    param ids: optional list of patient ids (all patients by default)
+    return pandas data frame (int32), one row per patient, one column per comorbity
+    '''
+    rows, index = _selected(state, ids)
+    return pd.DataFrame(state['counts'][rows], index=index, columns=bitmask.columns(state['scheme']))
+
+
+def masks(state, ids=None):
+    '''
+    masks
+    function to report the current comorbities of each patient as bitmasks
+    param state: dict from create
+    param ids: optional list of patient ids (all patients by default)
+    return pandas series of uint64, index is the patient ids
+    '''
+    rows, index = _selected(state, ids)
+    flagged = state['counts'][rows] > 0
+    values = np.bitwise_or.reduce(flagged.astype(np.uint64) << np.arange(flagged.shape[1], dtype=np.uint64), axis=1)
+    return pd.Series(values.reshape(-1), index=index, dtype=np.uint64)
+
+
+def flags(state, ids=None):
+    '''
+    flags
+    function to report the current comorbities of each patient, in the output format of the scheme
+    (see bitmask.to_pandas, the cmr2022 '# Comorbidities' is the number of measures flagged)
+    param state: dict from create
+    param ids: optional list of patient ids (all patients by default)
+    return pandas data frame (int64), one row per patient
+    '''
+    current = masks(state, ids)
+    return bitmask.to_pandas(current.to_numpy(), state['scheme'], index=current.index)
+
+
+def score(state, weights=None, hierarchy=True, ids=None):
+    '''
+    score
+    function to score the current comorbities of each patient
+    param state: dict from create
+    param weights: string or mapping, see pyelixhauser.scores.get_weights
+    param hierarchy: bool, drop the less severe comorbity of each hierarchy before weighting
+    param ids: optional list of patient ids (all patients by default)
+    return pandas series, one score per patient
+    '''
+    current = masks(state, ids)
+    values = scores.score_masks(current.to_numpy(), state['scheme'], weights=weights, hierarchy=hierarchy)
+    return pd.Series(values, index=current.index)
+
+
+def snapshot(state):
+    '''
+    snapshot
+    function to copy the state, e.g. to pickle it as a checkpoint
+    param state: dict from create
+    return dict of plain values and numpy arrays, independent of the state
+    '''
+    data = {key: value for key, value in state.items() if key != 'rows'}
+    data['ids'] = list(state['ids'])
+    data['counts'] = state['counts'][:len(state['ids'])].copy()
+    for key in ('event_times', 'event_rows', 'event_masks'):
+        data[key] = state[key].copy()
+    return data
+
+
+def restore(data):
+    '''
+    restore
+    function to rebuild an accumulator from a snapshot
+    param data: dict from snapshot
+    return dict, the state
+    '''
+    if data.get('version') != _format_version:
+        raise ValueError(F'unsupported snapshot version {data.get("version")!r}')
+    state = snapshot(dict(data, rows=None))
+    state['rows'] = {patient: row for row, patient in enumerate(state['ids'])}
+    return state
@@ -0,0 +1,121 @@
+'''
+pyelixhauser memo module contains
+an opt-in, bounded memoization layer for long running services, where the same codes and
+even the same diagnosis strings are looked up over and over
+
+two levels are cached, each with its own maximum size and least recently used eviction
+    code: a single code -> its comorbities (used by the string functions and the batch functions)
+    record: a whole string -> its comorbities (used by the string functions and the long format functions)
+
+the batch functions already look up each distinct code only once per batch, the code cache
+saves the lookups across batches. Worker processes (n_jobs) use their own copy of the caches
+
+example usage:
+enable(code_size=50000, record_size=100000)
+comorbidity_from_string('E11.9 N18.3')
+stats()   # {'code': {'hits': ..., 'misses': ..., 'evictions': ..., 'size': ..., 'maxsize': 50000}, 'record': {...}}
+clear()
+disable()
+'''
+
+from collections import OrderedDict
+from functools import wraps
+from threading import Lock
+
+levels = ('code', 'record')
+_missing = object()
+_lock = Lock()
+# level -> cache state, levels without an entry are disabled
+_caches = {}
+
+
+def _new_cache(maxsize):
+    '''
+    internal function to create the state of an empty cache
+    '''
+    return {'entries': OrderedDict(), 'maxsize': maxsize, 'hits': 0, 'misses': 0, 'evictions': 0}
+
+
+def enable(code_size=100000, record_size=100000):
+    '''
+    enable
+    function to turn the caches on (the contents and counters of enabled caches are kept when they are resized)
+    param code_size: int, maximum number of codes kept, None or 0 disables the code cache
+    param record_size: int, maximum number of strings kept, None or 0 disables the record cache
+    '''
+    with _lock:
+        for level, maxsize in zip(levels, (code_size, record_size)):
+            if not maxsize:
+                _caches.pop(level, None)
+                continue
+            cache = _caches.setdefault(level, _new_cache(maxsize))
+            cache['maxsize'] = maxsize
+            while len(cache['entries']) > maxsize:
+                cache['entries'].popitem(last=False)
+                cache['evictions'] += 1
+
+
+def disable():
+    '''
+    disable
+    function to turn the caches off and drop their contents
+    '''
+    with _lock:
+        _caches.clear()
+
+
+def clear():
+    '''
+    clear
+    function to empty the enabled caches and reset their counters
+    '''
+    with _lock:
+        for level, cache in _caches.items():
+            _caches[level] = _new_cache(cache['maxsize'])
+
+
+def stats():
+    '''
+    stats
+    function to report the counters of the enabled caches
+    return dict level -> dict (hits, misses, evictions, size, maxsize)
+    '''
+    with _lock:
+        return {level: {'hits': cache['hits'], 'misses': cache['misses'], 'evictions': cache['evictions'],
+                        'size': len(cache['entries']), 'maxsize': cache['maxsize']}
+                for level, cache in _caches.items()}
+
+
+def memoize(level):
+    '''
+    memoize
+    decorator to cache a function of a single string in one of the levels, the functions of all schemes
+    share the cache of a level (keyed by function and string), when the level is disabled the function
+    is called directly
+    param level: string, one of levels
+    return decorator
+    '''
+    def decorator(func):
+        @wraps(func)
+        def wrapper(value):
+            cache = _caches.get(level)
+            if cache is None:
+                return func(value)
+            key = (func, value)
+            with _lock:
+                result = cache['entries'].get(key, _missing)
+                if result is not _missing:
+                    cache['entries'].move_to_end(key)
+                    cache['hits'] += 1
+                    return result
+                cache['misses'] += 1
+            result = func(value)
+            with _lock:
+                entries = cache['entries']
+                entries[key] = result
+                if len(entries) > cache['maxsize']:
+                    entries.popitem(last=False)
+                    cache['evictions'] += 1
+            return result
+        return wrapper
+    return decorator
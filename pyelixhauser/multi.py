@@ -0,0 +1,161 @@
+'''
+pyelixhauser multi module contains
+scoring of the same column of strings against several schemes in a single pass
+
+each string is tokenized once and each distinct token is validated and looked up once per
+scheme, the comorbities of all schemes are returned side by side in one wide data frame with
+the columns of each scheme prefixed by its name (e.g. 'cmr2022_HF', 'icd10cm_Obesity')
+
+example usage:
+comorbidity_frame(df['diagnosis_codes'], ['icd10cm', 'cmr2022'], weights={'icd10cm': 'van_walraven'})
+'''
+
+from functools import partial
+import numpy as np
+import pandas as pd
+from pyelixhauser import batch, bitmask, instrument, scores
+from pyelixhauser.schemes import get_module, get_scheme
+from pyelixhauser.utils import unpack_masks
+
+# tokens are runs of characters none of the schemes' codes contain, the codes of every scheme are
+# found inside the tokens exactly as they would be in the whole string
+_token_pattern = '[^\\s,;|]+'
+_count_module = 'icd10cm_cmr_v2022'
+# module -> (regular expression of its codes, uppercase first, lookup of a single code), as used by its batch functions
+_tokenizers = {'cci': ('_token_pattern', False, '_code_mask'),
+               'icd9cm': ('_code_pattern', False, '_code_mask'),
+               'icd10cm': ('_code_pattern', False, '_code_mask'),
+               'icd10cm_cmr_v2022': ('_token_pattern', True, '_resolve_token')}
+_count_column = '# Comorbidities'
+
+
+def _warmup(schemes):
+    '''
+    internal function to load the reference tables of all schemes
+    '''
+    for scheme in schemes:
+        get_module(scheme).warmup()
+
+
+def _resolve(scheme, uniques):
+    '''
+    internal function to resolve the distinct tokens of a batch against one scheme, the codes of
+    the scheme are parsed out of the tokens and each distinct code is looked up once
+    return tuple of numpy arrays, one value per token (bitmask, '# Comorbidities' count for cmr2022 else 0)
+    '''
+    module = get_module(scheme)
+    pattern, upper, lookup = _tokenizers[get_scheme(scheme)['module']]
+    codes, offsets = batch.tokenize(uniques, getattr(module, pattern), upper=upper)
+    inverse, distinct = batch.factorize(codes)
+    if get_scheme(scheme)['module'] != _count_module:
+        masks = batch.resolve(distinct, getattr(module, lookup))[inverse]
+        return batch.reduce_or(masks, offsets), np.zeros(len(uniques), dtype=np.int64)
+    resolved = np.array([getattr(module, lookup)(code) for code in distinct], dtype=np.uint64).reshape(-1, 3)[inverse]
+    return batch.reduce_or(resolved[:, 0], offsets), batch.reduce_max(resolved[:, 1].astype(np.int64), offsets)
+
+
+def _batch_masks(array, schemes):
+    '''
+    internal function to resolve a whole column of strings against several schemes
+    param array: array like of strings
+    param schemes: list of scheme names
+    return tuple (numpy uint64 array, one row per string and one column per scheme;
+    numpy int64 array of the cmr2022 '# Comorbidities' counts, 0 without cmr2022)
+    '''
+    record = instrument.start(__name__)
+    tokens, offsets = batch.tokenize(array, _token_pattern)
+    instrument.lap(record, 'tokenize')
+    inverse, uniques = batch.factorize(tokens)
+    instrument.lap(record, 'dedupe')
+    masks = np.zeros((len(offsets) - 1, len(schemes)), dtype=np.uint64)
+    counts = np.zeros(len(offsets) - 1, dtype=np.int64)
+    for j, scheme in enumerate(schemes):
+        token_masks, token_counts = _resolve(scheme, uniques)
+        instrument.lap(record, 'resolve')
+        masks[:, j] = batch.reduce_or(token_masks[inverse], offsets)
+        if get_scheme(scheme)['module'] == _count_module:
+            counts = batch.reduce_max(token_counts[inverse], offsets)
+        instrument.lap(record, 'reduce')
+        batch.log_summary(scheme, len(masks), len(tokens), len(uniques), masks[:, j])
+    if record is not None:
+        instrument.finish(record, records=len(masks), tokens=len(tokens), distinct_tokens=len(uniques),
+                          records_with_comorbidity=int(np.count_nonzero(masks.any(axis=1))))
+    return masks, counts
+
+
+def _prefixes(schemes, prefixes):
+    '''
+    internal function to resolve the column prefix of each scheme (default: scheme name and '_')
+    '''
+    prefixes = prefixes or {}
+    return [prefixes.get(scheme, scheme + '_') for scheme in schemes]
+
+
+def _records(array, schemes, n_jobs, executor):
+    '''
+    internal function to run _batch_masks, over several processes when asked
+    '''
+    for scheme in schemes:
+        get_scheme(scheme)
+    return batch.parallel(partial(_batch_masks, schemes=schemes), array, n_jobs=n_jobs, executor=executor,
+                          warmup=partial(_warmup, schemes))
+
+
+def comorbidity_masks(array, schemes, n_jobs=None, executor=None):
+    '''
+    comorbidity_masks
+    function to detect the comorbities of several schemes for a whole column of strings in one pass
+    param array: list, numpy array or pandas series of strings (codes shoulld be seperated with , or space )
+    param schemes: list of scheme names, see pyelixhauser.schemes.names
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    return dict scheme -> numpy uint64 array, one bitmask per string (see pyelixhauser.bitmask),
+    same as bitmask.encode(array, scheme) for each scheme
+
+    example usage:
+    comorbidity_masks(['E11.9 N18.3', 'I50.9'], ['icd10cm', 'cmr2022'])
+    '''
+    schemes = list(schemes)
+    masks, _ = _records(array, schemes, n_jobs, executor)
+    return {scheme: masks[:, j] for j, scheme in enumerate(schemes)}
+
+
+def comorbidity_frame(array, schemes, weights=None, prefixes=None, n_jobs=None, executor=None, hierarchy=True):
+    '''
+    comorbidity_frame
+    function to detect the comorbities of several schemes for a whole column of strings in one pass,
+    the strings are tokenized once and each distinct code is validated and looked up once per scheme
+    param array: list, numpy array or pandas series of strings (codes shoulld be seperated with , or space )
+    param schemes: list of scheme names, see pyelixhauser.schemes.names
+    param weights: optional dict scheme -> weights (None for the bundled weights, a name or a mapping of
+    comorbity -> weight, see pyelixhauser.scores.get_weights), adds a '<prefix>score' column per scheme
+    param prefixes: optional dict scheme -> column prefix, the scheme name and '_' by default
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    param hierarchy: bool, drop the less severe comorbity of each hierarchy before weighting
+    returns pandas data frame (uint8 flags, cmr2022 '# Comorbidities' count, scores), one row per string,
+    for each scheme the columns of its comorbidity_matrix (strings without a valid code are all zeros)
+    then its score, index is the index of array when it is a pandas series
+
+    example usage:
+    comorbidity_frame(['E11.9 N18.3', 'I50.9', ''], ['icd10cm', 'cmr2022'], weights={'icd10cm': None})
+    '''
+    schemes = list(schemes)
+    weights = weights or {}
+    unknown = [scheme for scheme in weights if scheme not in schemes]
+    if unknown:
+        raise ValueError(F'weights given for schemes {unknown} that are not scored')
+    masks, counts = _records(array, schemes, n_jobs, executor)
+    index = array.index if isinstance(array, pd.Series) else None
+    frames = []
+    for j, (scheme, prefix) in enumerate(zip(schemes, _prefixes(schemes, prefixes))):
+        names = bitmask.columns(scheme)
+        flags = unpack_masks(masks[:, j], len(names))
+        if get_scheme(scheme)['module'] == _count_module:
+            flags = np.hstack([counts.astype(np.uint8).reshape(-1, 1), flags])
+            names = [_count_column] + names
+        frames.append(batch.to_frame(flags, [prefix + name for name in names], index=index))
+        if scheme in weights:
+            values = scores.score_masks(masks[:, j], scheme, weights=weights[scheme], hierarchy=hierarchy)
+            frames.append(pd.DataFrame({prefix + 'score': values}, index=index))
+    return pd.concat(frames, axis=1)
@@ -0,0 +1,56 @@
+'''
+Internal registry of the comorbidity schemes
+
+maps the short scheme names used by the streaming and command line interfaces
+to the module implementing the scheme and the names of its batch functions
+'''
+
+from importlib import import_module
+
+_schemes = {
+    'cci': {'module': 'cci', 'matrix': 'cci_matrix', 'long': 'cci_from_long', 'masks': 'cci_masks'},
+    'icd9cm': {'module': 'icd9cm', 'matrix': 'comorbidity_matrix', 'long': 'comorbidity_from_long',
+               'masks': 'comorbidity_masks'},
+    'icd10cm': {'module': 'icd10cm', 'matrix': 'comorbidity_matrix', 'long': 'comorbidity_from_long',
+                'masks': 'comorbidity_masks'},
+    'cmr2022': {'module': 'icd10cm_cmr_v2022', 'matrix': 'comorbidity_matrix', 'long': 'comorbidity_from_long',
+                'masks': 'comorbidity_masks'},
+}
+_aliases = {entry['module']: scheme for scheme, entry in _schemes.items()}
+
+names = list(_schemes)
+
+
+def get_scheme(scheme):
+    '''
+    get_scheme
+    function to resolve a scheme name (or module name) to its registry entry
+    param scheme: string, one of names (or the name of the module, e.g. 'icd10cm_cmr_v2022')
+    return dict
+    '''
+    try:
+        return _schemes[_aliases.get(scheme, scheme)]
+    except KeyError:
+        raise ValueError(F'unknown scheme {scheme!r}, expected one of {names}')
+
+
+def get_module(scheme):
+    '''
+    get_module
+    function to import the module implementing a scheme
+    param scheme: string, one of names
+    return module
+    '''
+    return import_module('pyelixhauser.' + get_scheme(scheme)['module'])
+
+
+def get_function(scheme, kind):
+    '''
+    get_function
+    function to look up one of the batch functions of a scheme
+    param scheme: string, one of names
+    param kind: string, 'matrix' (column of strings -> uint8 matrix) 'long' (id / code data frame -> one row per id)
+    or 'masks' (column of strings -> uint64 bitmasks)
+    return function
+    '''
+    return getattr(get_module(scheme), get_scheme(scheme)[kind])
@@ -0,0 +1,207 @@
+'''
+pyelixhauser scores module contains
+weighted comorbidity index scores computed for a whole batch at once
+
+bundled weight tables (resources/comorbidity_weights.csv)
+    van_walraven: van Walraven et al. 2009 weights of the Elixhauser comorbities (icd9cm and icd10cm)
+any other index, e.g. the AHRQ mortality or readmission index of the CMR measures, can be
+scored by passing its weights as a mapping of comorbity -> weight
+
+before weighting, the less severe comorbity of each hierarchy is dropped when the more
+severe one is present (e.g. solid tumor without metastasis when there is a metastatic cancer),
+pass hierarchy=False to score the flags as they are
+
+example usage:
+score(['428.0 196.1', '401.1'], 'icd9cm')
+score(df['diagnosis_codes'], 'cmr2022', weights={'HF': 15, 'CANCER_METS': 23, ...})
+'''
+
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+from pyelixhauser import bitmask, schemes
+from pyelixhauser.utils import open_resource
+
+_resource_name = '/resources/comorbidity_weights.csv'
+
+# scheme -> table of the bundled weights
+_weight_tables = {'icd9cm': 'elixhauser', 'icd10cm': 'elixhauser'}
+
+# scheme -> (more severe comorbity, comorbity dropped when it is present)
+_elixhauser_hierarchy = [('Metastatic cancer', 'Solid tumor without Metastasis'),
+                         ('Diabetes, complicated', 'Diabetes, uncomplicated'),
+                         ('Hypertension, complicated', 'Hypertension, uncomplicated')]
+_hierarchies = {
+    'icd9cm': _elixhauser_hierarchy,
+    'icd10cm': _elixhauser_hierarchy,
+    'cmr2022': [('DIAB_CX', 'DIAB_UNCX'), ('HTN_CX', 'HTN_UNCX'), ('LIVER_SEV', 'LIVER_MLD'),
+                ('RENLFL_SEV', 'RENLFL_MOD'), ('CANCER_METS', 'CANCER_SOLID'), ('CANCER_METS', 'CANCER_NSITU'),
+                ('CANCER_SOLID', 'CANCER_NSITU')],
+}
+
+
+def _normalize(name):
+    '''
+    internal function to compare comorbity names, ignoring case and white space
+    (some of the icd9cm names contain line breaks)
+    '''
+    return ' '.join(str(name).split()).lower()
+
+
+@lru_cache(maxsize=None)
+def _weight_table():
+    '''
+    internal function to load the bundled weight tables
+    return pandas data frame with columns table, weights, comorbidity, weight
+    '''
+    with open_resource(_resource_name) as f:
+        return pd.read_csv(f)
+
+
+def _scheme_name(scheme):
+    '''
+    internal function to resolve a scheme (or module) name to the short scheme name
+    '''
+    schemes.get_scheme(scheme)
+    return schemes._aliases.get(scheme, scheme)
+
+
+def indexes(scheme):
+    '''
+    indexes
+    function to list the bundled weights of a scheme
+    param scheme: string, one of pyelixhauser.schemes.names
+    return list of strings
+    '''
+    df = _weight_table()
+    return list(df.loc[df['table'] == _weight_tables.get(_scheme_name(scheme)), 'weights'].unique())
+
+
+def get_weights(scheme, weights=None):
+    '''
+    get_weights
+    function to resolve the weights of an index to one weight per comorbity of a scheme
+    param scheme: string, one of pyelixhauser.schemes.names
+    param weights: string, name of bundled weights (defaults to the first one of the scheme),
+    or a mapping (dict or pandas series) of comorbity -> weight, comorbities left out weigh 0
+    return pandas series, one weight per comorbity, in the order of the bits of the scheme's masks
+    '''
+    columns = bitmask.columns(scheme)
+    positions = {_normalize(name): j for j, name in enumerate(columns)}
+    if weights is None or isinstance(weights, str):
+        available = indexes(scheme)
+        if not available:
+            raise ValueError(F'no bundled weights for {scheme!r}, pass weights as a mapping of comorbity -> weight')
+        name = available[0] if weights is None else weights
+        if name not in available:
+            raise ValueError(F'unknown weights {name!r} for {scheme!r}, expected one of {available}')
+        df = _weight_table()
+        df = df.loc[(df['table'] == _weight_tables[_scheme_name(scheme)]) & (df['weights'] == name)]
+        weights = dict(zip(df['comorbidity'], df['weight']))
+    unknown = [name for name in weights if _normalize(name) not in positions]
+    if unknown:
+        raise ValueError(F'unknown comorbities {unknown} for {scheme!r}')
+    values = np.zeros(len(columns), dtype=np.result_type(*[np.asarray(w) for w in weights.values()], np.int64))
+    for name, weight in weights.items():
+        values[positions[_normalize(name)]] = weight
+    return pd.Series(values, index=columns)
+
+
+def _apply_hierarchy(masks, scheme):
+    '''
+    internal function to clear the less severe comorbity of each hierarchy when the more severe one is set
+    '''
+    positions = {_normalize(name): np.uint64(j) for j, name in enumerate(bitmask.columns(scheme))}
+    masks = np.asarray(masks, dtype=np.uint64)
+    for severe, dropped in _hierarchies.get(_scheme_name(scheme), []):
+        severe, dropped = positions[_normalize(severe)], positions[_normalize(dropped)]
+        masks = masks & ~(((masks >> severe) & np.uint64(1)) << dropped)
+    return masks
+
+
+def score_masks(masks, scheme, weights=None, hierarchy=True):
+    '''
+    score_masks
+    function to score bitmasks (see pyelixhauser.bitmask) without expanding them into a flag matrix,
+    the weights are summed per byte of the masks with lookup tables, so the product of the flags and
+    the weights costs a few table lookups per record
+    param masks: numpy uint64 array
+    param scheme: string, one of pyelixhauser.schemes.names
+    param weights: string or mapping, see get_weights
+    param hierarchy: bool, drop the less severe comorbity of each hierarchy before weighting
+    return numpy array (int64, or float64 for fractional weights), one score per mask
+    '''
+    vector = get_weights(scheme, weights).to_numpy()
+    masks = np.asarray(masks, dtype=np.uint64).reshape(-1)
+    if hierarchy:
+        masks = _apply_hierarchy(masks, scheme)
+    n_bytes = -(-len(vector) // 8)
+    padded = np.zeros(n_bytes * 8, dtype=vector.dtype)
+    padded[:len(vector)] = vector
+    # tables[k, b] is the sum of the weights of the bits set in byte value b at byte k of the mask
+    bits = (np.arange(256).reshape(-1, 1) >> np.arange(8)) & 1
+    tables = (bits @ padded.reshape(n_bytes, 8).T).T
+    mask_bytes = np.ascontiguousarray(masks, dtype='<u8').view(np.uint8).reshape(-1, 8)
+    scores = np.zeros(len(masks), dtype=vector.dtype)
+    for k in range(n_bytes):
+        scores += tables[k][mask_bytes[:, k]]
+    return scores
+
+
+def score_frame(results, scheme, weights=None, hierarchy=True):
+    '''
+    score_frame
+    function to score the output of comorbidity_from_array or comorbidity_matrix(as_frame=True)
+    as a single product of the flag matrix and the weight vector
+    param results: pandas data frame with the columns of the scheme (missing values count as 0)
+    param scheme: string, one of pyelixhauser.schemes.names
+    param weights: string or mapping, see get_weights
+    param hierarchy: bool, drop the less severe comorbity of each hierarchy before weighting
+    return pandas series, one score per row, same index as results
+    '''
+    vector = get_weights(scheme, weights)
+    flags = results.loc[:, list(vector.index)].fillna(0).to_numpy(dtype=np.int64) != 0
+    if hierarchy:
+        positions = {_normalize(name): j for j, name in enumerate(vector.index)}
+        for severe, dropped in _hierarchies.get(_scheme_name(scheme), []):
+            flags[:, positions[_normalize(dropped)]] &= ~flags[:, positions[_normalize(severe)]]
+    return pd.Series(flags @ vector.to_numpy(), index=results.index)
+
+
+def score(array, scheme, weights=None, hierarchy=True, n_jobs=None, executor=None):
+    '''
+    score
+    function to score a whole column of strings, without building the flag matrix
+    param array: list, numpy array or pandas series of strings (codes shoulld be seperated with , or space )
+    param scheme: string, one of pyelixhauser.schemes.names ('cci', 'icd9cm', 'icd10cm', 'cmr2022')
+    param weights: string, name of bundled weights (default 'van_walraven' for icd9cm and icd10cm),
+    or a mapping of comorbity -> weight
+    param hierarchy: bool, drop the less severe comorbity of each hierarchy before weighting
+    param n_jobs: int, number of worker processes to split the strings over (-1 for one per cpu)
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    return numpy array, one score per string
+
+    example usage:
+    score(['428.0 196.1', '401.1', ''], 'icd9cm')
+    '''
+    masks = bitmask.encode(array, scheme, n_jobs=n_jobs, executor=executor)
+    return score_masks(masks, scheme, weights=weights, hierarchy=hierarchy)
+
+
+def score_long(df, id_col, code_col, scheme, weights=None, hierarchy=True):
+    '''
+    score_long
+    function to score long format data (one code per row), one score per id
+    param df: pandas data frame
+    param id_col: name of the column identifying the patient or encounter
+    param code_col: name of the column containing the code
+    param scheme: string, one of pyelixhauser.schemes.names
+    param weights: string or mapping, see get_weights
+    param hierarchy: bool, drop the less severe comorbity of each hierarchy before weighting
+    return pandas series, index is the sorted ids
+
+    example usage:
+    score_long(pd.DataFrame({'id': [1, 1, 2], 'code': ['428.0', '196.1', '401.1']}), 'id', 'code', 'icd9cm')
+    '''
+    masks = bitmask.encode_long(df, id_col, code_col, scheme)
+    return pd.Series(score_masks(masks.to_numpy(), scheme, weights=weights, hierarchy=hierarchy), index=masks.index)
@@ -0,0 +1,348 @@
+'''
+pyelixhauser service module contains
+an asyncio micro-batching front end to the batch functions, for services receiving many small requests
+
+each call of submit queues one string of codes and returns its comorbities once they are resolved,
+the queued strings are flushed as one batch when max_batch strings are waiting or when the oldest
+one has waited max_latency seconds, and the batches run on a pool of worker processes (at most
+max_concurrency at a time, one per process) so the event loop is never blocked and the batches use
+several cores. The queue holds at most max_queue strings, submit waits
+for room when it is full
+
+the state of a service is a dict (see start), metrics() reports the queue depth, the batches and
+flushes, and the time the strings waited. serve() exposes a service over a small http server
+(stdlib only), e.g. as a local stand-in for an external coding endpoint in tests
+
+example usage:
+service = await start('cmr2022', max_batch=256, max_latency=0.005)
+result = await submit(service, 'E11.9 N18.3')   # {'mask': ..., 'comorbidities': ['DIAB_UNCX', 'RENLFL_MOD']}
+metrics(service)
+await stop(service)
+
+python -m pyelixhauser.service -s cmr2022 --port 8080
+curl -d '{"codes": "E11.9 N18.3"}' http://127.0.0.1:8080/score
+'''
+
+import argparse
+import asyncio
+import json
+import sys
+from time import perf_counter
+from pyelixhauser import batch, bitmask, schemes, scores
+from pyelixhauser.setup_logger import logger
+
+_stop = object()
+_reasons = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+
+def _score_batch(strings, scheme, weights):
+    '''
+    internal function to resolve a micro-batch on the batch functions, runs on the worker pool
+    return list of dicts, one per string (mask, comorbidities and, when weights is not False, score)
+    '''
+    masks = bitmask.encode(strings, scheme)
+    names = bitmask.columns(scheme)
+    flagged = {mask: [name for j, name in enumerate(names) if mask >> j & 1] for mask in set(masks.tolist())}
+    results = [{'mask': mask, 'comorbidities': flagged[mask]} for mask in masks.tolist()]
+    if weights is not False:
+        for result, value in zip(results, scores.score_masks(masks, scheme, weights=weights).tolist()):
+            result['score'] = value
+    return results
+
+
+async def start(scheme, max_batch=256, max_latency=0.005, max_concurrency=2, max_queue=10000,
+                score=False, weights=None, executor=None):
+    '''
+    start
+    function to start a micro-batching service on the running event loop
+    param scheme: string, one of pyelixhauser.schemes.names
+    param max_batch: int, largest number of strings resolved in one batch
+    param max_latency: float, seconds the oldest queued string waits for the batch to fill before it is flushed
+    param max_concurrency: int, largest number of batches running at a time
+    param max_queue: int, largest number of strings waiting, submit waits for room beyond it
+    param score: bool, add the score of each string to its result
+    param weights: string or mapping, see pyelixhauser.scores.get_weights (when score is True)
+    param executor: concurrent.futures executor to run the batches on, by default a process pool of
+    max_concurrency workers that inherit the loaded reference table (owned and shut down by the service).
+    A thread pool avoids the cost of sending the strings and results between processes, but the batch
+    functions hold the GIL, so its batches run on a single core
+    return dict, the state of the service
+    '''
+    schemes.get_scheme(scheme)
+    if max_batch < 1 or max_concurrency < 1 or max_queue < 1 or max_latency < 0:
+        raise ValueError('max_batch, max_concurrency and max_queue must be at least 1 and max_latency at least 0')
+    if score:
+        scores.get_weights(scheme, weights)
+    loop = asyncio.get_running_loop()
+    owned = executor is None
+    warmup = schemes.get_module(scheme).warmup
+    # the reference table is loaded before the first request instead of delaying it
+    if owned:
+        executor = batch.process_pool(max_concurrency, warmup=warmup)
+    else:
+        await loop.run_in_executor(executor, warmup)
+    service = {'scheme': scheme, 'max_batch': max_batch, 'max_latency': max_latency,
+               'max_concurrency': max_concurrency, 'weights': weights if score else False,
+               'executor': executor, 'owned': owned, 'queue': asyncio.Queue(maxsize=max_queue),
+               'slots': asyncio.Semaphore(max_concurrency), 'tasks': set(), 'closing': False,
+               'metrics': {'submitted': 0, 'completed': 0, 'failed': 0, 'batches': 0, 'size_flushes': 0,
+                           'latency_flushes': 0, 'max_queue_depth': 0, 'in_flight': 0, 'wait_seconds': 0.0,
+                           'batch_seconds': 0.0}}
+    service['collector'] = asyncio.create_task(_collect(service))
+    return service
+
+
+async def submit(service, s):
+    '''
+    submit
+    function to resolve a single string of codes through the micro-batches
+    param service: dict from start
+    param s: string (codes shoulld be seperated with , or space )
+    return dict with keys mask (int, see pyelixhauser.bitmask), comorbidities (list of names)
+    and score when the service scores
+    '''
+    if service['closing']:
+        raise RuntimeError('the service is stopped')
+    future = asyncio.get_running_loop().create_future()
+    await service['queue'].put((s, future, perf_counter()))
+    # a put that waited for room while the service stopped lands after the collector has exited
+    if service['collector'].done():
+        _fail_queued(service)
+    counters = service['metrics']
+    counters['submitted'] += 1
+    counters['max_queue_depth'] = max(counters['max_queue_depth'], service['queue'].qsize())
+    return await future
+
+
+async def _collect(service):
+    '''
+    internal task to group the queued strings into batches and start them
+    '''
+    loop = asyncio.get_running_loop()
+    queue, counters = service['queue'], service['metrics']
+    stopping = False
+    while not stopping:
+        item = await queue.get()
+        if item is _stop:
+            break
+        items = [item]
+        deadline = loop.time() + service['max_latency']
+        while len(items) < service['max_batch']:
+            try:
+                item = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is _stop:
+                stopping = True
+                break
+            items.append(item)
+        counters['size_flushes' if len(items) == service['max_batch'] else 'latency_flushes'] += 1
+        await service['slots'].acquire()
+        task = asyncio.create_task(_run(service, items))
+        service['tasks'].add(task)
+        task.add_done_callback(service['tasks'].discard)
+
+
+async def _run(service, items):
+    '''
+    internal task to resolve one batch on the worker pool and hand each caller its result
+    '''
+    counters = service['metrics']
+    began = perf_counter()
+    counters['in_flight'] += 1
+    counters['batches'] += 1
+    counters['wait_seconds'] += sum(began - queued for _, _, queued in items)
+    try:
+        results = await asyncio.get_running_loop().run_in_executor(
+            service['executor'], _score_batch, [s for s, _, _ in items], service['scheme'], service['weights'])
+    except Exception as error:
+        logger.error('batch of %d strings failed: %s', len(items), error)
+        counters['failed'] += len(items)
+        for _, future, _ in items:
+            if not future.done():
+                future.set_exception(error)
+    else:
+        counters['completed'] += len(items)
+        for (_, future, _), result in zip(items, results):
+            # callers that gave up (cancelled) are skipped
+            if not future.done():
+                future.set_result(result)
+    finally:
+        counters['in_flight'] -= 1
+        counters['batch_seconds'] += perf_counter() - began
+        service['slots'].release()
+
+
+def metrics(service):
+    '''
+    metrics
+    function to report the counters of a service
+    param service: dict from start
+    return dict with keys queue_depth, max_queue_depth, in_flight, submitted, completed, failed, batches,
+    size_flushes, latency_flushes (batches flushed full or on max_latency), mean_batch_size,
+    mean_wait_seconds (time in the queue per string) and batch_seconds (time running batches)
+    '''
+    counters = dict(service['metrics'])
+    batched = counters['completed'] + counters['failed']
+    counters['queue_depth'] = service['queue'].qsize()
+    counters['mean_batch_size'] = batched / counters['batches'] if counters['batches'] else 0.0
+    counters['mean_wait_seconds'] = counters.pop('wait_seconds') / batched if batched else 0.0
+    return counters
+
+
+def _fail_queued(service):
+    '''
+    internal function to fail the strings left in the queue once the collector has exited
+    '''
+    queue = service['queue']
+    while not queue.empty():
+        item = queue.get_nowait()
+        if item is not _stop and not item[1].done():
+            item[1].set_exception(RuntimeError('the service is stopped'))
+
+
+async def stop(service):
+    '''
+    stop
+    function to stop a service, the strings already queued are resolved first
+    param service: dict from start
+    '''
+    if service['closing']:
+        return
+    service['closing'] = True
+    await service['queue'].put(_stop)
+    await service['collector']
+    _fail_queued(service)
+    if service['tasks']:
+        await asyncio.gather(*service['tasks'])
+    if service['owned']:
+        service['executor'].shutdown(wait=True)
+
+
+async def _respond(writer, status, body, keep_alive):
+    '''
+    internal function to write a json http response
+    '''
+    payload = json.dumps(body).encode()
+    writer.write(F'HTTP/1.1 {status} {_reasons[status]}\r\nContent-Type: application/json\r\n'
+                 F'Content-Length: {len(payload)}\r\nConnection: {"keep-alive" if keep_alive else "close"}'
+                 F'\r\n\r\n'.encode() + payload)
+    await writer.drain()
+
+
+async def _handle(service, method, path, body):
+    '''
+    internal function to answer one http request
+    return tuple (status, json body)
+    '''
+    if path == '/metrics':
+        return 200, metrics(service)
+    if path == '/health':
+        return 200, {'status': 'ok', 'scheme': service['scheme']}
+    if path != '/score':
+        return 404, {'error': F'unknown path {path}'}
+    if method != 'POST':
+        return 405, {'error': 'use POST'}
+    try:
+        request = json.loads(body or b'{}')
+        if 'codes' in request:
+            return 200, await submit(service, str(request['codes']))
+        records = [str(s) for s in request['records']]
+    except (ValueError, KeyError, TypeError):
+        return 400, {'error': 'expected a json object with codes (string) or records (list of strings)'}
+    return 200, {'results': await asyncio.gather(*[submit(service, s) for s in records])}
+
+
+async def _connection(service, reader, writer):
+    '''
+    internal function to serve the http requests of one connection (keep-alive)
+    '''
+    try:
+        while True:
+            line = await reader.readline()
+            if not line.strip():
+                break
+            method, path, version = (line.decode('latin-1').split() + ['', '', ''])[:3]
+            headers = {}
+            while True:
+                header = await reader.readline()
+                if not header.strip():
+                    break
+                name, _, value = header.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+            keep_alive = headers.get('connection', '').lower() != 'close' and version != 'HTTP/1.0'
+            try:
+                status, response = await _handle(service, method, path, body)
+            except Exception as error:
+                status, response = 500, {'error': str(error)}
+            await _respond(writer, status, response, keep_alive)
+            if not keep_alive:
+                break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(service, host='127.0.0.1', port=8080):
+    '''
+    serve
+    function to expose a service over http (json): POST /score with {"codes": "E11.9 N18.3"} returns the result
+    of submit, {"records": [...]} returns {"results": [...]}, GET /metrics returns metrics() and GET /health
+    param service: dict from start
+    param host: string, address to listen on
+    param port: int, 0 picks a free port (see server.sockets[0].getsockname())
+    return asyncio server, close it (and stop the service) when done
+    '''
+    return await asyncio.start_server(lambda reader, writer: _connection(service, reader, writer), host, port)
+
+
+async def _main(args):
+    '''
+    internal function to run a service and its http server until interrupted
+    '''
+    service = await start(args.scheme, max_batch=args.max_batch, max_latency=args.max_latency,
+                          max_concurrency=args.concurrency, max_queue=args.max_queue,
+                          score=args.score is not None, weights=args.score or None)
+    server = await serve(service, args.host, args.port)
+    logger.info('serving %s on %s', args.scheme, server.sockets[0].getsockname())
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        await stop(service)
+
+
+def main(argv=None):
+    '''
+    main
+    function to run the http service from the command line
+    param argv: list of arguments, sys.argv by default
+    '''
+    parser = argparse.ArgumentParser(prog='python -m pyelixhauser.service', description='micro-batching http service')
+    parser.add_argument('-s', '--scheme', required=True, choices=schemes.names)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--max-latency', type=float, default=0.005, help='seconds')
+    parser.add_argument('--concurrency', type=int, default=2, help='worker processes (batches running at a time)')
+    parser.add_argument('--max-queue', type=int, default=10000)
+    parser.add_argument('--score', nargs='?', const='', metavar='WEIGHTS',
+                        help='add the score of each string, with the named bundled weights (default: the first)')
+    args = parser.parse_args(argv)
+    try:
+        asyncio.run(_main(args))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
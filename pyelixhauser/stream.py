@@ -0,0 +1,303 @@
+'''
+pyelixhauser stream module contains
+score_file, score_long_file and the generator pipeline they are built from, for scoring csv and
+parquet files that are larger than memory
+
+the input is read chunk_size rows at a time, every chunk is scored with one
+of the schemes in pyelixhauser.schemes ('cci', 'icd9cm', 'icd10cm', 'cmr2022')
+and appended to the output file, so memory use is bounded by chunk_size and
+not by the size of the input
+
+parquet support needs pyarrow (pip install pyarrow)
+
+example usage:
+score_file('claims.csv', 'flags.parquet', 'cmr2022', column='diagnosis_codes', keep_columns=['encounter_id'])
+'''
+
+import sys
+from collections import deque
+from contextlib import contextmanager
+import pandas as pd
+from pyelixhauser import batch, instrument, schemes, scores
+
+
+def _file_format(path, fmt=None):
+    '''
+    internal function to find the format of a file from its extension
+    param path: string or file object
+    param fmt: string, 'csv' or 'parquet' (overrides the extension)
+    return string, 'csv' or 'parquet'
+    '''
+    if fmt is not None:
+        if fmt not in ('csv', 'parquet'):
+            raise ValueError(F'unsupported file format {fmt!r}, expected csv or parquet')
+        return fmt
+    if isinstance(path, str) and path.lower().endswith(('.parquet', '.pq')):
+        return 'parquet'
+    return 'csv'
+
+
+def _import_parquet():
+    '''
+    internal function to import pyarrow.parquet, the optional dependency for parquet files
+    '''
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError('reading or writing parquet files requires pyarrow (pip install pyarrow)')
+    return pyarrow, pyarrow.parquet
+
+
+def read_chunks(path, columns, chunk_size=100000, fmt=None, sep=','):
+    '''
+    read_chunks
+    generator that reads a csv or parquet file chunk_size rows at a time
+    param path: string, file path ('-' reads csv from stdin) or file object
+    param columns: list of the columns to read (they are read as strings)
+    param chunk_size: int, number of rows per chunk
+    param fmt: string, 'csv' or 'parquet' (defaults to the file extension)
+    param sep: string, csv field separator
+    yields pandas data frame
+    '''
+    if path == '-':
+        path = sys.stdin
+    if _file_format(path, fmt) == 'parquet':
+        _, parquet = _import_parquet()
+        batches = parquet.ParquetFile(path).iter_batches(batch_size=chunk_size, columns=list(columns))
+        for record_batch in instrument.timed_iter(batches, 'read'):
+            yield record_batch.to_pandas().astype(object)
+    else:
+        dtypes = {column: str for column in columns}
+        chunks = pd.read_csv(path, sep=sep, usecols=list(columns), dtype=dtypes, chunksize=chunk_size)
+        yield from instrument.timed_iter(chunks, 'read')
+
+
+@contextmanager
+def _pool(scheme, n_jobs, executor):
+    '''
+    internal context manager giving the executor every chunk of a file runs on: executor when given,
+    otherwise one process pool for the whole file when n_jobs asks for several processes, else None
+    '''
+    if executor is not None or n_jobs in (None, 1):
+        yield executor
+        return
+    with batch.process_pool(n_jobs, warmup=schemes.get_module(scheme).warmup) as pool:
+        yield pool
+
+
+def score_chunks(chunks, scheme, column, keep_columns=(), n_jobs=None, score=None, executor=None):
+    '''
+    score_chunks
+    generator that scores each chunk of a wide file (one string of codes per row)
+    param chunks: iterable of pandas data frames
+    param scheme: string, one of pyelixhauser.schemes.names
+    param column: name of the column containing the codes
+    param keep_columns: columns copied to the output in front of the comorbities (e.g. an encounter id)
+    param n_jobs: int, worker processes each chunk is split over (-1 for one per cpu), the pool is
+    started once and reused for every chunk
+    param score: weights (see pyelixhauser.scores.get_weights) to write an index score column
+    instead of the comorbities, the flag matrix is then never built
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    yields pandas data frame, keep_columns then one uint8 column per comorbity (or the score)
+    '''
+    matrix = schemes.get_function(scheme, 'matrix')
+    with _pool(scheme, n_jobs, executor) as pool:
+        for chunk in chunks:
+            if score is None:
+                results = matrix(chunk.loc[:, column], as_frame=True, n_jobs=n_jobs, executor=pool)
+            else:
+                values = scores.score(chunk.loc[:, column], scheme, weights=score, n_jobs=n_jobs, executor=pool)
+                results = pd.DataFrame({'score': values})
+            kept = chunk.loc[:, list(keep_columns)].reset_index(drop=True)
+            yield pd.concat([kept, results], axis=1)
+
+
+def _score_long(df, scheme, id_col, code_col, score):
+    '''
+    internal function to score one group of whole ids of a long file (module level so it can run in a worker process)
+    return pandas data frame, id_col then one uint8 column per comorbity (or the score)
+    '''
+    if score is None:
+        return schemes.get_function(scheme, 'long')(df, id_col, code_col).reset_index()
+    return scores.score_long(df, id_col, code_col, scheme, weights=score).rename('score').to_frame().reset_index()
+
+
+def _whole_ids(chunks, id_col):
+    '''
+    internal generator that regroups the chunks of a long file so that no id is split over two of them,
+    the rows of the last id of a chunk are held back and joined to the next chunk
+    '''
+    pending = None
+    for chunk in chunks:
+        if pending is not None:
+            chunk = pd.concat([pending, chunk], ignore_index=True)
+        if len(chunk) == 0:
+            continue
+        is_last = (chunk.loc[:, id_col] == chunk.loc[:, id_col].iloc[-1]).to_numpy()
+        pending = chunk.loc[is_last]
+        if not is_last.all():
+            yield chunk.loc[~is_last]
+    if pending is not None and len(pending):
+        yield pending
+
+
+def score_long_chunks(chunks, scheme, id_col, code_col, score=None, n_jobs=None, executor=None):
+    '''
+    score_long_chunks
+    generator that scores each chunk of a long file (one code per row), the rows of an id
+    must be next to each other (e.g. sorted by id), the rows of the last id of a chunk are
+    held back and scored with the next chunk, so an id is never split over two output rows
+    param chunks: iterable of pandas data frames
+    param scheme: string, one of pyelixhauser.schemes.names
+    param id_col: name of the column identifying the patient or encounter
+    param code_col: name of the column containing the code
+    param score: weights (see pyelixhauser.scores.get_weights) to write an index score column
+    instead of the comorbities, the flag matrix is then never built
+    param n_jobs: int, worker processes scoring chunks side by side (-1 for one per cpu), the pool is
+    started once and reused for every chunk
+    param executor: concurrent.futures executor to score the chunks on instead of a new process pool
+    yields pandas data frame, id_col then one uint8 column per comorbity (or the score), in input order
+    '''
+    groups = _whole_ids(chunks, id_col)
+    with _pool(scheme, n_jobs, executor) as pool:
+        if pool is None:
+            for group in groups:
+                yield _score_long(group, scheme, id_col, code_col, score)
+            return
+        # at most two chunks per worker are in flight, so memory stays bounded by chunk_size
+        max_pending = 2 * batch.n_workers(n_jobs)
+        pending = deque()
+        for group in groups:
+            pending.append(pool.submit(_score_long, group, scheme, id_col, code_col, score))
+            if len(pending) >= max_pending:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _csv_header(columns, sep):
+    '''
+    internal function to build the csv header line, some of the icd9cm feature names
+    contain carriage returns, which the csv writer does not quote
+    '''
+    fields = []
+    for name in map(str, columns):
+        if any(c in name for c in (sep, '"', '\r', '\n')):
+            name = '"' + name.replace('"', '""') + '"'
+        fields.append(name)
+    return sep.join(fields) + '\n'
+
+
+@instrument.timed('write')
+def _write_table(pyarrow, parquet, writer, path, frame):
+    '''
+    internal function to append a chunk to a parquet file, opening the writer on the first chunk
+    return the parquet writer
+    '''
+    table = pyarrow.Table.from_pandas(frame, preserve_index=False)
+    if writer is None:
+        writer = parquet.ParquetWriter(path, table.schema)
+    writer.write_table(table)
+    return writer
+
+
+@instrument.timed('write')
+def _write_csv(f, frame, sep, header):
+    '''
+    internal function to append a chunk to a csv file, with the header line before the first chunk
+    '''
+    if header:
+        f.write(_csv_header(frame.columns, sep))
+    frame.to_csv(f, sep=sep, header=False, index=False)
+
+
+def write_chunks(frames, path, fmt=None, sep=','):
+    '''
+    write_chunks
+    function to append each scored chunk to a csv or parquet file as soon as it is produced
+    param frames: iterable of pandas data frames with the same columns
+    param path: string, file path ('-' writes csv to stdout) or file object
+    param fmt: string, 'csv' or 'parquet' (defaults to the file extension)
+    param sep: string, csv field separator
+    return int, number of rows written
+    '''
+    n_rows = 0
+    if _file_format(path, fmt) == 'parquet':
+        pyarrow, parquet = _import_parquet()
+        writer = None
+        try:
+            for frame in frames:
+                writer = _write_table(pyarrow, parquet, writer, path, frame)
+                n_rows += len(frame)
+        finally:
+            if writer is not None:
+                writer.close()
+        return n_rows
+    if path == '-':
+        path = sys.stdout
+    f = open(path, 'w', newline='') if isinstance(path, str) else path
+    try:
+        for i, frame in enumerate(frames):
+            _write_csv(f, frame, sep, header=i == 0)
+            n_rows += len(frame)
+    finally:
+        if f is not path:
+            f.close()
+    return n_rows
+
+
+def score_file(input_path, output_path, scheme, column, keep_columns=(), chunk_size=100000,
+               n_jobs=None, input_format=None, output_format=None, sep=',', score=None, executor=None):
+    '''
+    score_file
+    function to score a csv or parquet file with one string of codes per row, chunk by chunk
+    param input_path: string, file path ('-' for stdin) or file object
+    param output_path: string, file path ('-' for stdout) or file object
+    param scheme: string, one of pyelixhauser.schemes.names ('cci', 'icd9cm', 'icd10cm', 'cmr2022')
+    param column: name of the column containing the codes
+    param keep_columns: columns copied to the output in front of the comorbities (e.g. an encounter id)
+    param chunk_size: int, number of rows held in memory at a time
+    param n_jobs: int, worker processes each chunk is split over (-1 for one per cpu), one pool serves the whole file
+    param input_format: string, 'csv' or 'parquet' (defaults to the file extension)
+    param output_format: string, 'csv' or 'parquet' (defaults to the file extension)
+    param sep: string, csv field separator
+    param score: weights (see pyelixhauser.scores.get_weights) to write an index score column instead of the comorbities
+    param executor: concurrent.futures executor to run the chunks on instead of a new process pool
+    return int, number of rows written
+
+    example usage:
+    score_file('claims.csv', 'flags.csv', 'cmr2022', column='diagnosis_codes', keep_columns=['encounter_id'])
+    '''
+    columns = list(keep_columns) + [c for c in [column] if c not in keep_columns]
+    chunks = read_chunks(input_path, columns, chunk_size=chunk_size, fmt=input_format, sep=sep)
+    frames = score_chunks(chunks, scheme, column, keep_columns=keep_columns, n_jobs=n_jobs, score=score,
+                          executor=executor)
+    return write_chunks(frames, output_path, fmt=output_format, sep=sep)
+
+
+def score_long_file(input_path, output_path, scheme, id_col, code_col, chunk_size=100000,
+                    input_format=None, output_format=None, sep=',', score=None, n_jobs=None, executor=None):
+    '''
+    score_long_file
+    function to score a csv or parquet file with one code per row, grouped by id, chunk by chunk
+    param input_path: string, file path ('-' for stdin) or file object
+    param output_path: string, file path ('-' for stdout) or file object
+    param scheme: string, one of pyelixhauser.schemes.names ('cci', 'icd9cm', 'icd10cm', 'cmr2022')
+    param id_col: name of the column identifying the patient or encounter (rows of an id must be next to each other)
+    param code_col: name of the column containing the code
+    param chunk_size: int, number of rows held in memory at a time
+    param input_format: string, 'csv' or 'parquet' (defaults to the file extension)
+    param output_format: string, 'csv' or 'parquet' (defaults to the file extension)
+    param sep: string, csv field separator
+    param score: weights (see pyelixhauser.scores.get_weights) to write an index score column instead of the comorbities
+    param n_jobs: int, worker processes scoring chunks side by side (-1 for one per cpu), one pool serves the whole file
+    param executor: concurrent.futures executor to score the chunks on instead of a new process pool
+    return int, number of rows (ids) written
+
+    example usage:
+    score_long_file('diagnoses.csv', 'flags.csv', 'cmr2022', id_col='encounter_id', code_col='diagnosis_code')
+    '''
+    chunks = read_chunks(input_path, [id_col, code_col], chunk_size=chunk_size, fmt=input_format, sep=sep)
+    frames = score_long_chunks(chunks, scheme, id_col, code_col, score=score, n_jobs=n_jobs, executor=executor)
+    return write_chunks(frames, output_path, fmt=output_format, sep=sep)
@@ -0,0 +1,110 @@
+'''
+pyelixhauser tokens module contains
+single pass tokenizers of diagnosis strings for each code system, with the patterns compiled once
+
+a string is split into its candidate codes, each candidate is validated and its dots are
+removed, and the codes of a string are deduplicated (in order of first appearance)
+    icd9cm: codes are found as V?[0-9]{2,8} (the codes of the cci module)
+    icd10cm: codes are the runs of [A-Z0-9.] of the uppercased string that are valid icd10cm codes
+    (the codes of the icd10cm_cmr_v2022 module)
+
+example usage:
+codes('E11.9 Z23, Z20.828 , J30.1, e11.9', 'icd10cm')   # ['E119', 'Z23', 'Z20828', 'J301']
+codes_batch(df['diagnosis_codes'], 'icd10cm')   # all codes of the column and the offsets of each string
+'''
+
+import re
+import numpy as np
+from pyelixhauser import batch
+
+_icd9_pattern = re.compile('V?[0-9]{2,8}')
+_icd10cm_token_pattern = re.compile('[A-Z0-9.]+')
+_icd10cm_pattern = re.compile('(?i:[A-TV-Z][0-9][0-9AB](?:\\.[0-9A-KXZ](?:[0-9A-EXYZ](?:[0-9A-HX][0-59A-HJKMNP-S]?)?)?)?'
+                              '|U07(?:\\.[01])?)')
+
+systems = ('icd9cm', 'icd10cm')
+
+
+def validate_icd9(token):
+    '''
+    validate_icd9
+    function to find the icd9cm code in a token
+    param token: string
+    return string, the code without dots, or None if the token does not contain one
+    '''
+    result = _icd9_pattern.search(str(token).upper().replace('.', ''))
+    return None if result is None else result.group()
+
+
+def validate_icd10cm(token):
+    '''
+    validate_icd10cm
+    function to validate a token (a run of [A-Z0-9.]) as an icd10cm code
+    param token: string
+    return string, the code as written (with its dots), or None if the token is not a valid icd10cm code
+    '''
+    result = _icd10cm_pattern.fullmatch(token)
+    return None if result is None else result.group()
+
+
+def candidates(s, system):
+    '''
+    candidates
+    function to split a string into the candidate tokens of a code system, before validation
+    param s: string
+    param system: string, 'icd9cm' or 'icd10cm'
+    return list of strings
+    '''
+    if system == 'icd9cm':
+        return _icd9_pattern.findall(str(s))
+    if system == 'icd10cm':
+        return _icd10cm_token_pattern.findall(str(s).upper())
+    raise ValueError(F'unknown code system {system!r}, expected one of {list(systems)}')
+
+
+def codes(s, system):
+    '''
+    codes
+    function to tokenize a single string in one pass
+    param s: string (codes shoulld be seperated with , or space )
+    param system: string, 'icd9cm' or 'icd10cm'
+    return list of strings, the distinct valid codes without dots, in order of first appearance
+    '''
+    validate = validate_icd9 if system == 'icd9cm' else validate_icd10cm
+    found = {}
+    for token in candidates(s, system):
+        code = validate(token)
+        if code is not None:
+            found[code.replace('.', '')] = None
+    return list(found)
+
+
+def codes_batch(array, system):
+    '''
+    codes_batch
+    function to tokenize a whole column of strings at once, each distinct token of the column is
+    validated once
+    param array: list, numpy array or pandas series of strings
+    param system: string, 'icd9cm' or 'icd10cm'
+    return tuple (numpy object array of codes without dots, numpy int64 array of record offsets),
+    the distinct codes of record i are codes[offsets[i]:offsets[i + 1]] in order of first appearance
+    '''
+    if system not in systems:
+        raise ValueError(F'unknown code system {system!r}, expected one of {list(systems)}')
+    pattern = _icd9_pattern.pattern if system == 'icd9cm' else _icd10cm_token_pattern.pattern
+    tokens, offsets = batch.tokenize(array, pattern, upper=system == 'icd10cm')
+    inverse, uniques = batch.factorize(tokens)
+    validate = validate_icd9 if system == 'icd9cm' else validate_icd10cm
+    valid = [validate(token) for token in uniques]
+    code_numbers, code_values = batch.factorize([None if code is None else code.replace('.', '') for code in valid])
+    code_numbers = code_numbers[inverse]
+    records = np.repeat(np.arange(len(offsets) - 1), np.diff(offsets))
+    keep = code_numbers >= 0
+    # first appearance of each (record, code) pair, the token order within a record is kept
+    keys = records[keep] * max(len(code_values), 1) + code_numbers[keep]
+    _, first = np.unique(keys, return_index=True)
+    first = np.sort(first)
+    kept_records = records[keep][first]
+    new_offsets = np.zeros(len(offsets), dtype=np.int64)
+    np.cumsum(np.bincount(kept_records, minlength=len(offsets) - 1), out=new_offsets[1:])
+    return np.asarray(code_values, dtype=object)[code_numbers[keep][first]], new_offsets
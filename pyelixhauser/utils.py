@@ -3,10 +3,153 @@ Internal utilities package that provides an streamlined load function
 that loads the csv required from Elixhauser comorbity lookup
 '''
 
-import pkg_resources
 import re
+from bisect import bisect_left, bisect_right
+from importlib import resources
+import numpy as np
+from pyelixhauser import instrument
+
+
+def open_resource(path):
+    '''
+    open_resource
+    internal function to open a file bundled in pyelixhauser/resources,
+    uses importlib.resources, which is much cheaper to import than pkg_resources
+
+    param path: string, resource path relative to the package (e.g. "/resources/cci2015.csv")
+    return binary file object
+    '''
+    return resources.files('pyelixhauser').joinpath(path.lstrip('/')).open('rb')
+
+
 def load_resource(path):
-    stream = pkg_resources.resource_string('pyelixhauser', path)
+    with open_resource(path) as f:
+        stream = f.read()
     results =str(stream).split('\\n')
     results = [item.strip() for _, item in enumerate(results) if len(item)>1]
     return results
+
+
+def lazy_attributes(module_name, attributes):
+    '''
+    lazy_attributes
+    internal function to build a module level __getattr__ (PEP 562) so reference
+    tables that are only built on first use can still be imported by name
+
+    param module_name: string, name of the module (used in error messages)
+    param attributes: dict, attribute name -> function returning its value
+    return function
+    '''
+    def __getattr__(name):
+        if name in attributes:
+            return attributes[name]()
+        raise AttributeError(F"module {module_name!r} has no attribute {name!r}")
+    return __getattr__
+
+
+@instrument.timed('assemble')
+def unpack_masks(masks, width):
+    '''
+    unpack_masks
+    internal function to expand integer bitmasks into a binary matrix,
+    bit j of each mask becomes column j of the result
+
+    param masks: array like of ints (one bitmask per record)
+    param width: int, number of columns (bits) to unpack
+    return numpy uint8 array of shape (len(masks), width)
+    '''
+    masks = np.asarray(masks, dtype=np.uint64).reshape(-1, 1)
+    bits = np.arange(width, dtype=np.uint64)
+    return ((masks >> bits) & np.uint64(1)).astype(np.uint8)
+
+
+_byte_popcount = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def popcount(masks):
+    '''
+    popcount
+    internal function to count the set bits of integer bitmasks
+
+    param masks: array like of ints
+    return numpy uint8 array, same shape as masks
+    '''
+    masks = np.ascontiguousarray(masks, dtype=np.uint64)
+    if hasattr(np, 'bitwise_count'):
+        # numpy >= 2.0
+        return np.bitwise_count(masks)
+    return _byte_popcount[masks.reshape(-1, 1).view(np.uint8)].sum(axis=1, dtype=np.uint8).reshape(masks.shape)
+
+
+@instrument.timed('assemble')
+def sparse_masks(masks, width, counts=None):
+    '''
+    sparse_masks
+    internal function to expand integer bitmasks into the arrays of a CSR matrix,
+    without building the dense matrix, bit j of each mask becomes column j
+
+    param masks: array like of ints (one bitmask per record)
+    param width: int, number of columns (bits) to unpack
+    param counts: optional array like of ints stored in column 0 (the bits move to columns 1 to width),
+    e.g. the '# Comorbidities' count of the CMR
+    return tuple (data numpy uint8 array, indices numpy int32 array, indptr numpy int64 array),
+    the columns of row i are indices[indptr[i]:indptr[i + 1]], in increasing order
+    '''
+    masks = np.asarray(masks, dtype=np.uint64).reshape(-1)
+    if width < 64:
+        masks = masks & np.uint64((1 << width) - 1)
+    row_counts = popcount(masks).astype(np.int64)
+    if counts is not None:
+        counts = np.asarray(counts).reshape(-1)
+        row_counts += counts != 0
+    indptr = np.zeros(len(masks) + 1, dtype=np.int64)
+    np.cumsum(row_counts, out=indptr[1:])
+    indices = np.empty(indptr[-1], dtype=np.int32)
+    data = np.ones(indptr[-1], dtype=np.uint8)
+    cursor = indptr[:-1].copy()
+    offset = 0
+    if counts is not None:
+        rows = np.flatnonzero(counts)
+        indices[cursor[rows]] = 0
+        data[cursor[rows]] = counts[rows]
+        cursor[rows] += 1
+        offset = 1
+    for j in range(width):
+        rows = np.flatnonzero(masks & np.uint64(1 << j))
+        indices[cursor[rows]] = j + offset
+        cursor[rows] += 1
+    return data, indices, indptr
+
+
+def compile_intervals(intervals):
+    '''
+    compile_intervals
+    internal function to flatten possibly overlapping code ranges into
+    sorted, non overlapping segments that can be searched with bisect
+
+    param intervals: list of tuples (lower bound, upper bound, bitmask), bounds are half open [lower, upper)
+    return tuple (bounds, masks), a sorted list of segment bounds and the
+    bitmask of every range covering the segment [bounds[i], bounds[i + 1])
+    '''
+    bounds = sorted({b for lower, upper, _ in intervals for b in (lower, upper)})
+    masks = [0] * max(len(bounds) - 1, 0)
+    for lower, upper, mask in intervals:
+        for i in range(bisect_left(bounds, lower), bisect_left(bounds, upper)):
+            masks[i] |= mask
+    return bounds, masks
+
+
+def interval_mask(bounds, masks, value):
+    '''
+    interval_mask
+    internal function to find the bitmask of the segment containing a value
+
+    param bounds: sorted list of floats (from compile_intervals)
+    param masks: list of ints (from compile_intervals)
+    param value: float
+    return int, the bitmask of every range containing value (0 if none do)
+    '''
+    i = bisect_right(bounds, value) - 1
+    if 0 <= i < len(masks):
+        return masks[i]
+    return 0
@@ -9,6 +9,8 @@ setup(
     version=__version__,
     packages=find_packages(),
     package_data={'pyelixhauser': ['resources/*']},
+    extras_require={'parquet': ['pyarrow'], 'arrow': ['pyarrow'], 'polars': ['polars', 'pyarrow']},
+    entry_points={'console_scripts': ['pyelixhauser=pyelixhauser.cli:main']},
     license='GNU General Public License v3.0',
     author='Matthew Davis',
     author_email='davismat@musc.edu',
@@ -0,0 +1,16 @@
+import os
+import pytest
+
+
+@pytest.fixture(autouse=True, scope='session')
+def cache_dir(tmp_path_factory):
+    '''
+    keep the compiled artifacts written by the tests out of the user's cache
+    '''
+    previous = os.environ.get('PYELIXHAUSER_CACHE_DIR')
+    os.environ['PYELIXHAUSER_CACHE_DIR'] = str(tmp_path_factory.mktemp('cache'))
+    yield
+    if previous is None:
+        del os.environ['PYELIXHAUSER_CACHE_DIR']
+    else:
+        os.environ['PYELIXHAUSER_CACHE_DIR'] = previous
@@ -16,6 +16,22 @@ def test_cci():
     assert cci_from_string('4280|4280,1611, 1, 0010').sum() == 2
     assert cci_from_array(['4280|4280', '1611, 1, 0010', '']).shape == (3, 18)
     assert cci_from_array(['4280|4280', '1611, 1, 0010', '']).sum().sum() == 2
+
+    from pyelixhauser.cci import _get_cci, _cci_df, _is_substring
+    for code in ['4280', '428', '42', '0010', 'V451', 'V45', '99999', '']:
+        index = _cci_df.loc[:, 'ICD-9-CM CODE'].apply(lambda x: _is_substring(code, x))
+        assert (_get_cci(code)[0] is not None) == index.any()
+    assert _get_cci('428.0') == _get_cci('4280')
+
+    from pyelixhauser.cci import cci_matrix
+    import numpy as np
+    import pandas as pd
+    records = ['4280|4280', '1611, 1, 0010', '', None, '428.0 V45.1']
+    results = cci_matrix(records)
+    assert results.dtype == np.uint8 and results.shape == (5, 18)
+    assert (results[[0, 1, 2, 4]] == cci_from_array([records[i] for i in [0, 1, 2, 4]]).values).all()
+    assert results[3].sum() == 0
+    assert cci_matrix(pd.Series(records), as_frame=True).equals(pd.DataFrame(results, columns=cci_from_string('').index))
     logger.info('testing  cci module complete')
 
 def test_icd9cm():
@@ -38,6 +54,18 @@ def test_icd9cm():
     assert comorbidity_from_string('175').sum() ==1
     assert comorbidity_from_array([v.replace('x', '1') for v in ref_str_array ]).sum().sum() ==41
     assert comorbidity_from_array([v.replace('x', '1') for v in ref_str_array ]).shape[0] == ref_str_array.shape[0]
+
+    from pyelixhauser.icd9cm import _record_mask
+    for code in ['344.1', '344.6', '490.0', '505.9', '506.0', '428', 'V45.1', 'V45.2', '0490.1', '']:
+        expected = [_icd9_str_has_comorbity(code, ref_str) for ref_str in ref_str_array]
+        assert [bool((_record_mask(code) >> i) & 1) for i in range(len(expected))] == expected
+
+    from pyelixhauser.icd9cm import comorbidity_matrix
+    records = [v.replace('x', '1') for v in ref_str_array] + ['', 'V45.1 175']
+    results = comorbidity_matrix(records)
+    assert results.dtype.name == 'uint8'
+    assert (results == comorbidity_from_array(records).values).all()
+    assert comorbidity_matrix([]).shape == (0, ref_str_array.shape[0])
     logger.info('icd9cm module testing completed')
 
 def test_icd10cm():
@@ -55,6 +83,17 @@ def test_icd10cm():
     assert comorbidity_from_string( ' , '.join(ref_str_array).replace('x', '1')).sum() == _icd10cm_lookup_df.shape[0]
     assert comorbidity_from_array([v.replace('x', '1') for v in ref_str_array ]).sum().sum() ==41
     assert comorbidity_from_array([v.replace('x', '1') for v in ref_str_array ]).shape[0] == ref_str_array.shape[0]
+
+    from pyelixhauser.icd10cm import _record_mask, _icd_str_has_comorbity
+    for code in ['D51.2', 'D53.9', 'D54.0', 'I42.9', 'I43', 'Z72.1', 'F22.23', 'K70.0', 'D69.7', '']:
+        expected = [_icd_str_has_comorbity(code, ref_str) for ref_str in ref_str_array]
+        assert [bool((_record_mask(code) >> i) & 1) for i in range(len(expected))] == expected
+
+    from pyelixhauser.icd10cm import comorbidity_matrix
+    records = [v.replace('x', '1') for v in ref_str_array] + ['', 'D69.5 F22.23']
+    results = comorbidity_matrix(records, as_frame=True)
+    assert (results.dtypes == 'uint8').all()
+    assert (results.values == comorbidity_from_array(records).values).all()
     assert get_elix('') is None
     assert get_elix('123') is None
     assert get_elix('abcd') is None
@@ -79,8 +118,716 @@ def test_icd10cm_cmr_2022():
     results = comorbidity_from_array(['E11.9 Z23, Z20.828', 'J30.1', 'N18.3'])
     assert results.shape[0] == 3
     assert results.values.flatten().sum() == 4
+    logger.debug('comorbidity_from_array passed')
+
+    from pyelixhauser.icd10cm_cmr_v2022 import _lookup_comorbility, _feature_names
+    for code in ['E119', 'N183', 'A1801']:
+        expected = _idc10cm_lookup_df.loc[code, :]
+        mask, count = _lookup_comorbility(code)
+        assert count == expected.iloc[0]
+        assert [(mask >> i) & 1 for i in range(len(_feature_names) - 1)] == list(expected.iloc[1:])
+    assert _lookup_comorbility('J30.1') == (0, 0)
+    results = comorbidity_from_array(['E11.9 N18.3', '', 'J30.1'])
+    assert list(results.iloc[0, :].loc[lambda x: x == 1].index) == ['# Comorbidities', 'DIAB_UNCX', 'RENLFL_MOD']
+    assert results.iloc[1, :].isna().all()
+    assert results.iloc[2, :].sum() == 0
+
+    from pyelixhauser.icd10cm_cmr_v2022 import comorbidity_matrix
+    records = ['E11.9 Z23, Z20.828', 'J30.1', 'N18.3', 'e11.9,n18.3', '']
+    results = comorbidity_matrix(records)
+    assert results.dtype.name == 'uint8' and results.shape == (5, len(_feature_names))
+    assert (results[:4] == comorbidity_from_array(records[:4]).values).all()
+    assert results[4].sum() == 0
     logger.info('Testing icd10cm module complete')
 
+def test_long_format():
+    import pandas as pd
+    from pyelixhauser import cci, icd9cm, icd10cm, icd10cm_cmr_v2022
+    logger.debug('testing long format input ...')
+    cases = [(cci.cci_from_long, cci.cci_matrix, ['428.0', '0010', '1611', 'V45.1']),
+             (icd9cm.comorbidity_from_long, icd9cm.comorbidity_matrix, ['490.1', 'V45.1', '175', '344.1']),
+             (icd10cm.comorbidity_from_long, icd10cm.comorbidity_matrix, ['D69.5', 'F22.23', 'K70.0', 'Z72.1']),
+             (icd10cm_cmr_v2022.comorbidity_from_long, icd10cm_cmr_v2022.comorbidity_matrix, ['E11.9', 'N18.3', 'Z20.828', 'J30.1'])]
+    for from_long, matrix, codes in cases:
+        df = pd.DataFrame({'id': ['b', 'a', 'a', 'b', 'c'], 'code': codes + [None]})
+        results = from_long(df, 'id', 'code')
+        assert list(results.index) == ['a', 'b', 'c'] and results.index.name == 'id'
+        expected = matrix([' '.join(codes[1:3]), ' '.join([codes[0], codes[3]]), ''])
+        assert (results.values == expected).all()
+    logger.info('long format testing completed')
+
+
+def test_warmup():
+    import pyelixhauser
+    from pyelixhauser import cci, icd9cm, icd10cm, icd10cm_cmr_v2022
+    logger.debug('testing warmup ...')
+    pyelixhauser.warmup()
+    for module in (cci, icd9cm, icd10cm, icd10cm_cmr_v2022):
+        assert module._reference.cache_info().currsize == 1
+    try:
+        icd9cm._not_a_reference_table
+        assert False
+    except AttributeError:
+        pass
+    logger.info('warmup testing completed')
+
+
+def test_cache():
+    import os
+    import tempfile
+    import numpy as np
+    from pyelixhauser import cache, icd9cm, icd10cm, icd10cm_cmr_v2022
+    logger.debug('testing compiled artifact cache ...')
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'test.bin')
+        arrays = {'codes': np.array(['A01', 'B2'], dtype=str), 'masks': np.array([1, 2 ** 40], dtype=np.uint64), 'empty': np.zeros(0)}
+        cache.write_arrays(path, arrays, {'feature_names': ['a', 'b']})
+        loaded, meta = cache.read_arrays(path)
+        assert meta == {'feature_names': ['a', 'b']}
+        assert all((loaded[name] == array).all() and loaded[name].dtype == array.dtype for name, array in arrays.items())
+
+        paths = cache.build_cache(directory, modules=('icd9cm', 'icd10cm', 'icd10cm_cmr_v2022'))
+        assert len(paths) == 3 and all(os.path.exists(p) for p in paths)
+        # a new package or compile version never picks up an older artifact
+        name = cache.artifact_name('icd9cm', icd9cm._resource_name, icd9cm._compile_version)
+        assert os.path.basename(paths[0]) == name
+        assert cache.artifact_name('icd9cm', icd9cm._resource_name, icd9cm._compile_version + 1) != name
+        cache.__version__, version = 'test', cache.__version__
+        try:
+            assert cache.artifact_name('icd9cm', icd9cm._resource_name, icd9cm._compile_version) != name
+        finally:
+            cache.__version__ = version
+        # nor an artifact built from a different csv of the same size
+        resource_hash = cache.resource_hash
+        cache.resource_hash = lambda resource_name: resource_hash(resource_name)[::-1]
+        try:
+            assert cache.artifact_name('icd9cm', icd9cm._resource_name, icd9cm._compile_version) != name
+        finally:
+            cache.resource_hash = resource_hash
+        previous = os.environ.get('PYELIXHAUSER_CACHE_DIR')
+        os.environ['PYELIXHAUSER_CACHE_DIR'] = directory
+        try:
+            for module in (icd9cm, icd10cm, icd10cm_cmr_v2022):
+                expected = module._reference()
+                module._reference.cache_clear()
+                loaded = module._reference()
+                assert all(loaded[key] == expected[key] for key in expected if key != 'null_result')
+        finally:
+            if previous is None:
+                del os.environ['PYELIXHAUSER_CACHE_DIR']
+            else:
+                os.environ['PYELIXHAUSER_CACHE_DIR'] = previous
+    logger.info('compiled artifact cache testing completed')
+
+
+def test_parallel():
+    from concurrent.futures import ThreadPoolExecutor
+    from pyelixhauser import cci, icd9cm, icd10cm, icd10cm_cmr_v2022
+    logger.debug('testing parallel batch scoring ...')
+    cases = [(cci.cci_matrix, ['428.0', '0010 1611', '', 'V45.1']),
+             (icd9cm.comorbidity_matrix, ['490.1', 'V45.1 175', '', '344.1']),
+             (icd10cm.comorbidity_matrix, ['D69.5', 'F22.23 K70.0', '', 'Z72.1']),
+             (icd10cm_cmr_v2022.comorbidity_matrix, ['E11.9', 'N18.3 Z20.828', '', 'J30.1'])]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for matrix, records in cases:
+            records = records * 25
+            expected = matrix(records)
+            assert (matrix(records, n_jobs=2) == expected).all()
+            assert (matrix(records, executor=executor) == expected).all()
+    results = icd10cm_cmr_v2022.comorbidity_from_array(['E11.9', '', 'J30.1'] * 10, n_jobs=2)
+    assert results.equals(icd10cm_cmr_v2022.comorbidity_from_array(['E11.9', '', 'J30.1'] * 10))
+    logger.info('parallel batch scoring testing completed')
+
+def test_stream():
+    import io
+    import pandas as pd
+    from pyelixhauser import icd10cm_cmr_v2022
+    from pyelixhauser.stream import score_file, read_chunks, score_chunks
+    logger.debug('testing streaming file scoring ...')
+    records = ['E11.9', 'N18.3 Z20.828', '', 'J30.1', '0010'] * 7
+    source = io.StringIO(pd.DataFrame({'id': range(len(records)), 'codes': records}).to_csv(index=False))
+    output = io.StringIO()
+    assert score_file(source, output, 'cmr2022', column='codes', keep_columns=['id'], chunk_size=4) == len(records)
+    output.seek(0)
+    results = pd.read_csv(output)
+    expected = icd10cm_cmr_v2022.comorbidity_matrix(records, as_frame=True)
+    assert list(results.columns) == ['id'] + list(expected.columns)
+    assert (results['id'] == range(len(records))).all()
+    assert (results.drop(columns='id').to_numpy() == expected.to_numpy()).all()
+    source.seek(0)
+    chunks = list(score_chunks(read_chunks(source, ['codes'], chunk_size=10), 'cci', 'codes'))
+    assert [len(chunk) for chunk in chunks] == [10, 10, 10, 5]
+    try:
+        next(score_chunks([], 'elixhauser', 'codes'))
+        assert False
+    except ValueError:
+        pass
+    # one process pool (or the given executor) serves every chunk of a file
+    from concurrent.futures import ThreadPoolExecutor
+    from pyelixhauser import batch, icd9cm
+    from pyelixhauser.stream import score_long_chunks
+    process_pool, pools = batch.process_pool, []
+    batch.process_pool = lambda *args, **kwargs: pools.append(process_pool(*args, **kwargs)) or pools[-1]
+    try:
+        source.seek(0)
+        chunks = list(score_chunks(read_chunks(source, ['codes'], chunk_size=4), 'cmr2022', 'codes', n_jobs=2))
+    finally:
+        batch.process_pool = process_pool
+    assert len(pools) == 1 and len(chunks) == 9
+    assert (pd.concat(chunks, ignore_index=True).to_numpy() == expected.to_numpy()).all()
+    long_df = pd.DataFrame({'pid': [1, 1, 2, 2, 3, 4, 4, 5], 'code': ['490.1', '175', '', 'V45.1', '344.1', '490.1', '070.32', '175']})
+    expected_long = icd9cm.comorbidity_from_long(long_df, 'pid', 'code').reset_index()
+    chunks = [long_df.iloc[i:i + 3] for i in range(0, len(long_df), 3)]
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        for kwargs in ({'n_jobs': 2}, {'executor': executor}):
+            results = pd.concat(score_long_chunks(chunks, 'icd9cm', 'pid', 'code', **kwargs), ignore_index=True)
+            assert (results.to_numpy() == expected_long.to_numpy()).all()
+        results = pd.concat(score_chunks([pd.DataFrame({'codes': records})], 'cmr2022', 'codes', executor=executor))
+        assert (results.to_numpy() == expected.to_numpy()).all()
+    logger.info('streaming file scoring testing completed')
+
+def test_cli():
+    import os
+    import tempfile
+    import pandas as pd
+    from pyelixhauser import icd9cm
+    from pyelixhauser.cli import main
+    logger.debug('testing command line interface ...')
+    long_df = pd.DataFrame({'pid': ['1', '1', '2', '2', '3', '4', '4'],
+                            'code': ['490.1', '175', '', 'V45.1', '344.1', '490.1', '070.32']})
+    expected = icd9cm.comorbidity_from_long(long_df, 'pid', 'code')
+    with tempfile.TemporaryDirectory() as directory:
+        source, output = os.path.join(directory, 'codes.csv'), os.path.join(directory, 'flags.csv')
+        long_df.to_csv(source, index=False)
+        for chunk_size, jobs in ((1, '1'), (3, '2'), (100, '1')):
+            assert main([source, '-o', output, '-s', 'icd9cm', '--layout', 'long', '--id', 'pid', '--codes', 'code',
+                         '--chunk-size', str(chunk_size), '--jobs', jobs]) == 0
+            results = pd.read_csv(output, dtype={'pid': str}).set_index('pid')
+            assert list(results.index) == list(expected.index)
+            assert (results.to_numpy() == expected.to_numpy()).all()
+        assert main([source, '-o', output, '-s', 'cci', '--codes', 'code', '--id', 'pid']) == 0
+        assert pd.read_csv(output).shape == (len(long_df), 19)
+        assert main([source, '-o', output, '-s', 'cci', '--codes', 'code', '--id', 'pid', '--chunk-size', '2', '-j', '2']) == 0
+        assert pd.read_csv(output).shape == (len(long_df), 19)
+    logger.info('command line interface testing completed')
+
+def test_sparse():
+    import sys
+    import numpy as np
+    import pandas as pd
+    from pyelixhauser import batch, cci, icd9cm, icd10cm, icd10cm_cmr_v2022
+    from pyelixhauser.utils import sparse_masks, unpack_masks
+    logger.debug('testing sparse output ...')
+    masks = np.array([0, 5, 2 ** 38, 0, 3], dtype=np.uint64)
+    data, indices, indptr = sparse_masks(masks, 39, counts=np.array([0, 2, 1, 1, 2], dtype=np.uint8))
+    assert list(indptr) == [0, 0, 3, 5, 6, 9]
+    assert list(indices) == [0, 1, 3, 0, 39, 0, 0, 1, 2]
+    assert list(data) == [2, 1, 1, 1, 1, 1, 2, 1, 1]
+    # the data frame is the same with and without scipy
+    frames = [batch.to_sparse((data, indices, indptr), list(range(40)), as_frame=True)]
+    scipy_modules = {name: module for name, module in sys.modules.items() if name.split('.')[0] == 'scipy'}
+    sys.modules.update({name: None for name in scipy_modules}, scipy=None)
+    try:
+        frames.append(batch.to_sparse((data, indices, indptr), list(range(40)), as_frame=True))
+    finally:
+        sys.modules.pop('scipy')
+        sys.modules.update(scipy_modules)
+    expected = np.zeros((5, 40), dtype=np.uint8)
+    expected[np.repeat(np.arange(5), np.diff(indptr)), indices] = data
+    for frame in frames:
+        assert all(dtype == pd.SparseDtype(np.uint8, 0) for dtype in frame.dtypes)
+        assert (frame.sparse.to_dense().to_numpy() == expected).all()
+    cases = [(cci.cci_matrix, cci.cci_from_long, ['428.0', '0010 1611', '', 'V45.1']),
+             (icd9cm.comorbidity_matrix, icd9cm.comorbidity_from_long, ['490.1', 'V45.1 175', '', '344.1']),
+             (icd10cm.comorbidity_matrix, icd10cm.comorbidity_from_long, ['D69.5', 'F22.23 K70.0', '', 'Z72.1']),
+             (icd10cm_cmr_v2022.comorbidity_matrix, icd10cm_cmr_v2022.comorbidity_from_long,
+              ['E11.9', 'N18.3 Z20.828', '', 'J30.1'])]
+    for matrix, from_long, records in cases:
+        dense = matrix(records, as_frame=True)
+        results = matrix(records, as_frame=True, sparse=True)
+        assert list(results.columns) == list(dense.columns)
+        assert all(isinstance(dtype, pd.SparseDtype) for dtype in results.dtypes)
+        assert (results.sparse.to_dense().to_numpy() == dense.to_numpy()).all()
+        long_df = pd.DataFrame({'id': [1, 2, 2, 3], 'code': [records[0], *records[1].split(), records[3]]})
+        dense = from_long(long_df, 'id', 'code')
+        results = from_long(long_df, 'id', 'code', sparse=True)
+        assert results.index.equals(dense.index)
+        assert (results.sparse.to_dense().to_numpy() == dense.to_numpy()).all()
+        try:
+            import scipy.sparse
+            assert (matrix(records, sparse=True).toarray() == matrix(records)).all()
+        except ImportError:
+            pass
+    logger.info('sparse output testing completed')
+
+def test_bitmask():
+    import numpy as np
+    from pyelixhauser import bitmask, cci, icd9cm, icd10cm, icd10cm_cmr_v2022
+    logger.debug('testing bitmask representation ...')
+    cases = {'cci': (cci.cci_from_string, cci.cci_from_array, ['428.0', '0010 1611', '', 'V45.1']),
+             'icd9cm': (icd9cm.comorbidity_from_string, icd9cm.comorbidity_from_array, ['490.1', 'V45.1 175', '', '344.1']),
+             'icd10cm': (icd10cm.comorbidity_from_string, icd10cm.comorbidity_from_array, ['D69.5', 'F22.23 K70.0', '', 'Z72.1']),
+             'cmr2022': (icd10cm_cmr_v2022.comorbidity_from_string, icd10cm_cmr_v2022.comorbidity_from_array,
+                         ['E11.9', 'N18.3 Z20.828', 'Z23', 'J30.1'])}
+    for scheme, (from_string, from_array, records) in cases.items():
+        masks = bitmask.encode(records, scheme)
+        assert masks.dtype == np.uint64
+        results = from_array(records)
+        assert (bitmask.from_pandas(results, scheme) == masks).all()
+        assert (bitmask.to_pandas(masks, scheme).to_numpy() == results.to_numpy()).all()
+        for record, mask in zip(records, masks):
+            assert bitmask.from_pandas(from_string(record), scheme) == mask
+            assert bitmask.to_pandas(mask, scheme).index.equals(from_string(record).index)
+        assert (bitmask.popcount(masks) == [bin(int(m)).count('1') for m in masks]).all()
+        assert bitmask.union_reduce(masks) == bitmask.union(*masks)
+        assert list(bitmask.union_reduce(masks, [1, 1, 2, 2])) == [masks[0] | masks[1], masks[2] | masks[3]]
+    assert list(bitmask.union([1, 2], 4)) == [5, 6]
+    assert list(bitmask.intersection([3, 5], [1, 4])) == [1, 4]
+    assert list(bitmask.difference([3, 5], 1)) == [2, 4]
+    logger.info('bitmask representation testing completed')
+
+def test_scores():
+    import io
+    import numpy as np
+    import pandas as pd
+    from pyelixhauser import icd9cm, icd10cm_cmr_v2022, scores
+    from pyelixhauser.stream import score_chunks
+    logger.debug('testing index scores ...')
+    records = ['428.0 196.1 174.1', '401.1 250.40', '', 'V45.1']
+    # chf 7, metastatic cancer 12 (solid tumor 4 dropped by the hierarchy), renal failure 5
+    assert list(scores.score(records, 'icd9cm')) == [19, 0, 0, 5]
+    assert list(scores.score(records, 'icd9cm', hierarchy=False)) == [23, 0, 0, 5]
+    assert list(scores.score_frame(icd9cm.comorbidity_from_array(records), 'icd9cm')) == [19, 0, 0, 5]
+    weights = scores.get_weights('icd9cm').to_numpy()
+    assert list(icd9cm.comorbidity_matrix(records).astype(np.int64) @ weights) == [23, 0, 0, 5]
+    assert scores.indexes('icd10cm') == ['van_walraven']
+    long_df = pd.DataFrame({'id': [1, 1, 2, 3], 'code': ['428.0', '196.1', '401.1', '']})
+    assert scores.score_long(long_df, 'id', 'code', 'icd9cm').to_dict() == {1: 19, 2: 0, 3: 0}
+    cmr_weights = {'HF': 1.5, 'CANCER_METS': 2, 'CANCER_SOLID': 1, 'DIAB_CX': 1, 'DIAB_UNCX': 1}
+    cmr_records = ['I50.9 C78.01 C34.90', 'E11.9', 'E11.65 E11.9', '']
+    assert list(scores.score(cmr_records, 'cmr2022', weights=cmr_weights)) == [3.5, 1, 1, 0]
+    results = icd10cm_cmr_v2022.comorbidity_from_array(cmr_records)
+    assert list(scores.score_frame(results, 'cmr2022', weights=cmr_weights)) == [3.5, 1, 1, 0]
+    for bad in ({'scheme': 'cmr2022'}, {'scheme': 'icd9cm', 'weights': {'HF': 1}}):
+        try:
+            scores.score(records, **bad)
+            assert False
+        except ValueError:
+            pass
+    source = pd.DataFrame({'id': range(4), 'codes': records})
+    chunks = list(score_chunks([source.iloc[:2], source.iloc[2:]], 'icd9cm', 'codes', ['id'], score='van_walraven'))
+    assert pd.concat(chunks)['score'].tolist() == [19, 0, 0, 5]
+    logger.info('index scores testing completed')
+
+
+
+def test_poa():
+    import numpy as np
+    import pandas as pd
+    from pyelixhauser import batch, icd10cm_cmr_v2022
+    logger.debug('testing present on admission indicators ...')
+    codes = ['I50.9 I63.9 E11.9', 'I50.9, I63.9', 'I69.30 I50.9', '', 'I63.9 E11.9']
+    poa = ['NNY', 'Y', 'N N', '', 'U']
+    results = icd10cm_cmr_v2022.comorbidity_from_array(codes, poa=poa)
+    columns = ['HF', 'CBVD_POA', 'CBVD_SQLA', 'DIAB_UNCX']
+    assert results.loc[[0, 1, 2, 4], columns].to_numpy().tolist() == [[0, 0, 0, 1], [1, 1, 0, 0],
+                                                                      [0, 0, 1, 0], [0, 0, 0, 1]]
+    assert results.loc[3].isna().all()
+    assert (icd10cm_cmr_v2022.comorbidity_from_array(codes, poa=['Y'] * 5).fillna(-1)
+            == icd10cm_cmr_v2022.comorbidity_from_array(codes).fillna(-1)).all().all()
+    matrix = icd10cm_cmr_v2022.comorbidity_matrix(codes, as_frame=True, poa=poa)
+    assert (matrix.loc[[0, 1, 2, 4]] == results.loc[[0, 1, 2, 4]]).all().all()
+    # junk tokens take no indicator, the indicators pair with the valid codes
+    junk = icd10cm_cmr_v2022.comorbidity_from_array(['xx I50.9 I63.9', 'I50.9 xx I63.9'], poa=['YN', 'YN'])
+    assert junk.loc[:, ['HF', 'CBVD_POA']].to_numpy().tolist() == [[1, 0], [1, 0]]
+    masks = icd10cm_cmr_v2022.comorbidity_masks(codes, poa=poa)
+    assert list(masks) == list(icd10cm_cmr_v2022.comorbidity_masks(codes, poa=poa, n_jobs=2))
+    try:
+        icd10cm_cmr_v2022.comorbidity_matrix(codes, poa=poa[:2])
+        assert False
+    except ValueError:
+        pass
+    long_df = pd.DataFrame({'id': [1, 1, 2, 2], 'code': ['I50.9', 'E11.9', 'I50.9', 'I63.9'],
+                            'poa': ['N', 'Y', None, 'U']})
+    long_results = icd10cm_cmr_v2022.comorbidity_from_long(long_df, 'id', 'code', poa_col='poa')
+    assert long_results.loc[:, columns].to_numpy().tolist() == [[0, 0, 0, 1], [1, 0, 0, 0]]
+    assert list(batch.align_tokens(np.array([0, 2, 3]), np.array([0, 1, 3]))) == [0, -1, 1]
+    logger.info('present on admission testing completed')
+
+
+
+def test_multi():
+    import pandas as pd
+    from pyelixhauser import bitmask, icd10cm, icd10cm_cmr_v2022, multi, scores
+    logger.debug('testing multi scheme scoring ...')
+    records = pd.Series(['I50.9, E11.9 N18.3', 'e11.9|I10', '', 'V45.1 428.0;I63.9', 'I50.9'], index=list('abcde'))
+    schemes = ['cci', 'icd9cm', 'icd10cm', 'cmr2022']
+    masks = multi.comorbidity_masks(records, schemes)
+    for scheme in schemes:
+        assert list(masks[scheme]) == list(bitmask.encode(records, scheme))
+    results = multi.comorbidity_frame(records, ['icd10cm', 'cmr2022'], weights={'icd10cm': None},
+                                      prefixes={'cmr2022': 'cmr_'})
+    assert list(results.index) == list('abcde')
+    icd10_columns = ['icd10cm_' + name for name in bitmask.columns('icd10cm')]
+    assert (results.loc[:, icd10_columns].to_numpy() == icd10cm.comorbidity_matrix(records)).all()
+    cmr_columns = ['cmr_' + name for name in ['# Comorbidities'] + bitmask.columns('cmr2022')]
+    assert (results.loc[:, cmr_columns].to_numpy() == icd10cm_cmr_v2022.comorbidity_matrix(records)).all()
+    assert list(results['icd10cm_score']) == list(scores.score(records, 'icd10cm'))
+    assert 'cmr_score' not in results
+    parallel = multi.comorbidity_frame(records, ['icd10cm', 'cmr2022'], n_jobs=2)
+    assert (parallel.to_numpy() == results.drop(columns='icd10cm_score').to_numpy()).all()
+    try:
+        multi.comorbidity_frame(records, ['cmr2022'], weights={'icd9cm': None})
+        assert False
+    except ValueError:
+        pass
+    logger.info('multi scheme scoring testing completed')
+
+
+
+def test_memo():
+    from pyelixhauser import cci, icd9cm, icd10cm_cmr_v2022, memo
+    logger.debug('testing memoization ...')
+    records = ['E11.9 N18.3', 'E11.9', 'E11.9 N18.3', 'I50.9', 'I10', 'E11.9 N18.3']
+    expected = [icd10cm_cmr_v2022.get_elix(s) for s in records]
+    try:
+        memo.enable(code_size=3, record_size=2)
+        assert [icd10cm_cmr_v2022.get_elix(s) for s in records] == expected
+        stats = memo.stats()
+        assert stats['record'] == {'hits': 1, 'misses': 5, 'evictions': 3, 'size': 2, 'maxsize': 2}
+        assert stats['code']['size'] == 3 and stats['code']['evictions'] > 0
+        assert (icd10cm_cmr_v2022.comorbidity_matrix(records) == icd10cm_cmr_v2022.comorbidity_matrix(records)).all()
+        assert icd9cm.get_elix('428.0') == 'Congestive heart failure' and cci.get_cci('428.0') == cci.get_cci('428.0')
+        # the batch functions store each cold code once at the code level
+        memo.clear()
+        icd10cm_cmr_v2022.comorbidity_matrix(['I50.9 N18.3', 'I50.9'])
+        assert memo.stats()['code']['misses'] == memo.stats()['code']['size'] == 2
+        memo.clear()
+        cci.cci_matrix(['428.0 401.1', '428.0'])
+        assert memo.stats()['code']['misses'] == memo.stats()['code']['size'] == 2
+        memo.enable(code_size=1, record_size=0)
+        assert list(memo.stats()) == ['code'] and memo.stats()['code']['size'] == 1
+        memo.clear()
+        assert memo.stats()['code'] == {'hits': 0, 'misses': 0, 'evictions': 0, 'size': 0, 'maxsize': 1}
+    finally:
+        memo.disable()
+    assert memo.stats() == {}
+    logger.info('memoization testing completed')
+
+
+
+def test_tokens():
+    import numpy as np
+    import pandas as pd
+    from pyelixhauser import batch, tokens
+    logger.debug('testing tokenizers ...')
+    assert tokens.codes('E11.9 Z23, Z20.828 , J30.1, e11.9 not a code', 'icd10cm') == ['E119', 'Z23', 'Z20828', 'J301']
+    assert tokens.codes('428.0|V45.1 4280', 'icd9cm') == ['428', 'V45', '4280']
+    assert tokens.validate_icd10cm('U07.1') == 'U07.1' and tokens.validate_icd10cm('U07.2') is None
+    assert tokens.validate_icd9('v45.1') == 'V451'
+    records = pd.Series(['E11.9 Z23, Z20.828 , J30.1, e11.9', None, 'xx', 'I10 I10 I50.9'])
+    codes, offsets = tokens.codes_batch(records, 'icd10cm')
+    assert list(offsets) == [0, 4, 4, 4, 6]
+    for i, s in enumerate(records):
+        assert list(codes[offsets[i]:offsets[i + 1]]) == tokens.codes('' if s is None else s, 'icd10cm')
+    lengths = batch.reduce_max(np.ones(len(codes), dtype=np.int64), offsets)
+    assert list(lengths) == [1, 0, 0, 1]
+    try:
+        tokens.codes_batch(records, 'icd11')
+        assert False
+    except ValueError:
+        pass
+    logger.info('tokenizers testing completed')
+
+
+
+def test_batch_logging():
+    from pyelixhauser import cci, icd10cm_cmr_v2022
+    messages = []
+    handler = logging.Handler()
+    handler.emit = lambda record: messages.append(record.getMessage())
+    level = logger.level
+    logger.addHandler(handler)
+    try:
+        logger.setLevel(logging.ERROR)
+        icd10cm_cmr_v2022.comorbidity_matrix(['E11.9 N18.3', 'I10 xx', ''])
+        icd10cm_cmr_v2022.comorbidity_from_string('E11.9 N18.3 xx')
+        assert messages == []
+        logger.setLevel(logging.DEBUG)
+        icd10cm_cmr_v2022.comorbidity_matrix(['E11.9 N18.3', 'I10 xx', ''])
+        cci.cci_matrix(['428.0 V45.1', '428.0'])
+        icd10cm_cmr_v2022.comorbidity_from_string('E11.9 N18.3 xx')
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+    assert messages == [
+        'pyelixhauser.icd10cm_cmr_v2022: 3 records, 4 tokens, 4 distinct tokens resolved, 2 records with a comorbidity',
+        'pyelixhauser.cci: 2 records, 3 tokens, 2 distinct tokens resolved, 2 records with a comorbidity']
+
+
+
+def test_instrument():
+    import io
+    import json
+    import sys
+    import pandas as pd
+    from pyelixhauser import cci, icd10cm_cmr_v2022, instrument
+    from pyelixhauser.cli import main
+    logger.debug('testing instrumentation ...')
+    batches = []
+    instrument.reset()
+    icd10cm_cmr_v2022.comorbidity_matrix(['E11.9 N18.3 xx', 'I10', ''])
+    assert instrument.snapshot()['counters'] == {}
+    try:
+        instrument.enable(callback=batches.append)
+        icd10cm_cmr_v2022.comorbidity_matrix(['E11.9 N18.3 xx', 'I10', ''], as_frame=True)
+        cci.cci_from_long(pd.DataFrame({'id': [1, 1, 2], 'code': ['428.0', 'V45.1', '']}), 'id', 'code')
+    finally:
+        instrument.disable()
+    assert [batch['name'] for batch in batches] == ['pyelixhauser.icd10cm_cmr_v2022', 'pyelixhauser.cci']
+    counters = batches[0]['counters']
+    assert {key: counters[key] for key in ['records', 'tokens', 'distinct_tokens', 'valid_tokens',
+                                           'tokens_with_comorbidity', 'records_with_comorbidity']} == \
+        {'records': 3, 'tokens': 4, 'distinct_tokens': 4, 'valid_tokens': 3, 'tokens_with_comorbidity': 3,
+         'records_with_comorbidity': 2}
+    assert set(batches[0]['timers']) == {'tokenize', 'dedupe', 'resolve', 'reduce'}
+    assert set(batches[1]['timers']) == {'group', 'dedupe', 'resolve', 'reduce'}
+    totals = instrument.snapshot()
+    assert totals['counters']['records'] == 5 and totals['timers']['assemble'] > 0
+    assert set(totals['modules']) == {'pyelixhauser.icd10cm_cmr_v2022', 'pyelixhauser.cci'}
+    assert 'icd10cm_cmr_v2022' in totals['load_times']
+    instrument.reset()
+    assert instrument.snapshot()['counters'] == {}
+    stdin, stdout, stderr = sys.stdin, sys.stdout, sys.stderr
+    sys.stdin, sys.stdout, sys.stderr = io.StringIO('codes\nE11.9\nI10\n'), io.StringIO(), io.StringIO()
+    try:
+        assert main(['-s', 'cmr2022', '--stats']) == 0
+        stats = json.loads(sys.stderr.getvalue())
+    finally:
+        sys.stdin, sys.stdout, sys.stderr = stdin, stdout, stderr
+        instrument.disable()
+        instrument.reset()
+    assert stats['rows'] == 2 and stats['counters']['records'] == 2 and stats['timers']['read'] > 0
+    logger.info('instrumentation testing completed')
+
+
+
+def test_labels():
+    import numpy as np
+    import pandas as pd
+    from pyelixhauser import bitmask, cci, icd9cm, icd10cm, icd10cm_cmr_v2022
+    logger.debug('testing batch labels ...')
+    cases = [(icd9cm.get_elix, icd9cm.get_elix_array, ['428.0 401.1 196.1', '490.1', '', 'not a code', None]),
+             (icd10cm.get_elix, icd10cm.get_elix_array, ['I50.9 E11.9', 'K29.2 | K70.0', '', 'Z71.5']),
+             (icd10cm_cmr_v2022.get_elix, icd10cm_cmr_v2022.get_elix_array, ['E11.9 N18.3', 'J30.1', '', 'E11.9']),
+             (cci.get_cci, cci.get_cci_array, ['428.0 401.1', '490.1', '', '428.0'])]
+    for get_one, get_array, records in cases:
+        labels = get_array(pd.Series(records))
+        assert labels.dtype == object and len(labels) == len(records)
+        assert list(labels) == [get_one('' if s is None else s) for s in records]
+    assert icd10cm_cmr_v2022.get_elix_array(['E11.9 N18.3'])[0] == 'DIAB_UNCX | RENLFL_MOD'
+    assert icd10cm_cmr_v2022.get_elix_array([''])[0] is None
+    masks = np.array([0, 1, 3], dtype=np.uint64)
+    assert list(bitmask.labels(masks, 'cmr2022', sep=',')) == [None, 'AIDS', 'AIDS,ALCOHOL']
+    logger.info('batch labels testing completed')
+
+def test_lookback():
+    import pickle
+    import numpy as np
+    import pandas as pd
+    from pyelixhauser import lookback, bitmask, scores
+    from pyelixhauser.icd10cm_cmr_v2022 import comorbidity_from_array
+    logger.debug('testing lookback accumulator ...')
+    events = pd.DataFrame({'patient_id': [1, 2, 1, 1, 2, 3],
+                           'service_date': ['2021-01-10', '2021-02-01', '2021-06-01', '2021-12-01', '2022-03-01', '2022-03-01'],
+                           'diagnosis_codes': ['E11.9 N18.3', 'I50.9', 'E11.9', 'J45.909', '', 'not a code']})
+    state = lookback.create('cmr2022', window='365D')
+    for i in range(len(events)):
+        row = events.iloc[i:i + 1]
+        lookback.ingest(state, row['patient_id'], row['service_date'], row['diagnosis_codes'])
+        # same flags as re-scoring the history of each patient inside the window
+        now = pd.Timestamp(row['service_date'].iloc[0])
+        seen = events.iloc[:i + 1]
+        dates = pd.to_datetime(seen['service_date'])
+        inside = seen[dates > now - pd.Timedelta('365D')]
+        history = inside.groupby('patient_id')['diagnosis_codes'].agg(' '.join)
+        expected = bitmask.encode(history, 'cmr2022')
+        current = lookback.masks(state)
+        assert list(current.index) == list(seen['patient_id'].unique())
+        for patient, mask in zip(history.index, expected):
+            assert current[patient] == mask
+        assert (current.drop(history.index) == 0).all()
+    flags = lookback.flags(state)
+    assert list(flags.columns) == list(comorbidity_from_array(['E11.9']).columns)
+    assert flags.loc[1, 'LUNG_CHRONIC'] == 1 and flags.loc[1, 'DIAB_UNCX'] == 1 and flags.loc[1, 'RENLFL_MOD'] == 0
+    assert lookback.counts(state, ids=[1]).loc[1, 'DIAB_UNCX'] == 1
+    assert (lookback.score(state, weights={'HF': 15}) == scores.score_masks(lookback.masks(state).to_numpy(), 'cmr2022',
+                                                                          weights={'HF': 15})).all()
+    # snapshots are independent of the state and survive pickling
+    restored = lookback.restore(pickle.loads(pickle.dumps(lookback.snapshot(state))))
+    assert lookback.expire(state, '2023-01-01') == 2 and lookback.masks(state).sum() == 0
+    assert lookback.masks(restored, ids=[1])[1] != 0
+    lookback.ingest(restored, [4], ['2022-04-01'], ['I50.9'])
+    assert lookback.flags(restored, ids=[4]).loc[4, 'HF'] == 1
+    # numeric timestamps, events out of order
+    state = lookback.create('icd10cm', window=30, expire_on_ingest=False)
+    lookback.ingest_masks(state, ['a', 'a', 'b'], [40, 10, 20], np.array([1, 2, 4], dtype=np.uint64))
+    assert list(lookback.masks(state)) == [3, 4]
+    assert lookback.expire(state) == 1 and list(lookback.masks(state)) == [1, 4]
+    lookback.ingest_masks(state, ['c', 'd'], [25, 15], np.array([8, 16], dtype=np.uint64))
+    assert list(state['event_times']) == [15, 20, 25, 40]
+    assert lookback.expire(state, 46) == 1 and list(lookback.masks(state)) == [1, 4, 8, 0]
+    lookback.ingest_masks(state, range(100), [45] * 100, np.full(100, 2, dtype=np.uint64))
+    assert len(lookback.counts(state)) == 104 and (lookback.masks(state, ids=range(100)) == 2).all()
+    assert len(lookback.snapshot(state)['counts']) == 104
+    try:
+        lookback.ingest_masks(state, ['a'], [1, 2], [1])
+        assert False
+    except ValueError:
+        pass
+    try:
+        lookback.masks(state, ids=['z'])
+        assert False
+    except KeyError:
+        pass
+    logger.info('lookback testing completed')
+
+def test_service():
+    import asyncio
+    import json
+    from concurrent.futures import ThreadPoolExecutor
+    from pyelixhauser import service, bitmask
+    logger.debug('testing micro-batching service ...')
+    records = ['E11.9 N18.3', 'I50.9', '', 'not a code', 'J45.909, E66.9'] * 20
+
+    async def run():
+        batched = await service.start('cmr2022', max_batch=16, max_latency=0.01, max_concurrency=2)
+        results = await asyncio.gather(*[service.submit(batched, s) for s in records])
+        assert [result['mask'] for result in results] == bitmask.encode(records, 'cmr2022').tolist()
+        assert results[0]['comorbidities'] == ['DIAB_UNCX', 'RENLFL_MOD'] and results[2]['comorbidities'] == []
+        counters = service.metrics(batched)
+        assert counters['completed'] == counters['submitted'] == len(records) and counters['queue_depth'] == 0
+        assert counters['batches'] >= len(records) // 16 and counters['size_flushes'] >= 1
+        # a lone request is flushed on max_latency
+        assert (await service.submit(batched, 'I50.9'))['comorbidities'] == ['HF']
+        assert service.metrics(batched)['latency_flushes'] >= 1
+        # the local http server
+        server = await service.serve(batched, port=0)
+        reader, writer = await asyncio.open_connection(*server.sockets[0].getsockname()[:2])
+        responses = []
+        for method, path, body in [('POST', '/score', {'codes': 'I50.9'}), ('POST', '/score', {'records': ['E11.9', '']}),
+                                   ('POST', '/score', {'other': 1}), ('GET', '/metrics', None), ('GET', '/nope', None)]:
+            payload = b'' if body is None else json.dumps(body).encode()
+            writer.write(F'{method} {path} HTTP/1.1\r\nContent-Length: {len(payload)}\r\n\r\n'.encode() + payload)
+            await writer.drain()
+            head = (await reader.readuntil(b'\r\n\r\n')).decode().split('\r\n')
+            length = int([line.split(':')[1] for line in head if line.lower().startswith('content-length')][0])
+            responses.append((int(head[0].split()[1]), json.loads(await reader.readexactly(length))))
+        writer.close()
+        server.close()
+        await server.wait_closed()
+        await service.stop(batched)
+        # any executor can run the batches, e.g. a thread pool
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            threaded = await service.start('icd10cm', executor=executor, score=True)
+            assert (await service.submit(threaded, 'I50.9'))['score'] == 7
+            await service.stop(threaded)
+            # a submit that passed the closing check before stop fails instead of waiting forever
+            threaded['closing'] = False
+            try:
+                await asyncio.wait_for(service.submit(threaded, 'I50.9'), 5)
+                assert False
+            except RuntimeError:
+                pass
+        return responses
+
+    responses = asyncio.run(run())
+    assert responses[0] == (200, {'mask': 1 << 18, 'comorbidities': ['HF']})
+    assert responses[1][0] == 200 and [r['comorbidities'] for r in responses[1][1]['results']] == [['DIAB_UNCX'], []]
+    assert [status for status, _ in responses[2:]] == [400, 200, 404]
+    assert responses[3][1]['submitted'] >= len(records) + 4
+    try:
+        asyncio.run(service.start('cmr2022', max_batch=0))
+        assert False
+    except ValueError:
+        pass
+    logger.info('micro-batching service testing completed')
+
+def test_arrow():
+    import numpy as np
+    from pyelixhauser import arrow, bitmask, icd10cm_cmr_v2022
+    logger.debug('testing arrow input and output ...')
+    try:
+        import pyarrow
+    except ImportError:
+        try:
+            arrow.encode(['E11.9'], 'cmr2022')
+            assert False
+        except ImportError:
+            pass
+        return
+    records = ['E11.9 N18.3', 'I50.9', None, 'not a code', 'E11.9 N18.3', 'J45.909, E66.9']
+    expected = bitmask.encode(['' if s is None else s for s in records], 'cmr2022')
+    strings = pyarrow.array(records)
+    assert (arrow.encode(strings, 'cmr2022') == expected).all()
+    assert (arrow.encode(strings.dictionary_encode(), 'cmr2022') == expected).all()
+    # unsigned dictionary indices, as exported by polars categoricals
+    dictionary = strings.dictionary_encode()
+    unsigned = pyarrow.DictionaryArray.from_arrays(dictionary.indices.cast(pyarrow.uint32()), dictionary.dictionary)
+    assert (arrow.encode(unsigned, 'cmr2022') == expected).all()
+    assert (arrow.encode(pyarrow.chunked_array([records[:2], records[2:]]), 'cmr2022') == expected).all()
+    lists = pyarrow.array([None if s is None else s.replace(',', '').split() for s in records])
+    assert (arrow.encode(lists, 'cmr2022') == expected).all()
+    batch = arrow.comorbidity_arrow(strings, 'cmr2022')
+    matrix = icd10cm_cmr_v2022.comorbidity_matrix(['' if s is None else s for s in records], as_frame=True)
+    assert batch.schema.names == list(matrix.columns)
+    assert (np.column_stack([column.to_numpy() for column in batch.columns]) == matrix.to_numpy()).all()
+    assert arrow.comorbidity_arrow(lists, 'icd10cm', dtype='bool').column(0).type == pyarrow.bool_()
+    try:
+        import polars
+        frame = arrow.comorbidity_polars(polars.Series(records).cast(polars.Categorical), 'cmr2022')
+        assert frame.columns == list(matrix.columns) and (frame.to_numpy() == matrix.to_numpy()).all()
+    except ImportError:
+        pass
+    logger.info('arrow input and output testing completed')
+
+def test_categorical():
+    import numpy as np
+    import pandas as pd
+    from pyelixhauser import batch, cci, icd9cm, icd10cm, icd10cm_cmr_v2022
+    logger.debug('testing dictionary encoded input ...')
+    icd9_records = ['428.0 401.1', '490.1', '', None, 'V45.1 175', '428.0 401.1']
+    icd10_records = ['E11.9 N18.3', 'I50.9', '', None, 'J45.909, E66.9', 'E11.9 N18.3']
+    cases = [(cci.cci_from_array, cci.cci_from_long, icd9_records),
+             (icd9cm.comorbidity_from_array, icd9cm.comorbidity_from_long, icd9_records),
+             (icd10cm.comorbidity_from_array, icd10cm.comorbidity_from_long, icd10_records),
+             (icd10cm_cmr_v2022.comorbidity_from_array, icd10cm_cmr_v2022.comorbidity_from_long, icd10_records)]
+    for from_array, from_long, records in cases:
+        plain = pd.Series(records)
+        assert from_array(plain.astype('category')).equals(from_array(plain))
+        assert from_array(plain.astype('category').iloc[1:4]).equals(from_array(plain.iloc[1:4]))
+        long_df = pd.DataFrame({'id': [1, 1, 2, 3, 3], 'code': records[0].split() + records[1].split() + ['', None]})
+        assert from_long(long_df.assign(code=long_df['code'].astype('category')), 'id', 'code').equals(from_long(long_df, 'id', 'code'))
+    codes, values = batch.categories(pd.Categorical(['b', None, 'b'], categories=['a', 'b', 'c', 'd']))
+    assert list(values[codes]) == ['b', '', 'b'] and len(values) == 2
+    assert batch.categories(['b', 'a']) is None
+    assert (batch.take(np.array([5, 7]), np.array([1, 1, 0])) == [7, 7, 5]).all()
+    try:
+        import pyarrow
+    except ImportError:
+        pyarrow = None
+    if pyarrow is not None:
+        expected = icd10cm_cmr_v2022.comorbidity_matrix(icd10_records)
+        dictionary = pyarrow.array(icd10_records).dictionary_encode()
+        unsigned = pyarrow.DictionaryArray.from_arrays(dictionary.indices.cast(pyarrow.uint32()), dictionary.dictionary)
+        chunked = pyarrow.chunked_array([pyarrow.array(icd10_records[:3]).dictionary_encode(),
+                                         pyarrow.array(icd10_records[3:]).dictionary_encode()])
+        for array in (dictionary, unsigned, chunked, pyarrow.array(icd10_records)):
+            assert (icd10cm_cmr_v2022.comorbidity_matrix(array) == expected).all()
+        codes, values = batch.categories(chunked)
+        assert list(values[codes]) == ['' if s is None else s for s in icd10_records]
+    logger.info('dictionary encoded input testing completed')
+
 
 if __name__ == "__main__":
     logger.setLevel("DEBUG")
@@ -89,5 +836,25 @@ if __name__ == "__main__":
     test_icd9cm()
     test_icd10cm()
     test_icd10cm_cmr_2022()
+    test_long_format()
+    test_warmup()
+    test_cache()
+    test_parallel()
+    test_stream()
+    test_cli()
+    test_sparse()
+    test_bitmask()
+    test_scores()
+    test_poa()
+    test_multi()
+    test_memo()
+    test_tokens()
+    test_batch_logging()
+    test_instrument()
+    test_labels()
+    test_lookback()
+    test_service()
+    test_arrow()
+    test_categorical()
     logger.info('all tests completed for pyelixhauser package')
     print('test complete')